@@ -0,0 +1,47 @@
+from importlib import import_module
+from typing import Dict
+
+import click
+
+
+class LazyGroup(click.Group):
+    # Subcommands live in "module:command" strings and are only imported when invoked, so that light commands
+    # never pay for importing the solver or the whole pipeline
+    def __init__(self, *args, lazy_commands: Dict[str, str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
+
+    def get_command(self, ctx, name):
+        if name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[name].split(":")
+            return getattr(import_module(module_name), command_name)
+        return super().get_command(ctx, name)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group(cls=LazyGroup, lazy_commands={"build": "network.main:main"})
+def network():
+    """Build networks from GTFS feeds"""
+
+
+@cli.group(
+    cls=LazyGroup,
+    lazy_commands={
+        "run": "scenarios.cli:run",
+        "write": "scenarios.cli:write",
+        "archive": "scenarios.cli:archive",
+    },
+)
+def scenario():
+    """Schedule scenarios and write them out as GTFS"""
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import os
+import shutil
+import tempfile
+import time
+
+from .cache import get_input_digests, get_network_cache_key
+from .config import PATH_TO_NETWORKS
+from .feed_store import FeedStore, get_feed_key
+from .load import GtfsFiles
+from .mbta_gtfs import GtfsFeed
+from .relevant_stop_times import generate_relevant_stop_times
+from .snapshot import SnapshotReader, is_network_snapshot, write_network_snapshot
+
+
+def get_feed_gtfs_files(feed: GtfsFeed, store: FeedStore) -> GtfsFiles:
+    # Each stored feed gets its own directory, which also holds the tables derived from it
+    return GtfsFiles(
+        directory_path=store.get_feed_directory(feed.version),
+        zip_path=store.get_feed_path(feed.version, verify=False),
+    )
+
+
+def get_network_output_path(feed: GtfsFeed, output_directory: str = PATH_TO_NETWORKS) -> str:
+    return os.path.join(output_directory, get_feed_key(feed.version))
+
+
+def _get_built_network_key(output_path: str) -> Optional[str]:
+    if not is_network_snapshot(output_path):
+        return None
+    try:
+        return SnapshotReader(output_path).metadata.get("network_cache_key")
+    except Exception:
+        return None
+
+
+def build_feed_network(feed: GtfsFeed, store: FeedStore, output_directory: str = PATH_TO_NETWORKS) -> str:
+    from .main import get_gtfs_network
+
+    gtfs_files = get_feed_gtfs_files(feed, store)
+    if not gtfs_files.exists("relevant_stop_times"):
+        generate_relevant_stop_times(gtfs_files)
+    input_digests = get_input_digests(gtfs_files)
+    key = get_network_cache_key(input_digests=input_digests)
+    output_path = get_network_output_path(feed, output_directory)
+    if _get_built_network_key(output_path) == key:
+        print(f"Network for {feed.version} is up to date")
+        return output_path
+    network = get_gtfs_network(gtfs_files, parallel=False)
+    metadata = {
+        "feed_version": feed.version,
+        "start_date": feed.start_date.isoformat(),
+        "end_date": feed.end_date.isoformat(),
+        "network_cache_key": key,
+        "input_digests": input_digests,
+    }
+    os.makedirs(output_directory, exist_ok=True)
+    temp_path = tempfile.mkdtemp(dir=output_directory, suffix=".tmp")
+    try:
+        write_network_snapshot(network, temp_path, metadata)
+        shutil.rmtree(output_path, ignore_errors=True)
+        os.replace(temp_path, output_path)
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    return output_path
+
+
+def _build_feed_networks(feeds: List[GtfsFeed], store_path: str, output_directory: str) -> Dict[str, str]:
+    store = FeedStore(store_path)
+    output_paths = {}
+    for feed in feeds:
+        start = time.perf_counter()
+        output_paths[feed.version] = build_feed_network(feed, store, output_directory)
+        print(f"Built network for {feed.version} in {time.perf_counter() - start:.2f}s")
+    return output_paths
+
+
+def split_into_runs(items: List, count: int) -> List[List]:
+    count = max(1, min(count, len(items)))
+    size, remainder = divmod(len(items), count)
+    runs, start = [], 0
+    for index in range(count):
+        end = start + size + (1 if index < remainder else 0)
+        runs.append(items[start:end])
+        start = end
+    return runs
+
+
+def build_networks_for_feeds(
+    feeds: List[GtfsFeed],
+    store: FeedStore = None,
+    processes: int = 1,
+    output_directory: str = PATH_TO_NETWORKS,
+) -> Dict[str, str]:
+    # Adjacent feeds usually differ in only a few tables, so each process builds a run of consecutive feeds
+    # in date order. Every build after the first in a run then reuses parsed tables from the one before it
+    # and, when it can, patches that network instead of linking a new one.
+    store = store or FeedStore()
+    feeds = sorted(feeds, key=lambda feed: feed.start_date)
+    runs = split_into_runs(feeds, processes)
+    if len(runs) <= 1:
+        return _build_feed_networks(feeds, store.path, output_directory)
+    with ProcessPoolExecutor(max_workers=len(runs)) as executor:
+        futures = [executor.submit(_build_feed_networks, run, store.path, output_directory) for run in runs]
+        output_paths = {}
+        for future in futures:
+            output_paths.update(future.result())
+    return {feed.version: output_paths[feed.version] for feed in feeds}
@@ -1,8 +1,15 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable
+import os
+import time
+
+import numpy as np
+
 from .load import (
-    load_relevant_stop_times,
+    GtfsFiles,
     load_calendar,
     load_calendar_attributes,
-    load_shapes,
+    load_shape_columns,
     load_stops,
     load_transfers,
     load_trips,
@@ -10,7 +17,6 @@ from .load import (
     load_route_patterns,
 )
 from .models import (
-    StopTime,
     Station,
     Stop,
     LocationType,
@@ -21,7 +27,9 @@ from .models import (
     Route,
     RoutePattern,
 )
-from .time import time_from_string, DAYS_OF_WEEK
+from .shapes import create_shapes_by_id
+from .stop_times import build_stop_times_table, load_stop_time_columns
+from .time import DAYS_OF_WEEK
 
 
 def index_by(items, id_getter):
@@ -34,21 +42,41 @@ def index_by(items, id_getter):
     return res
 
 
-def get_shapes_by_id(shapes):
+def group_by(items, key_getter):
     res = {}
-    for shape in shapes:
-        shape_id = shape["shape_id"]
-        if not res.get(shape_id):
-            res[shape_id] = []
-        lat = float(shape["shape_pt_lat"])
-        lon = float(shape["shape_pt_lon"])
-        seq = int(shape["shape_pt_sequence"])
-        res[shape_id].append((lat, lon, seq))
-    for shape_id in res:
-        res[shape_id] = [(lat, lon) for (lat, lon, _) in sorted(res[shape_id], key=lambda entry: entry[2])]
+    if isinstance(key_getter, str):
+        key_getter_as_str = key_getter
+        key_getter = lambda dict: dict[key_getter_as_str]
+    for item in items:
+        res.setdefault(key_getter(item), []).append(item)
     return res
 
 
+def load_shapes_by_id(gtfs_files: GtfsFiles = None):
+    return get_shapes_by_id(load_shape_columns(gtfs_files))
+
+
+def get_shapes_by_id(shape_columns):
+    ids = np.array(shape_columns["shape_id"])
+    # Number shapes in order of first appearance, which is the order they have always been keyed in
+    unique_ids, first_rows, id_codes = np.unique(ids, return_index=True, return_inverse=True)
+    appearance_order = np.argsort(first_rows, kind="stable")
+    rank = np.empty(len(unique_ids), dtype=np.int64)
+    rank[appearance_order] = np.arange(len(unique_ids))
+    shape_code = rank[id_codes.reshape(-1)]
+    sequence = np.array(shape_columns["shape_pt_sequence"], dtype=np.int64)
+    rows = np.lexsort((sequence, shape_code))
+    points = np.column_stack(
+        (
+            np.array(shape_columns["shape_pt_lat"], dtype=np.float64)[rows],
+            np.array(shape_columns["shape_pt_lon"], dtype=np.float64)[rows],
+        )
+    )
+    offsets = np.zeros(len(unique_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(shape_code, minlength=len(unique_ids)), out=offsets[1:])
+    return create_shapes_by_id(unique_ids[appearance_order].tolist(), points, offsets)
+
+
 def link_services(calendar_dicts, calendar_attribute_dicts):
     services = []
     calendar_attributes_by_id = index_by(calendar_attribute_dicts, "service_id")
@@ -94,13 +122,20 @@ def link_station(station_dict):
     return Station(**get_station_stop_args_from_dict(station_dict))
 
 
+def get_regular_service_for_trip(trip_dict, services_by_id):
+    matching_service = services_by_id.get(trip_dict["service_id"])
+    # Throw out special services with no regularly scheduled service days
+    if matching_service and len(matching_service.days) > 0:
+        return matching_service
+    return None
+
+
 def link_trips(trip_dicts, services_by_id, shapes_by_id):
     res = {}
     for trip_dict in trip_dicts:
         trip_id = trip_dict["trip_id"]
-        matching_service = services_by_id.get(trip_dict["service_id"])
-        # Throw out special services with no regularly scheduled service days
-        if matching_service and len(matching_service.days) > 0:
+        matching_service = get_regular_service_for_trip(trip_dict, services_by_id)
+        if matching_service:
             trip = Trip(
                 id=trip_dict["trip_id"],
                 service=matching_service,
@@ -114,64 +149,47 @@ def link_trips(trip_dicts, services_by_id, shapes_by_id):
     return res
 
 
-def link_stop_times(stop, stop_time_dicts, trips_by_id):
-    stop_times = []
-    added = 0
-    for stop_time_dict in stop_time_dicts:
-        if stop_time_dict["stop_id"] == stop.id:
-            trip = trips_by_id.get(stop_time_dict["trip_id"])
-            if trip:
-                stop_time = StopTime(
-                    stop=stop,
-                    trip=trip,
-                    time=time_from_string(stop_time_dict["departure_time"]),
-                )
-                added += 1
-                stop_times.append(stop_time)
-                trip.add_stop_time(stop_time)
-    stop.set_stop_times(sorted(stop_times))
+def link_stop_times(stop_time_columns, stops, trips_by_id):
+    trips = list(trips_by_id.values())
+    stop_times = build_stop_times_table(stop_time_columns, stops, trips)
+    for index, stop in enumerate(stops):
+        stop.set_stop_times(stop_times.get_stop_times_for_stop(index))
+    for index, trip in enumerate(trips):
+        trip.set_stop_times(stop_times.get_stop_times_for_trip(index))
+    return stop_times
 
 
-def link_child_stops(station, stop_dicts):
-    for stop_dict in stop_dicts:
-        if stop_dict["parent_station"] == station.id and stop_dict["location_type"] == LocationType.STOP:
-            stop = Stop(parent_station=station, **get_station_stop_args_from_dict(stop_dict))
-            yield stop
-            if len(stop.stop_times) > 0:
-                station.add_child_stop(stop)
-
-
-def link_transfers(stop, all_stops, transfer_dicts):
-    for transfer_dict in transfer_dicts:
-        if transfer_dict["from_stop_id"] == stop.id:
-            to_stop = next(
-                (other_stop for other_stop in all_stops if other_stop.id == transfer_dict["to_stop_id"]),
-                None,
-            )
-            if to_stop:
-                transfer = Transfer(
-                    from_stop=stop,
-                    to_stop=to_stop,
-                    min_walk_time=int(transfer_dict["min_walk_time"] or 0),
-                    min_wheelchair_time=int(transfer_dict["min_wheelchair_time"] or 0),
-                    min_transfer_time=int(transfer_dict["min_transfer_time"] or 0),
-                    suggested_buffer_time=int(transfer_dict["suggested_buffer_time"] or 0),
-                    wheelchair_transfer=transfer_dict["wheelchair_transfer"],
-                )
-                stop.add_transfer(transfer)
+def link_child_stops(station, child_stop_dicts):
+    for stop_dict in child_stop_dicts:
+        if stop_dict["location_type"] == LocationType.STOP:
+            yield Stop(parent_station=station, **get_station_stop_args_from_dict(stop_dict))
+
+
+def get_transfer_args_from_dict(transfer_dict):
+    return {
+        "min_walk_time": int(transfer_dict["min_walk_time"] or 0),
+        "min_wheelchair_time": int(transfer_dict["min_wheelchair_time"] or 0),
+        "min_transfer_time": int(transfer_dict["min_transfer_time"] or 0),
+        "suggested_buffer_time": int(transfer_dict["suggested_buffer_time"] or 0),
+        "wheelchair_transfer": transfer_dict["wheelchair_transfer"],
+    }
+
+
+def link_transfers(stop, stops_by_id, transfer_dicts_for_stop):
+    for transfer_dict in transfer_dicts_for_stop:
+        to_stop = stops_by_id.get(transfer_dict["to_stop_id"])
+        if to_stop:
+            transfer = Transfer(from_stop=stop, to_stop=to_stop, **get_transfer_args_from_dict(transfer_dict))
+            stop.add_transfer(transfer)
 
 
 def link_routes(route_dicts, route_pattern_dicts):
     routes = []
+    route_pattern_dicts_by_route_id = group_by(route_pattern_dicts, "route_id")
     for route_dict in route_dicts:
         route_id = route_dict["route_id"]
         route = Route(id=route_id, long_name=route_dict["route_long_name"])
-        matching_route_patterns = [
-            route_pattern_dict
-            for route_pattern_dict in route_pattern_dicts
-            if route_pattern_dict["route_id"] == route_id
-        ]
-        for route_pattern_dict in matching_route_patterns:
+        for route_pattern_dict in route_pattern_dicts_by_route_id.get(route_id, []):
             route.route_patterns.append(
                 RoutePattern(
                     id=route_pattern_dict["route_pattern_id"],
@@ -185,42 +203,97 @@ def link_routes(route_dicts, route_pattern_dicts):
     return index_by(routes, lambda r: r.id)
 
 
-def ensure_trips_are_sorted(trips_by_id):
-    for trip in trips_by_id.values():
-        trip.stop_times = list(sorted(trip.stop_times, key=lambda st: st.time))
+# These are small enough that reading them is mostly waiting on I/O
+THREADED_TABLE_LOADERS = {
+    "calendar": load_calendar,
+    "calendar_attributes": load_calendar_attributes,
+    "stops": load_stops,
+    "transfers": load_transfers,
+    "trips": load_trips,
+    "routes": load_routes,
+    "route_patterns": load_route_patterns,
+}
+
+# These dominate load time, so they are parsed in their own processes
+PROCESS_TABLE_LOADERS = {
+    "relevant_stop_times": load_stop_time_columns,
+    "shapes": load_shapes_by_id,
+}
 
 
-def build_network_from_gtfs():
+def _timed_load(loader, gtfs_files: GtfsFiles):
+    start = time.perf_counter()
+    result = loader(gtfs_files)
+    return result, time.perf_counter() - start
+
+
+def load_gtfs_tables(gtfs_files: GtfsFiles, parallel: bool = None, names: Iterable[str] = None):
+    start = time.perf_counter()
+    if parallel is None:
+        parallel = (os.cpu_count() or 1) > 1
+    loaders = {**PROCESS_TABLE_LOADERS, **THREADED_TABLE_LOADERS}
+    if names is not None:
+        loaders = {name: loader for name, loader in loaders.items() if name in names}
+    if parallel:
+        with (
+            ProcessPoolExecutor(max_workers=len(PROCESS_TABLE_LOADERS)) as processes,
+            ThreadPoolExecutor(max_workers=len(THREADED_TABLE_LOADERS)) as threads,
+        ):
+            futures = {
+                name: (processes if name in PROCESS_TABLE_LOADERS else threads).submit(_timed_load, loader, gtfs_files)
+                for name, loader in loaders.items()
+            }
+            results = {name: future.result() for name, future in futures.items()}
+    else:
+        results = {name: _timed_load(loader, gtfs_files) for name, loader in loaders.items()}
+    for name, (_, elapsed) in results.items():
+        print(f"Loaded {name} in {elapsed:.2f}s")
+    print(f"Loaded all GTFS tables in {time.perf_counter() - start:.2f}s")
+    return {name: result for name, (result, _) in results.items()}
+
+
+def build_network_from_gtfs(gtfs_files: GtfsFiles = None, parallel: bool = None):
+    gtfs_files = gtfs_files or GtfsFiles()
     # Do the loading...
-    calendar_dicts = load_calendar()
-    calendar_attribute_dicts = load_calendar_attributes()
-    stop_dicts = load_stops()
-    stop_time_dicts = load_relevant_stop_times()
-    transfer_dicts = load_transfers()
-    trip_dicts = load_trips()
-    route_dicts = load_routes()
-    route_pattern_dicts = load_route_patterns()
-    shapes = load_shapes()
+    return build_network_from_tables(load_gtfs_tables(gtfs_files, parallel=parallel))
+
+
+def build_network_from_tables(tables):
+    calendar_dicts = tables["calendar"]
+    calendar_attribute_dicts = tables["calendar_attributes"]
+    stop_dicts = tables["stops"]
+    stop_time_columns = tables["relevant_stop_times"]
+    transfer_dicts = tables["transfers"]
+    trip_dicts = tables["trips"]
+    route_dicts = tables["routes"]
+    route_pattern_dicts = tables["route_patterns"]
+    shapes_by_id = tables["shapes"]
     # Now do the linking...
     station_dicts = get_stations_from_stops(stop_dicts)
     services_by_id = link_services(calendar_dicts, calendar_attribute_dicts)
     routes_by_id = link_routes(route_dicts, route_pattern_dicts)
-    shapes_by_id = get_shapes_by_id(shapes)
     trips_by_id = link_trips(trip_dicts, services_by_id, shapes_by_id)
     stations = [link_station(d) for d in station_dicts]
+    stop_dicts_by_parent_station = group_by(stop_dicts, "parent_station")
+    transfer_dicts_by_from_stop_id = group_by(transfer_dicts, "from_stop_id")
     all_stops = []
     for station in stations:
-        for child_stop in link_child_stops(station, stop_dicts):
-            all_stops.append(child_stop)
-            link_stop_times(child_stop, stop_time_dicts, trips_by_id)
+        all_stops += link_child_stops(station, stop_dicts_by_parent_station.get(station.id, []))
+    stop_times = link_stop_times(stop_time_columns, all_stops, trips_by_id)
+    for stop in all_stops:
+        if len(stop.stop_times) > 0:
+            stop.parent_station.add_child_stop(stop)
+    stops_by_id = {}
+    for stop in all_stops:
+        stops_by_id.setdefault(stop.id, stop)
     for station in stations:
         for stop in station.child_stops:
-            link_transfers(stop, all_stops, transfer_dicts)
-    ensure_trips_are_sorted(trips_by_id)
+            link_transfers(stop, stops_by_id, transfer_dicts_by_from_stop_id.get(stop.id, []))
     return Network(
         stations_by_id=index_by(stations, lambda st: st.id),
         trips_by_id=trips_by_id,
         shapes_by_id=shapes_by_id,
         routes_by_id=routes_by_id,
         services_by_id=services_by_id,
+        stop_times=stop_times,
     )
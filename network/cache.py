@@ -0,0 +1,255 @@
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from .build import build_network_from_tables, load_gtfs_tables
+from .config import PATH_TO_NETWORK_CACHE, MAX_CACHED_NETWORKS
+from .incremental import IncompatibleChange, can_patch_network_snapshot, get_patch_input_tables, patch_network_snapshot
+from .load import GtfsFiles
+from .models import Network
+from .snapshot import SnapshotReader, is_network_snapshot, read_network_snapshot, write_network_snapshot
+
+NETWORK_INPUT_FILES = (
+    "calendar",
+    "calendar_attributes",
+    "stops",
+    "relevant_stop_times",
+    "transfers",
+    "trips",
+    "routes",
+    "route_patterns",
+    "shapes",
+)
+
+
+def _hash_file(digest, file_path: str):
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+
+def get_code_version() -> str:
+    digest = hashlib.sha256()
+    for file_path in sorted(glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        digest.update(os.path.basename(file_path).encode())
+        _hash_file(digest, file_path)
+    return digest.hexdigest()
+
+
+def get_input_digests(gtfs_files: GtfsFiles = None) -> Dict[str, str]:
+    gtfs_files = gtfs_files or GtfsFiles()
+    return {file_name: gtfs_files.get_digest(file_name) for file_name in NETWORK_INPUT_FILES}
+
+
+def get_input_fingerprint(gtfs_files: GtfsFiles = None, input_digests: Dict[str, str] = None) -> str:
+    input_digests = input_digests or get_input_digests(gtfs_files)
+    digest = hashlib.sha256()
+    for file_name in NETWORK_INPUT_FILES:
+        digest.update(f"{file_name}:{input_digests[file_name]}".encode())
+    return digest.hexdigest()
+
+
+def get_network_cache_key(gtfs_files: GtfsFiles = None, input_digests: Dict[str, str] = None) -> str:
+    digest = hashlib.sha256()
+    digest.update(get_code_version().encode())
+    digest.update(get_input_fingerprint(gtfs_files, input_digests).encode())
+    return digest.hexdigest()[:16]
+
+
+# Batch builds share the cache between processes, so any entry can disappear under us
+def _get_mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _get_cache_entry_path(key: str) -> str:
+    return os.path.join(PATH_TO_NETWORK_CACHE, key)
+
+
+def _get_table_cache_path(file_name: str, input_digest: str) -> str:
+    digest = hashlib.sha256(f"{get_code_version()}:{file_name}:{input_digest}".encode())
+    return os.path.join(PATH_TO_NETWORK_CACHE, "tables", f"{file_name}-{digest.hexdigest()[:16]}.pickle")
+
+
+def _load_cached_table(file_name: str, input_digest: str):
+    table_path = _get_table_cache_path(file_name, input_digest)
+    try:
+        with open(table_path, "rb") as file:
+            table = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Discarding unreadable cached table {table_path}: {e!r}")
+        os.remove(table_path)
+        return None
+    _touch(table_path)
+    return table
+
+
+def _store_cached_table(file_name: str, input_digest: str, table):
+    table_path = _get_table_cache_path(file_name, input_digest)
+    os.makedirs(os.path.dirname(table_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(table_path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        pickle.dump(table, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, table_path)
+    # Keep as many parses of each table as there are cached networks to go with them
+    table_paths = sorted(
+        glob(os.path.join(os.path.dirname(table_path), f"{file_name}-*.pickle")), key=_get_mtime, reverse=True
+    )
+    for stale_path in table_paths[MAX_CACHED_NETWORKS:]:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def load_gtfs_tables_with_cache(
+    input_digests: Dict[str, str],
+    gtfs_files: GtfsFiles = None,
+    names: Iterable[str] = NETWORK_INPUT_FILES,
+    parallel: bool = None,
+) -> Dict:
+    # Tables whose input is unchanged since some earlier build are read back instead of parsed again
+    gtfs_files = gtfs_files or GtfsFiles()
+    tables = {}
+    for file_name in names:
+        table = _load_cached_table(file_name, input_digests[file_name])
+        if table is not None:
+            tables[file_name] = table
+    missing = [file_name for file_name in names if file_name not in tables]
+    if tables:
+        print(f"Reusing parsed {', '.join(tables)}")
+    if missing:
+        parsed_tables = load_gtfs_tables(gtfs_files, parallel=parallel, names=missing)
+        for file_name, table in parsed_tables.items():
+            _store_cached_table(file_name, input_digests[file_name], table)
+        tables.update(parsed_tables)
+    return tables
+
+
+def _get_cache_entry_paths():
+    return [path for path in glob(os.path.join(PATH_TO_NETWORK_CACHE, "*")) if is_network_snapshot(path)]
+
+
+def load_cached_network(key: str) -> Optional[Network]:
+    entry_path = _get_cache_entry_path(key)
+    if not is_network_snapshot(entry_path):
+        return None
+    try:
+        network = read_network_snapshot(entry_path)
+    except Exception as e:
+        print(f"Discarding unreadable cached network {entry_path}: {e!r}")
+        shutil.rmtree(entry_path, ignore_errors=True)
+        return None
+    # Bump the mtime so that eviction treats this entry as recently used
+    _touch(entry_path)
+    return network
+
+
+def evict_cached_networks(max_entries: int = MAX_CACHED_NETWORKS):
+    entry_paths = _get_cache_entry_paths()
+    entry_paths.sort(key=_get_mtime, reverse=True)
+    for entry_path in entry_paths[max_entries:]:
+        print(f"Evicting cached network {entry_path}")
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def _get_cache_metadata(input_digests: Dict[str, str] = None) -> Dict:
+    return {"code_version": get_code_version(), "input_digests": input_digests or {}}
+
+
+def _write_cache_entry(key: str, write):
+    os.makedirs(PATH_TO_NETWORK_CACHE, exist_ok=True)
+    entry_path = _get_cache_entry_path(key)
+    # Write to a temporary directory first so that a crash never leaves a partial entry behind
+    temp_path = tempfile.mkdtemp(dir=PATH_TO_NETWORK_CACHE, suffix=".tmp")
+    try:
+        write(temp_path)
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.replace(temp_path, entry_path)
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    evict_cached_networks()
+
+
+def store_cached_network(key: str, network: Network, input_digests: Dict[str, str] = None):
+    metadata = _get_cache_metadata(input_digests)
+    _write_cache_entry(key, lambda temp_path: write_network_snapshot(network, temp_path, metadata))
+
+
+def find_closest_cached_network(input_digests: Dict[str, str]) -> Optional[Tuple[str, List[str]]]:
+    # The best base for an incremental rebuild is an entry built by this code that can be patched into this
+    # network, and after that the one with the fewest changed inputs
+    code_version = get_code_version()
+    candidates = []
+    for entry_path in _get_cache_entry_paths():
+        try:
+            metadata = SnapshotReader(entry_path).metadata
+        except Exception:
+            continue
+        if metadata.get("code_version") != code_version:
+            continue
+        entry_digests = metadata.get("input_digests", {})
+        changed = [name for name in NETWORK_INPUT_FILES if entry_digests.get(name) != input_digests[name]]
+        candidates.append(
+            (not can_patch_network_snapshot(changed), len(changed), -_get_mtime(entry_path), entry_path, changed)
+        )
+    if not candidates:
+        return None
+    *_, entry_path, changed = min(candidates)
+    return entry_path, changed
+
+
+def update_cached_network(
+    key: str,
+    input_digests: Dict[str, str],
+    gtfs_files: GtfsFiles = None,
+    parallel: bool = None,
+) -> Optional[Network]:
+    closest = find_closest_cached_network(input_digests)
+    if closest is None or not can_patch_network_snapshot(closest[1]):
+        return None
+    base_path, changed = closest
+    start = time.perf_counter()
+    tables = load_gtfs_tables_with_cache(
+        input_digests, gtfs_files, names=get_patch_input_tables(changed), parallel=parallel
+    )
+    metadata = _get_cache_metadata(input_digests)
+    try:
+        _write_cache_entry(
+            key, lambda temp_path: patch_network_snapshot(base_path, changed, tables, temp_path, metadata)
+        )
+    except (IncompatibleChange, OSError) as e:
+        print(f"Can't patch cached network {os.path.basename(base_path)}: {e}")
+        return None
+    print(
+        f"Patched cached network {os.path.basename(base_path)} for changes to {', '.join(changed)} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return load_cached_network(key)
+
+
+def build_and_cache_network(
+    key: str,
+    input_digests: Dict[str, str],
+    gtfs_files: GtfsFiles = None,
+    parallel: bool = None,
+) -> Network:
+    network = build_network_from_tables(load_gtfs_tables_with_cache(input_digests, gtfs_files, parallel=parallel))
+    store_cached_network(key, network, input_digests)
+    return network
@@ -5,4 +5,8 @@ GTFS_ARCHIVE_URL = "https://cdn.mbta.com/archive/archived_feeds.txt"
 
 PATH_TO_DATA = join(dirname(__file__), "..", "data")
 PATH_TO_GTFS_DATA = join(PATH_TO_DATA, "gtfs-present")
-PATH_TO_PICKLED_NETWORK = join(PATH_TO_DATA, "network.pickle")
+PATH_TO_GTFS_ZIP = join(PATH_TO_DATA, "gtfs-present.zip")
+PATH_TO_FEED_STORE = join(PATH_TO_DATA, "feeds")
+PATH_TO_NETWORK_CACHE = join(PATH_TO_DATA, "network-cache")
+MAX_CACHED_NETWORKS = 4
+PATH_TO_NETWORKS = join(PATH_TO_DATA, "networks")
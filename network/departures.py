@@ -0,0 +1,114 @@
+from collections import defaultdict
+from typing import Dict, List, Sequence, Union
+import datetime
+
+import numpy as np
+
+from .models import Network, Service, Station, Stop, StopTime
+from .stop_times import StopTimeRowsView, StopTimesTable, StopTimesView
+from .time import to_seconds
+
+Time = Union[int, datetime.timedelta]
+
+
+class Departures(object):
+    def __init__(self, stop_times: Sequence[StopTime], times: np.ndarray, service_ids: np.ndarray):
+        # All three are aligned and sorted by time, so every query is a binary search over times
+        self.stop_times = stop_times
+        self.times = times
+        self.service_ids = service_ids
+        self.departures_by_service_id: Dict[str, "Departures"] = {}
+
+    @classmethod
+    def from_table_rows(cls, table: StopTimesTable, rows: np.ndarray):
+        rows = rows[np.argsort(table.time[rows], kind="stable")]
+        return cls(
+            stop_times=StopTimeRowsView(table, rows),
+            times=table.time[rows],
+            service_ids=table.trip_service_ids[table.trip_index[rows]],
+        )
+
+    @classmethod
+    def from_stop_times(cls, stop_times: Sequence[StopTime]):
+        stop_times = sorted(stop_times, key=lambda stop_time: stop_time.time)
+        return cls(
+            stop_times=stop_times,
+            times=np.array([stop_time.time for stop_time in stop_times], dtype=np.int32),
+            service_ids=np.array([stop_time.trip.service.id for stop_time in stop_times], dtype=object),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def _take(self, indices: np.ndarray) -> "Departures":
+        if isinstance(self.stop_times, StopTimeRowsView):
+            stop_times = StopTimeRowsView(self.stop_times.table, self.stop_times.rows[indices])
+        else:
+            stop_times = [self.stop_times[index] for index in indices]
+        return Departures(stop_times, self.times[indices], self.service_ids[indices])
+
+    def for_service(self, service: Service = None) -> "Departures":
+        if service is None:
+            return self
+        departures = self.departures_by_service_id.get(service.id)
+        if departures is None:
+            departures = self._take(np.flatnonzero(self.service_ids == service.id))
+            self.departures_by_service_id[service.id] = departures
+        return departures
+
+    def _get_range(self, start: Time = None, end: Time = None) -> slice:
+        lower = 0 if start is None else int(np.searchsorted(self.times, to_seconds(start), side="left"))
+        upper = len(self.times) if end is None else int(np.searchsorted(self.times, to_seconds(end), side="left"))
+        return slice(lower, max(lower, upper))
+
+    def get_times(self, service: Service = None, start: Time = None, end: Time = None) -> np.ndarray:
+        departures = self.for_service(service)
+        return departures.times[departures._get_range(start, end)]
+
+    def get_next_departures(self, time: Time, count: int = 1, service: Service = None) -> List[StopTime]:
+        departures = self.for_service(service)
+        lower = departures._get_range(start=time).start
+        return list(departures.stop_times[lower : lower + count])
+
+    def get_departures_between(self, start: Time, end: Time, service: Service = None) -> List[StopTime]:
+        departures = self.for_service(service)
+        return list(departures.stop_times[departures._get_range(start, end)])
+
+    def get_headways(self, service: Service = None, start: Time = None, end: Time = None) -> np.ndarray:
+        return np.diff(self.get_times(service, start, end))
+
+
+class DepartureIndex(object):
+    def __init__(self, network: Network):
+        self.network = network
+        self.departures_by_stop_id: Dict[str, Departures] = {}
+        self.departures_by_station_id: Dict[str, Departures] = {}
+        self.stop_times_by_stop_id: Dict[str, List[StopTime]] = None
+
+    def _get_stop_times_from_trips(self, stop: Stop) -> List[StopTime]:
+        # Synthetic networks only link stop times to their trips, so group them by stop once
+        if self.stop_times_by_stop_id is None:
+            self.stop_times_by_stop_id = defaultdict(list)
+            for trip in self.network.trips_by_id.values():
+                for stop_time in trip.stop_times:
+                    self.stop_times_by_stop_id[stop_time.stop.id].append(stop_time)
+        return self.stop_times_by_stop_id.get(stop.id, [])
+
+    def _create_departures(self, stops: List[Stop]) -> Departures:
+        views = [stop.stop_times for stop in stops]
+        if views and all(isinstance(view, StopTimesView) for view in views):
+            table = views[0].table
+            return Departures.from_table_rows(table, np.concatenate([view.rows for view in views]))
+        return Departures.from_stop_times([st for stop in stops for st in self._get_stop_times_from_trips(stop)])
+
+    def get_departures_for_stop(self, stop: Stop) -> Departures:
+        departures = self.departures_by_stop_id.get(stop.id)
+        if departures is None:
+            departures = self.departures_by_stop_id[stop.id] = self._create_departures([stop])
+        return departures
+
+    def get_departures_for_station(self, station: Station) -> Departures:
+        departures = self.departures_by_station_id.get(station.id)
+        if departures is None:
+            departures = self.departures_by_station_id[station.id] = self._create_departures(station.child_stops)
+        return departures
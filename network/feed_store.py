@@ -0,0 +1,81 @@
+from typing import Optional
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from network.config import PATH_TO_FEED_STORE
+
+FEED_ZIP_NAME = "feed.zip"
+FEED_METADATA_NAME = "feed.json"
+ARCHIVE_INDEX_NAME = "archived_feeds.txt"
+
+
+def get_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_feed_key(version: str) -> str:
+    # Feed versions look like "Winter 2025, 2025-01-09T20:05:58+00:00, version D", so keep them readable
+    # but path-safe, and add a hash so that versions which sanitize the same way stay distinct
+    readable = re.sub(r"[^A-Za-z0-9._-]+", "_", version).strip("_")[:80]
+    return f"{readable}-{hashlib.sha256(version.encode()).hexdigest()[:8]}"
+
+
+class FeedStore(object):
+    def __init__(self, path: str = PATH_TO_FEED_STORE):
+        self.path = path
+
+    @property
+    def archive_index_path(self) -> str:
+        return os.path.join(self.path, ARCHIVE_INDEX_NAME)
+
+    def read_archive_index(self) -> Optional[str]:
+        if not os.path.exists(self.archive_index_path):
+            return None
+        with open(self.archive_index_path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    def write_archive_index(self, text: str):
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = self.archive_index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, self.archive_index_path)
+
+    def get_feed_directory(self, version: str) -> str:
+        return os.path.join(self.path, get_feed_key(version))
+
+    def get_metadata(self, version: str) -> Optional[dict]:
+        metadata_path = os.path.join(self.get_feed_directory(version), FEED_METADATA_NAME)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def get_feed_path(self, version: str, verify: bool = True) -> Optional[str]:
+        metadata = self.get_metadata(version)
+        zip_path = os.path.join(self.get_feed_directory(version), FEED_ZIP_NAME)
+        if not metadata or not os.path.exists(zip_path):
+            return None
+        if verify and get_sha256(zip_path) != metadata["sha256"]:
+            print(f"Checksum mismatch for stored feed {version}, discarding it")
+            shutil.rmtree(self.get_feed_directory(version), ignore_errors=True)
+            return None
+        return zip_path
+
+    def add_feed(self, version: str, url: str, downloaded_zip_path: str) -> str:
+        feed_directory = self.get_feed_directory(version)
+        os.makedirs(feed_directory, exist_ok=True)
+        zip_path = os.path.join(feed_directory, FEED_ZIP_NAME)
+        os.replace(downloaded_zip_path, zip_path)
+        metadata = {"version": version, "url": url, "sha256": get_sha256(zip_path)}
+        # Metadata is written last, so a feed without it is treated as absent
+        with open(os.path.join(feed_directory, FEED_METADATA_NAME), "w", encoding="utf-8") as file:
+            json.dump(metadata, file, indent=2)
+        return zip_path
@@ -0,0 +1,125 @@
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+from .build import (
+    get_regular_service_for_trip,
+    get_transfer_args_from_dict,
+    group_by,
+    link_routes,
+    link_services,
+)
+from .snapshot import (
+    SnapshotReader,
+    SnapshotWriter,
+    write_route_arrays,
+    write_service_arrays,
+    write_shape_arrays,
+    write_transfer_arrays,
+)
+
+
+class IncompatibleChange(Exception):
+    pass
+
+
+def patch_transfers(reader: SnapshotReader, writer: SnapshotWriter, tables: Dict):
+    stop_ids = reader.strings("stops.id")
+    # Transfers can point at any stop, and the first stop with a given id wins, as in build_network_from_tables
+    stop_indices_by_id = {}
+    for index, stop_id in enumerate(stop_ids):
+        stop_indices_by_id.setdefault(stop_id, index)
+    transfer_dicts_by_from_stop_id = group_by(tables["transfers"], "from_stop_id")
+    transfer_groups = [[] for _ in range(len(stop_ids))]
+    # Only stops that are children of a station (those with stop times) get transfers
+    for stop_index in reader.array("stations.child_stop_index"):
+        transfer_groups[stop_index] = [
+            {
+                "to_stop_index": stop_indices_by_id[transfer_dict["to_stop_id"]],
+                **get_transfer_args_from_dict(transfer_dict),
+            }
+            for transfer_dict in transfer_dicts_by_from_stop_id.get(stop_ids[stop_index], [])
+            if transfer_dict["to_stop_id"] in stop_indices_by_id
+        ]
+    write_transfer_arrays(writer, transfer_groups)
+
+
+def patch_services(reader: SnapshotReader, writer: SnapshotWriter, tables: Dict):
+    services_by_id = link_services(tables["calendar"], tables["calendar_attributes"])
+    service_for_trip_id = {}
+    for trip_dict in tables["trips"]:
+        service = get_regular_service_for_trip(trip_dict, services_by_id)
+        if service:
+            service_for_trip_id[trip_dict["trip_id"]] = service
+    # A calendar change that adds or drops trips changes the stop times too, which needs a full rebuild
+    if list(service_for_trip_id) != list(reader.strings("trips.id")):
+        raise IncompatibleChange("calendar changes alter which trips run")
+    service_indices = {service_id: index for index, service_id in enumerate(services_by_id)}
+    write_service_arrays(writer, list(services_by_id.values()))
+    writer.add_array(
+        "trips.service_index",
+        [service_indices[service.id] for service in service_for_trip_id.values()],
+        dtype=np.int32,
+    )
+
+
+def patch_routes(reader: SnapshotReader, writer: SnapshotWriter, tables: Dict):
+    routes_by_id = link_routes(tables["routes"], tables["route_patterns"])
+    write_route_arrays(writer, list(routes_by_id.values()))
+
+
+def patch_shapes(reader: SnapshotReader, writer: SnapshotWriter, tables: Dict):
+    shape_indices = write_shape_arrays(writer, tables["shapes"])
+    trip_shape_ids = reader.strings("trips.shape_id")
+    missing_shape_ids = set(trip_shape_ids) - set(shape_indices)
+    if missing_shape_ids:
+        raise IncompatibleChange(f"trips reference missing shapes {sorted(missing_shape_ids)[:5]}")
+    writer.add_array("trips.shape_index", [shape_indices[shape_id] for shape_id in trip_shape_ids], dtype=np.int32)
+
+
+# Each patch rewrites the snapshot sections that depend only on its input tables (plus what the
+# previous snapshot already holds), and lists every table it needs to have parsed.
+PATCHES: Dict[str, Callable] = {
+    "transfers": patch_transfers,
+    "calendar": patch_services,
+    "calendar_attributes": patch_services,
+    "routes": patch_routes,
+    "route_patterns": patch_routes,
+    "shapes": patch_shapes,
+}
+
+PATCH_INPUT_TABLES = {
+    patch_transfers: ("transfers",),
+    patch_services: ("calendar", "calendar_attributes", "trips"),
+    patch_routes: ("routes", "route_patterns"),
+    patch_shapes: ("shapes",),
+}
+
+
+def can_patch_network_snapshot(changed_tables: Iterable[str]) -> bool:
+    return all(table in PATCHES for table in changed_tables)
+
+
+def get_patches(changed_tables: Iterable[str]) -> List[Callable]:
+    return list(dict.fromkeys(PATCHES[table] for table in changed_tables))
+
+
+def get_patch_input_tables(changed_tables: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(table for patch in get_patches(changed_tables) for table in PATCH_INPUT_TABLES[patch]))
+
+
+def patch_network_snapshot(
+    base_directory: str,
+    changed_tables: Iterable[str],
+    tables: Dict,
+    directory: str,
+    metadata: Dict = None,
+):
+    assert can_patch_network_snapshot(changed_tables), f"Can't patch a network for changes to {changed_tables}"
+    reader = SnapshotReader(base_directory)
+    writer = SnapshotWriter()
+    for name in reader.array_names:
+        writer.arrays[name] = reader.array(name)
+    for patch in get_patches(changed_tables):
+        patch(reader, writer, tables)
+    writer.write(directory, metadata)
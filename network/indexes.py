@@ -0,0 +1,215 @@
+from bisect import insort
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import math
+import re
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .models import Station, Trip
+    from .stop_times import StopTimesTable
+
+EARTH_RADIUS_KM = 6371.0088
+GRID_CELL_DEGREES = 0.02
+
+Location = Tuple[float, float]
+Cell = Tuple[int, int]
+
+
+def normalize_station_name(name: str) -> str:
+    name = name.casefold().replace("&", " and ")
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
+
+
+def get_station_name_aliases(name: str) -> List[str]:
+    # Stations like "Science Park/West End" also go by each half of their name
+    parts = [part for part in name.split("/") if part.strip()]
+    if len(parts) < 2:
+        return []
+    return [normalize_station_name(part) for part in parts]
+
+
+def get_distance_km(first: Location, second: Location) -> float:
+    lat_1, lon_1, lat_2, lon_2 = map(math.radians, (*first, *second))
+    a = math.sin((lat_2 - lat_1) / 2) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def _get_cell(location: Location) -> Cell:
+    lat, lon = location
+    return (math.floor(lat / GRID_CELL_DEGREES), math.floor(lon / GRID_CELL_DEGREES))
+
+
+def _get_ring(center: Cell, radius: int) -> Iterable[Cell]:
+    row, column = center
+    if radius == 0:
+        yield center
+        return
+    for offset in range(-radius, radius + 1):
+        yield (row - radius, column + offset)
+        yield (row + radius, column + offset)
+    for offset in range(-radius + 1, radius):
+        yield (row + offset, column - radius)
+        yield (row + offset, column + radius)
+
+
+class StationIndex(object):
+    def __init__(self, stations: Iterable["Station"] = ()):
+        self.stations_by_name: Dict[str, "Station"] = {}
+        self.stations_by_normalized_name: Dict[str, "Station"] = {}
+        self.stations_by_alias: Dict[str, "Station"] = {}
+        self.stations_by_municipality: Dict[str, List["Station"]] = defaultdict(list)
+        self.stations_by_cell: Dict[Cell, List["Station"]] = defaultdict(list)
+        self.cell_bounds: Optional[Tuple[int, int, int, int]] = None
+        self.max_abs_latitude = 0.0
+        for station in stations:
+            self.add_station(station)
+
+    def add_station(self, station: "Station"):
+        # The first station with a given name wins, as it always has for get_station_by_name
+        self.stations_by_name.setdefault(station.name, station)
+        self.stations_by_normalized_name.setdefault(normalize_station_name(station.name), station)
+        for alias in get_station_name_aliases(station.name):
+            self.stations_by_alias.setdefault(alias, station)
+        self.stations_by_municipality[station.municipality].append(station)
+        if station.location:
+            cell = _get_cell(station.location)
+            self.stations_by_cell[cell].append(station)
+            self._extend_cell_bounds(cell)
+            self.max_abs_latitude = max(self.max_abs_latitude, abs(station.location[0]))
+
+    def add_alias(self, alias: str, station: "Station"):
+        self.stations_by_alias[normalize_station_name(alias)] = station
+
+    def _extend_cell_bounds(self, cell: Cell):
+        row, column = cell
+        if self.cell_bounds is None:
+            self.cell_bounds = (row, row, column, column)
+            return
+        min_row, max_row, min_column, max_column = self.cell_bounds
+        self.cell_bounds = (min(min_row, row), max(max_row, row), min(min_column, column), max(max_column, column))
+
+    def get_station_by_name(self, name: str) -> Optional["Station"]:
+        return self.stations_by_name.get(name)
+
+    def find_station_by_name(self, name: str) -> Optional["Station"]:
+        station = self.stations_by_name.get(name)
+        if station:
+            return station
+        normalized_name = normalize_station_name(name)
+        return self.stations_by_normalized_name.get(normalized_name) or self.stations_by_alias.get(normalized_name)
+
+    def get_stations_by_municipality(self, municipality: str) -> List["Station"]:
+        return list(self.stations_by_municipality.get(municipality, ()))
+
+    def _get_max_ring_radius(self, center: Cell) -> int:
+        min_row, max_row, min_column, max_column = self.cell_bounds
+        row, column = center
+        return max(row - min_row, max_row - row, column - min_column, max_column - column, 0)
+
+    def get_nearest_stations(
+        self,
+        location: Location,
+        count: int = 1,
+        max_distance_km: float = None,
+    ) -> List[Tuple["Station", float]]:
+        if self.cell_bounds is None or count <= 0:
+            return []
+        center = _get_cell(location)
+        # Every station outside ring r is more than r whole cells away along at least one axis. Meridians are
+        # closest together at the highest latitude we've seen, so the distance from there to a meridian r
+        # cells over bounds how close those stations can be.
+        max_abs_latitude = max(self.max_abs_latitude, abs(location[0]))
+        cos_latitude = math.cos(math.radians(max_abs_latitude))
+        found = []
+        for radius in range(self._get_max_ring_radius(center) + 1):
+            for cell in _get_ring(center, radius):
+                for station in self.stations_by_cell.get(cell, ()):
+                    distance_km = get_distance_km(location, station.location)
+                    if max_distance_km is None or distance_km <= max_distance_km:
+                        found.append((station, distance_km))
+            cell_offset = math.radians(min(radius * GRID_CELL_DEGREES, 90))
+            unsearched_distance_km = EARTH_RADIUS_KM * math.asin(cos_latitude * math.sin(cell_offset))
+            if max_distance_km is not None and unsearched_distance_km > max_distance_km:
+                break
+            if len(found) >= count and sorted(d for _, d in found)[count - 1] <= unsearched_distance_km:
+                break
+        found.sort(key=lambda station_and_distance: station_and_distance[1])
+        return found[:count]
+
+
+class TripIndex(object):
+    def __init__(self, trips: Iterable["Trip"] = ()):
+        self.trips: List["Trip"] = []
+        self.positions_by_trip_id: Dict[str, int] = {}
+        self.station_ids_by_position: List[FrozenSet[str]] = []
+        self.positions_by_station_id: Dict[str, List[int]] = defaultdict(list)
+        self.positions_by_route_pattern_id: Dict[str, List[int]] = defaultdict(list)
+        for trip in trips:
+            self.add_trip(trip)
+
+    @classmethod
+    def from_stop_times_table(cls, table: "StopTimesTable"):
+        # Reading (trip, station) pairs off the table avoids materializing a StopTime for every row
+        station_ids_by_code = {}
+        stop_station_code = np.array(
+            [station_ids_by_code.setdefault(stop.parent_station.id, len(station_ids_by_code)) for stop in table.stops],
+            dtype=np.int64,
+        )
+        station_ids = list(station_ids_by_code)
+        station_count = max(len(station_ids), 1)
+        pairs = np.unique(table.trip_index.astype(np.int64) * station_count + stop_station_code[table.stop_index])
+        pair_trip_index, pair_station_code = np.divmod(pairs, station_count)
+        offsets = np.searchsorted(pair_trip_index, np.arange(len(table.trips) + 1))
+        index = cls()
+        for position, trip in enumerate(table.trips):
+            codes = pair_station_code[offsets[position] : offsets[position + 1]]
+            index.add_trip(trip, [station_ids[code] for code in codes])
+        return index
+
+    def add_trip(self, trip: "Trip", station_ids: Iterable[str] = None):
+        # Stations are read from the trip's stop times as they stand when it is added
+        if station_ids is None:
+            station_ids = (stop_time.stop.parent_station.id for stop_time in trip.stop_times)
+        station_ids = frozenset(station_ids)
+        position = self.positions_by_trip_id.get(trip.id)
+        if position is None:
+            position = len(self.trips)
+            self.trips.append(trip)
+            self.station_ids_by_position.append(station_ids)
+            self.positions_by_trip_id[trip.id] = position
+        else:
+            # A trip with the same id replaces the old one where it stood, as it does in trips_by_id
+            self._remove_position(position)
+            self.trips[position] = trip
+            self.station_ids_by_position[position] = station_ids
+        # Positions stay sorted so that every lookup returns trips in network order
+        for station_id in station_ids:
+            insort(self.positions_by_station_id[station_id], position)
+        insort(self.positions_by_route_pattern_id[trip.route_pattern_id], position)
+
+    def _remove_position(self, position: int):
+        for station_id in self.station_ids_by_position[position]:
+            self.positions_by_station_id[station_id].remove(position)
+        self.positions_by_route_pattern_id[self.trips[position].route_pattern_id].remove(position)
+
+    def get_station_ids_for_trip(self, trip: "Trip") -> FrozenSet[str]:
+        position = self.positions_by_trip_id.get(trip.id)
+        return frozenset() if position is None else self.station_ids_by_position[position]
+
+    def get_trips_for_route_pattern(self, route_pattern_id: str) -> List["Trip"]:
+        return [self.trips[position] for position in self.positions_by_route_pattern_id.get(route_pattern_id, ())]
+
+    def get_trips_serving_stations(self, stations: Iterable["Station"]) -> Iterator["Trip"]:
+        station_ids = {station.id for station in stations}
+        if not station_ids:
+            yield from self.trips
+            return
+        # Walk the rarest station's trips in network order and check the rest against each trip's station set
+        rarest_station_id = min(
+            station_ids, key=lambda station_id: len(self.positions_by_station_id.get(station_id, ()))
+        )
+        for position in self.positions_by_station_id.get(rarest_station_id, ()):
+            if station_ids <= self.station_ids_by_position[position]:
+                yield self.trips[position]
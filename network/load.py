@@ -1,30 +1,165 @@
+from contextlib import contextmanager
+from typing import Optional, Sequence
+from zipfile import ZipFile
 import csv
+import hashlib
+import io
 import os
 
-from .config import PATH_TO_GTFS_DATA
+from .config import PATH_TO_GTFS_DATA, PATH_TO_GTFS_ZIP
+from .time import DAYS_OF_WEEK
 
 
-def loader_by_file_name(file_name):
-    file_path = os.path.join(PATH_TO_GTFS_DATA, file_name + ".txt")
+class GtfsFiles(object):
+    # Tables are read from the feed zip when it has them, and otherwise from the directory, which is
+    # where derived tables like relevant_stop_times.txt (and feeds extracted the old way) live.
+    def __init__(self, directory_path: str = PATH_TO_GTFS_DATA, zip_path: str = PATH_TO_GTFS_ZIP):
+        self.directory_path = directory_path
+        self.zip_path = zip_path
 
-    def load():
+    def _get_zip_member(self, file_name: str) -> Optional[str]:
+        if self.zip_path and os.path.exists(self.zip_path):
+            member = file_name + ".txt"
+            with ZipFile(self.zip_path) as zip_file:
+                if member in zip_file.namelist():
+                    return member
+        return None
+
+    def get_path(self, file_name: str) -> Optional[str]:
+        if self._get_zip_member(file_name):
+            return None
+        file_path = os.path.join(self.directory_path, file_name + ".txt")
+        return file_path if os.path.exists(file_path) else None
+
+    def exists(self, file_name: str) -> bool:
+        return bool(self._get_zip_member(file_name) or self.get_path(file_name))
+
+    @contextmanager
+    def open(self, file_name: str):
+        member = self._get_zip_member(file_name)
+        if member:
+            with ZipFile(self.zip_path) as zip_file:
+                with io.TextIOWrapper(zip_file.open(member), encoding="utf-8", newline="") as file:
+                    yield file
+            return
+        with open(os.path.join(self.directory_path, file_name + ".txt"), "r", encoding="utf-8") as file:
+            yield file
+
+    def get_digest(self, file_name: str) -> Optional[str]:
+        member = self._get_zip_member(file_name)
+        if member:
+            # Zip entries already carry a CRC of their content, so there is no need to decompress them
+            with ZipFile(self.zip_path) as zip_file:
+                info = zip_file.getinfo(member)
+            return f"zip:{info.CRC:08x}:{info.file_size}"
+        file_path = self.get_path(file_name)
+        if not file_path:
+            return None
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _get_column_indices(header, column_names, file_name):
+    missing = [column_name for column_name in column_names if column_name not in header]
+    if missing:
+        raise ValueError(f"{file_name}.txt is missing columns {missing}")
+    return [header.index(column_name) for column_name in column_names]
+
+
+def loader_by_file_name(file_name, column_names: Sequence[str] = None):
+    def load(gtfs_files: GtfsFiles = None):
+        gtfs_files = gtfs_files or GtfsFiles()
         res = []
-        with open(file_path, "r") as file:
-            dict_reader = csv.DictReader(file)
-            for row in dict_reader:
-                res.append(row)
+        with gtfs_files.open(file_name) as file:
+            if column_names is None:
+                for row in csv.DictReader(file):
+                    res.append(row)
+                return res
+            reader = csv.reader(file)
+            indices = _get_column_indices(next(reader), column_names, file_name)
+            for row in reader:
+                if row:
+                    res.append({column_name: row[index] for column_name, index in zip(column_names, indices)})
         return res
 
     return load
 
 
-load_calendar = loader_by_file_name("calendar")
-load_calendar_attributes = loader_by_file_name("calendar_attributes")
+def column_loader_by_file_name(file_name, column_names: Sequence[str]):
+    def load(gtfs_files: GtfsFiles = None):
+        gtfs_files = gtfs_files or GtfsFiles()
+        with gtfs_files.open(file_name) as file:
+            reader = csv.reader(file)
+            indices = _get_column_indices(next(reader), column_names, file_name)
+            columns = [[] for _ in column_names]
+            appenders = [(column.append, index) for column, index in zip(columns, indices)]
+            for row in reader:
+                if row:
+                    for append, index in appenders:
+                        append(row[index])
+        return dict(zip(column_names, columns))
+
+    return load
+
+
+load_calendar = loader_by_file_name("calendar", ("service_id", *DAYS_OF_WEEK))
+load_calendar_attributes = loader_by_file_name(
+    "calendar_attributes",
+    (
+        "service_id",
+        "service_description",
+        "service_schedule_name",
+        "service_schedule_type",
+        "service_schedule_typicality",
+    ),
+)
 load_stop_times = loader_by_file_name("stop_times")
 load_relevant_stop_times = loader_by_file_name("relevant_stop_times")
-load_stops = loader_by_file_name("stops")
-load_transfers = loader_by_file_name("transfers")
-load_trips = loader_by_file_name("trips")
-load_routes = loader_by_file_name("routes")
-load_route_patterns = loader_by_file_name("route_patterns")
-load_shapes = loader_by_file_name("shapes")
+load_relevant_stop_time_columns = column_loader_by_file_name(
+    "relevant_stop_times",
+    ("trip_id", "stop_id", "departure_time", "stop_sequence"),
+)
+load_stops = loader_by_file_name(
+    "stops",
+    (
+        "stop_id",
+        "stop_name",
+        "municipality",
+        "stop_lat",
+        "stop_lon",
+        "wheelchair_boarding",
+        "on_street",
+        "at_street",
+        "vehicle_type",
+        "zone_id",
+        "level_id",
+        "location_type",
+        "parent_station",
+    ),
+)
+load_transfers = loader_by_file_name(
+    "transfers",
+    (
+        "from_stop_id",
+        "to_stop_id",
+        "min_walk_time",
+        "min_wheelchair_time",
+        "min_transfer_time",
+        "suggested_buffer_time",
+        "wheelchair_transfer",
+    ),
+)
+load_trips = loader_by_file_name(
+    "trips",
+    ("trip_id", "service_id", "route_id", "route_pattern_id", "direction_id", "shape_id"),
+)
+load_trip_route_columns = column_loader_by_file_name("trips", ("trip_id", "route_id"))
+load_routes = loader_by_file_name("routes", ("route_id", "route_long_name"))
+load_route_patterns = loader_by_file_name("route_patterns", ("route_pattern_id", "route_id", "direction_id"))
+load_shape_columns = column_loader_by_file_name(
+    "shapes",
+    ("shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"),
+)
@@ -1,29 +1,63 @@
-import os
-import pickle
-import sys
-
-from .build import build_network_from_gtfs
-from .config import PATH_TO_PICKLED_NETWORK
-
-LARGE_RECURSION_LIMIT = 10000
-
-
-def get_gtfs_network():
-    if os.path.exists(PATH_TO_PICKLED_NETWORK):
-        with open(PATH_TO_PICKLED_NETWORK, "rb") as file:
-            try:
-                return pickle.load(file)
-            except Exception:
-                print("Error loading pickled network.")
-    print("Creating network from scratch...")
-    network = build_network_from_gtfs()
-    with open(PATH_TO_PICKLED_NETWORK, "wb") as file:
-        old_limit = sys.getrecursionlimit()
-        sys.setrecursionlimit(LARGE_RECURSION_LIMIT)
-        pickle.dump(network, file)
-        sys.setrecursionlimit(old_limit)
+from datetime import date
+from typing import List, Union
+import time
+
+import click
+
+from .cache import (
+    build_and_cache_network,
+    get_input_digests,
+    get_network_cache_key,
+    load_cached_network,
+    update_cached_network,
+)
+from .batch import build_networks_for_feeds
+from .config import GTFS_ARCHIVE_URL
+from .feed_store import FeedStore
+from .load import GtfsFiles
+from .mbta_gtfs import date_options, get_requested_dates, resolve_feeds, store_gtfs_feeds
+
+
+def get_gtfs_network(gtfs_files: GtfsFiles = None, parallel: bool = None):
+    start = time.perf_counter()
+    input_digests = get_input_digests(gtfs_files)
+    key = get_network_cache_key(input_digests=input_digests)
+    network = load_cached_network(key)
+    if network:
+        print(f"Network cache hit ({key}), loaded in {time.perf_counter() - start:.2f}s")
         return network
+    network = update_cached_network(key, input_digests, gtfs_files, parallel=parallel)
+    if network:
+        return network
+    print(f"Network cache miss ({key}), creating network from scratch...")
+    network = build_and_cache_network(key, input_digests, gtfs_files, parallel=parallel)
+    print(f"Built and cached network in {time.perf_counter() - start:.2f}s")
+    return network
+
+
+@click.command()
+@date_options
+@click.option("--archive", "archive_url", default=GTFS_ARCHIVE_URL, help="Archive index URL, file:// URL, or directory")
+@click.option("--refresh/--no-refresh", default=False, help="Always re-fetch the archive index")
+@click.option("--processes", default=1, show_default=True, help="Build networks for this many feeds at once")
+def main(
+    dates: List[Union[None, date]],
+    start_date: Union[None, date],
+    end_date: Union[None, date],
+    archive_url: str,
+    refresh: bool,
+    processes: int,
+):
+    """Build the network for gtfs-present, or for the feeds in effect on the given dates"""
+    requested_dates = get_requested_dates(dates, start_date, end_date)
+    if not requested_dates:
+        get_gtfs_network()
+        return
+    store = FeedStore()
+    feeds = store_gtfs_feeds(resolve_feeds(requested_dates, archive_url, store, refresh), store)
+    for version, output_path in build_networks_for_feeds(feeds, store, processes=processes).items():
+        print(f"Network for {version}: {output_path}")
 
 
 if __name__ == "__main__":
-    get_gtfs_network()
+    main()
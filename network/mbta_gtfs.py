@@ -1,14 +1,17 @@
-from typing import List, Union
+from typing import Iterable, List, Optional, Tuple, Union
 from csv import DictReader
 from dataclasses import dataclass
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 from zipfile import BadZipFile, ZipFile
-from tqdm import tqdm
+import os
+import shutil
 import tempfile
 import click
-import requests
 
-from network.config import GTFS_ARCHIVE_URL, PATH_TO_GTFS_DATA
+from network.config import GTFS_ARCHIVE_URL, PATH_TO_GTFS_DATA, PATH_TO_GTFS_ZIP
+from network.feed_store import ARCHIVE_INDEX_NAME, FeedStore
 
 
 @dataclass
@@ -33,8 +36,87 @@ def validate_date_arg(_, __, date_arg: Union[None, str]) -> Union[None, date]:
         raise click.BadParameter("Must specify a date as yyyy-mm-dd or 'latest'")
 
 
-def download_gtfs_feed(feed: GtfsFeed):
+def validate_date_args(context, param, date_args: Tuple[str]) -> List[Union[None, date]]:
+    return [validate_date_arg(context, param, date_arg) for date_arg in date_args]
+
+
+def validate_range_date_arg(_, __, date_arg: Union[None, str]) -> Union[None, date]:
+    if date_arg is None:
+        return None
+    try:
+        return date_from_string(date_arg, "%Y-%m-%d")
+    except ValueError:
+        raise click.BadParameter("Must specify a date as yyyy-mm-dd")
+
+
+def date_options(command):
+    # Shared by every command that works on feeds for one or more dates
+    command = click.option(
+        "--end-date", callback=validate_range_date_arg, help="Last date of a range of dates, as yyyy-mm-dd"
+    )(command)
+    command = click.option(
+        "--start-date", callback=validate_range_date_arg, help="First date of a range of dates, as yyyy-mm-dd"
+    )(command)
+    command = click.option(
+        "--date", "dates", multiple=True, callback=validate_date_args, help="A date as yyyy-mm-dd, or 'latest'"
+    )(command)
+    return command
+
+
+def get_dates_in_range(start_date: date, end_date: date) -> List[date]:
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def get_requested_dates(
+    dates: Iterable[Union[None, date]],
+    start_date: Union[None, date],
+    end_date: Union[None, date],
+) -> List[Union[None, date]]:
+    if (start_date is None) != (end_date is None):
+        raise click.UsageError("--start-date and --end-date must be given together")
+    requested_dates = list(dates)
+    if start_date is not None:
+        if end_date < start_date:
+            raise click.UsageError("--end-date must not be before --start-date")
+        requested_dates += get_dates_in_range(start_date, end_date)
+    return requested_dates
+
+
+def get_local_path(url: str) -> Optional[str]:
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return url2pathname(parsed.path)
+    if parsed.scheme in ("http", "https"):
+        return None
+    return url
+
+
+def resolve_archive_url(archive_url: str) -> str:
+    local_path = get_local_path(archive_url)
+    if local_path and os.path.isdir(local_path):
+        return os.path.join(local_path, ARCHIVE_INDEX_NAME)
+    return archive_url
+
+
+def resolve_feed_url(feed_url: str, archive_url: str) -> str:
+    archive_path = get_local_path(archive_url)
+    feed_path = get_local_path(feed_url)
+    # Local archives may list their feeds relative to the index file
+    if archive_path and feed_path and not os.path.isabs(feed_path):
+        return os.path.join(os.path.dirname(archive_path), feed_path)
+    return feed_url
+
+
+def download_gtfs_feed(feed: GtfsFeed, target_path: str):
+    local_path = get_local_path(feed.url)
+    if local_path:
+        shutil.copyfile(local_path, target_path)
+        return
+    import requests
+    from tqdm import tqdm
+
     response = requests.get(feed.url, stream=True)
+    response.raise_for_status()
     total_size_in_bytes = int(response.headers.get("content-length", 0))
     block_size = 1024
     progress_bar = tqdm(
@@ -43,29 +125,68 @@ def download_gtfs_feed(feed: GtfsFeed):
         unit_scale=True,
         desc=f"Downloading {feed.url}",
     )
-    target_file = tempfile.NamedTemporaryFile(suffix=".zip")
-    with open(target_file.name, "wb") as file:
+    with open(target_path, "wb") as file:
         for data in response.iter_content(block_size):
             progress_bar.update(len(data))
             file.write(data)
     progress_bar.close()
+
+
+def get_stored_gtfs_feed(feed: GtfsFeed, store: FeedStore) -> Optional[str]:
+    stored_path = store.get_feed_path(feed.version)
+    if stored_path:
+        print(f"Using stored GTFS feed {feed.version}")
+        return stored_path
+    os.makedirs(store.path, exist_ok=True)
+    file_descriptor, target_path = tempfile.mkstemp(suffix=".zip", dir=store.path)
+    os.close(file_descriptor)
     try:
-        zf = ZipFile(target_file.name)
-        zf.extractall(PATH_TO_GTFS_DATA)
+        download_gtfs_feed(feed, target_path)
+        with ZipFile(target_path) as zf:
+            corrupt_member = zf.testzip()
+        if corrupt_member is not None:
+            raise BadZipFile(f"Bad CRC for {corrupt_member}")
     except BadZipFile:
         print("Corrupt GTFS feed:", feed.url)
+        os.remove(target_path)
+        return None
+    except BaseException:
+        os.remove(target_path)
+        raise
+    return store.add_feed(feed.version, feed.url, target_path)
+
+
+def install_gtfs_feed(zip_path: str, extract: bool = False):
+    # The network loader reads tables straight out of this zip, so there is no need to extract it
+    temp_path = PATH_TO_GTFS_ZIP + ".tmp"
+    shutil.copyfile(zip_path, temp_path)
+    os.replace(temp_path, PATH_TO_GTFS_ZIP)
+    if extract:
+        with ZipFile(zip_path) as zf:
+            zf.extractall(PATH_TO_GTFS_DATA)
+
+
+def fetch_archive_index(archive_url: str) -> str:
+    local_path = get_local_path(archive_url)
+    if local_path:
+        with open(local_path, "r", encoding="utf-8") as file:
+            return file.read()
+    import requests
+
+    req = requests.get(archive_url)
+    req.raise_for_status()
+    return req.text
 
 
-def load_feeds_from_archive():
+def parse_archive_index(text: str, archive_url: str) -> List[GtfsFeed]:
     feeds = []
-    req = requests.get(GTFS_ARCHIVE_URL)
-    lines = req.text.splitlines()
+    lines = text.splitlines()
     reader = DictReader(lines, delimiter=",")
     for entry in reader:
         start_date = date_from_string(entry["feed_start_date"])
         end_date = date_from_string(entry["feed_end_date"])
         version = entry["feed_version"]
-        url = entry["archive_url"]
+        url = resolve_feed_url(entry["archive_url"], archive_url)
         gtfs_feed = GtfsFeed(
             start_date=start_date,
             end_date=end_date,
@@ -76,22 +197,116 @@ def load_feeds_from_archive():
     return list(reversed(sorted(feeds, key=lambda feed: feed.start_date)))
 
 
-def select_feed(feeds: List[GtfsFeed], date: Union[None, date]) -> GtfsFeed:
+def load_feeds_from_archive(
+    archive_url: str = GTFS_ARCHIVE_URL,
+    store: FeedStore = None,
+    refresh: bool = True,
+) -> List[GtfsFeed]:
+    import requests
+
+    store = store or FeedStore()
+    archive_url = resolve_archive_url(archive_url)
+    text = None
+    if refresh:
+        try:
+            text = fetch_archive_index(archive_url)
+            store.write_archive_index(text)
+        except (requests.RequestException, OSError) as e:
+            print(f"Could not fetch {archive_url} ({e}), falling back to the cached archive index")
+    if text is None:
+        text = store.read_archive_index()
+    if text is None:
+        raise click.ClickException(f"Could not fetch {archive_url} and no archive index is cached")
+    return parse_archive_index(text, archive_url)
+
+
+def find_feed(feeds: List[GtfsFeed], date: Union[None, date]) -> Optional[GtfsFeed]:
     if date is None:
-        return feeds[0]
-    try:
-        return next((feed for feed in feeds if feed.start_date <= date <= feed.end_date))
-    except StopIteration:
+        return feeds[0] if feeds else None
+    return next((feed for feed in feeds if feed.start_date <= date <= feed.end_date), None)
+
+
+def select_feed(feeds: List[GtfsFeed], date: Union[None, date]) -> GtfsFeed:
+    feed = find_feed(feeds, date)
+    if feed is None:
         print(f"No GTFS feed available for {date}")
+    return feed
+
+
+def resolve_feed(
+    date: Union[None, date],
+    archive_url: str = GTFS_ARCHIVE_URL,
+    store: FeedStore = None,
+    refresh: bool = False,
+) -> GtfsFeed:
+    store = store or FeedStore()
+    # A specific date can usually be answered from the cached index without touching the network.
+    # Only "latest" or a date the cached index doesn't cover needs a fresh copy.
+    if not refresh and date is not None and store.read_archive_index() is not None:
+        feed = find_feed(load_feeds_from_archive(archive_url, store, refresh=False), date)
+        if feed:
+            return feed
+    return select_feed(load_feeds_from_archive(archive_url, store, refresh=True), date)
+
+
+def select_feeds(feeds: List[GtfsFeed], dates: Iterable[Union[None, date]]) -> List[GtfsFeed]:
+    # Many dates fall within the same feed, which only needs to be built once
+    selected = {}
+    for requested_date in dates:
+        feed = select_feed(feeds, requested_date)
+        if feed:
+            selected.setdefault(feed.version, feed)
+    return sorted(selected.values(), key=lambda feed: feed.start_date)
+
+
+def resolve_feeds(
+    dates: List[Union[None, date]],
+    archive_url: str = GTFS_ARCHIVE_URL,
+    store: FeedStore = None,
+    refresh: bool = False,
+) -> List[GtfsFeed]:
+    store = store or FeedStore()
+    if not refresh and None not in dates and store.read_archive_index() is not None:
+        feeds = load_feeds_from_archive(archive_url, store, refresh=False)
+        if all(find_feed(feeds, requested_date) for requested_date in dates):
+            return select_feeds(feeds, dates)
+    return select_feeds(load_feeds_from_archive(archive_url, store, refresh=True), dates)
+
+
+def store_gtfs_feeds(feeds: List[GtfsFeed], store: FeedStore = None) -> List[GtfsFeed]:
+    store = store or FeedStore()
+    return [feed for feed in feeds if get_stored_gtfs_feed(feed, store)]
 
 
 @click.command()
-@click.option("--date", callback=validate_date_arg)
-def load_mbta_gtfs_feed(date: Union[None, date]):
-    feeds = load_feeds_from_archive()
-    feed = select_feed(feeds, date)
+@date_options
+@click.option("--archive", "archive_url", default=GTFS_ARCHIVE_URL, help="Archive index URL, file:// URL, or directory")
+@click.option("--refresh/--no-refresh", default=False, help="Always re-fetch the archive index")
+@click.option("--extract/--no-extract", default=False, help="Also extract every table into data/gtfs-present")
+def load_mbta_gtfs_feed(
+    dates: List[Union[None, date]],
+    start_date: Union[None, date],
+    end_date: Union[None, date],
+    archive_url: str,
+    refresh: bool,
+    extract: bool,
+):
+    requested_dates = get_requested_dates(dates, start_date, end_date)
+    if not requested_dates:
+        raise click.UsageError("Specify a --date, or a --start-date and --end-date")
+    store = FeedStore()
+    if len(requested_dates) > 1:
+        # Batches only fill the feed store, since there is just one gtfs-present to install into
+        for feed in store_gtfs_feeds(resolve_feeds(requested_dates, archive_url, store, refresh), store):
+            print(f"Stored GTFS feed {feed.version} ({feed.start_date} to {feed.end_date})")
+        return
+    feed = resolve_feed(requested_dates[0], archive_url, store, refresh)
+    if feed is None:
+        return
     print(f"Selecting GTFS feed for dates: {feed.start_date} to {feed.end_date}")
-    download_gtfs_feed(feed)
+    zip_path = get_stored_gtfs_feed(feed, store)
+    if zip_path:
+        install_gtfs_feed(zip_path, extract=extract)
 
 
 if __name__ == "__main__":
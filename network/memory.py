@@ -0,0 +1,58 @@
+import sys
+import time
+import tracemalloc
+
+import click
+
+from .build import build_network_from_gtfs
+from .models import Network
+
+
+def get_instance_size(instance) -> int:
+    size = sys.getsizeof(instance)
+    if hasattr(instance, "__dict__"):
+        size += sys.getsizeof(instance.__dict__)
+    return size
+
+
+def get_model_sizes(network: Network):
+    station = next(station for station in network.stations_by_id.values() if station.child_stops)
+    stop = station.child_stops[0]
+    trip = next(trip for trip in network.trips_by_id.values() if trip.stop_times)
+    models = {"Station": station, "Stop": stop, "Trip": trip, "StopTime": trip.stop_times[0]}
+    transfer = next((transfer for stop in station.child_stops for transfer in stop.transfers), None)
+    if transfer:
+        models["Transfer"] = transfer
+    return {name: get_instance_size(instance) for name, instance in models.items()}
+
+
+def materialize_stop_times(network: Network):
+    return [list(trip.stop_times) for trip in network.trips_by_id.values()]
+
+
+def format_megabytes(size: int) -> str:
+    return f"{size / 2**20:.1f} MB"
+
+
+@click.command()
+def main():
+    tracemalloc.start()
+    start = time.perf_counter()
+    network = build_network_from_gtfs(parallel=False)
+    built, built_peak = tracemalloc.get_traced_memory()
+    print(f"Built network in {time.perf_counter() - start:.2f}s")
+    print(f"Network heap: {format_megabytes(built)} (peak {format_megabytes(built_peak)})")
+    stop_times = materialize_stop_times(network)
+    stop_time_count = sum(len(trip_stop_times) for trip_stop_times in stop_times)
+    materialized, _ = tracemalloc.get_traced_memory()
+    print(
+        f"Materialized {stop_time_count} stop times: +{format_megabytes(materialized - built)} "
+        f"({(materialized - built) / max(stop_time_count, 1):.0f} bytes each)"
+    )
+    tracemalloc.stop()
+    for name, size in get_model_sizes(network).items():
+        print(f"{name}: {size} bytes per instance")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 from dataclasses import dataclass, field
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, FrozenSet, Iterator, Optional, Sequence, TYPE_CHECKING
 import functools
-import datetime
+
+from .indexes import StationIndex, TripIndex
+
+if TYPE_CHECKING:
+    from .departures import Departures, DepartureIndex
+    from .stop_times import StopTimesTable
 
 DIRECTIONS = (0, 1)
 
@@ -32,24 +37,30 @@ class Service(object):
         return hash(self.id)
 
 
-@dataclass
+def _linked_field(default_factory):
+    # Links between models are filled in after construction and left out of __init__, __repr__, and __eq__
+    return field(default_factory=default_factory, init=False, repr=False, compare=False)
+
+
+@dataclass(slots=True)
 class Trip(object):
     id: str
     route_id: str
     route_pattern_id: str
     shape_id: str
-    shape: List[Tuple[float, float]]
+    shape: Sequence[Tuple[float, float]]
     direction_id: int
     service: Service
-
-    def __post_init__(self):
-        self.stop_times = []
+    stop_times: List["StopTime"] = _linked_field(list)
 
     def add_stop_time(self, stop_time):
         self.stop_times.append(stop_time)
 
+    def set_stop_times(self, stop_times):
+        self.stop_times = stop_times
+
 
-@dataclass
+@dataclass(slots=True)
 class StationStop(object):
     id: str
     name: str
@@ -64,15 +75,14 @@ class StationStop(object):
     location_type: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Station(StationStop):
+    child_stops: List["Stop"] = _linked_field(list)
+    child_stops_by_direction: Dict[int, "Stop"] = _linked_field(dict)
+
     def __str__(self):
         return f"Station({self.id})"
 
-    def __post_init__(self):
-        self.child_stops = []
-        self.child_stops_by_direction = {}
-
     def add_child_stop(self, stop):
         self.child_stops.append(stop)
 
@@ -84,17 +94,15 @@ class Station(StationStop):
         return self.child_stops_by_direction[direction]
 
 
-@dataclass
+@dataclass(slots=True)
 class Stop(StationStop):
     parent_station: Station
+    stop_times: List["StopTime"] = _linked_field(list)
+    transfers: List["Transfer"] = _linked_field(list)
 
     def __str__(self):
         return f"Stop({self.parent_station.id}.{self.id})"
 
-    def __post_init__(self):
-        self.stop_times = []
-        self.transfers = []
-
     def set_stop_times(self, stop_times):
         self.stop_times = stop_times
 
@@ -103,11 +111,12 @@ class Stop(StationStop):
 
 
 @functools.total_ordering
-@dataclass
+@dataclass(slots=True)
 class StopTime(object):
     stop: Stop
     trip: Trip
-    time: datetime.timedelta
+    # Seconds since the start of the service day, which can run past 24:00:00
+    time: int
 
     def __eq__(self, other):
         return self.time == other.time
@@ -119,7 +128,7 @@ class StopTime(object):
         return self.time < other.time
 
 
-@dataclass
+@dataclass(slots=True)
 class Transfer(object):
     from_stop: Stop
     to_stop: Stop
@@ -134,25 +143,90 @@ class Transfer(object):
 class Network(object):
     stations_by_id: Dict[str, Station]
     trips_by_id: Dict[str, Trip]
-    shapes_by_id: Dict[str, List[Tuple[float, float]]]
+    shapes_by_id: Dict[str, Sequence[Tuple[float, float]]]
     routes_by_id: Dict[str, "Route"]
     services_by_id: Dict[str, "Service"]
+    stop_times: "StopTimesTable" = None
+    station_index: StationIndex = field(default=None, init=False, repr=False, compare=False)
+    trip_index: TripIndex = field(default=None, init=False, repr=False, compare=False)
+    departure_index: "DepartureIndex" = field(default=None, init=False, repr=False, compare=False)
 
     def add_station(self, station: Station):
         existing_station_by_id = self.stations_by_id.get(station.id)
         if existing_station_by_id:
             raise NameError(f"Station with id {station.id} already exists in network")
         self.stations_by_id[station.id] = station
+        if self.station_index is not None:
+            self.station_index.add_station(station)
         return station
 
+    def get_station_index(self) -> StationIndex:
+        # Built on first use so that networks loaded from a snapshot only materialize stations when asked
+        if self.station_index is None:
+            self.station_index = StationIndex(self.stations_by_id.values())
+        return self.station_index
+
+    def add_station_alias(self, alias: str, station: Station):
+        self.get_station_index().add_alias(alias, station)
+
+    def add_trip(self, trip: Trip):
+        self.trips_by_id[trip.id] = trip
+        if self.trip_index is not None:
+            self.trip_index.add_trip(trip)
+        # Departures are cheap to rebuild per stop, so drop them rather than splice the trip in
+        self.departure_index = None
+        return trip
+
+    def get_trip_index(self) -> TripIndex:
+        if self.trip_index is None:
+            if self.stop_times is not None and len(self.stop_times.trips) == len(self.trips_by_id):
+                self.trip_index = TripIndex.from_stop_times_table(self.stop_times)
+            else:
+                self.trip_index = TripIndex(self.trips_by_id.values())
+        return self.trip_index
+
+    def get_trips_serving_stations(self, stations: List[Station]) -> Iterator[Trip]:
+        return self.get_trip_index().get_trips_serving_stations(stations)
+
+    def get_trips_for_route_pattern(self, route_pattern_id: str) -> List[Trip]:
+        return self.get_trip_index().get_trips_for_route_pattern(route_pattern_id)
+
+    def get_station_ids_for_trip(self, trip: Trip) -> FrozenSet[str]:
+        return self.get_trip_index().get_station_ids_for_trip(trip)
+
+    def get_departure_index(self) -> "DepartureIndex":
+        # departures imports this module, so it can only be imported once both are loaded
+        from .departures import DepartureIndex
+
+        if self.departure_index is None:
+            self.departure_index = DepartureIndex(self)
+        return self.departure_index
+
+    def get_departures_for_stop(self, stop: Stop) -> "Departures":
+        return self.get_departure_index().get_departures_for_stop(stop)
+
+    def get_departures_for_station(self, station: Station) -> "Departures":
+        return self.get_departure_index().get_departures_for_station(station)
+
     def get_station_by_id(self, station_id: str) -> Optional[Station]:
         return self.stations_by_id.get(station_id)
 
     def get_station_by_name(self, station_name: str) -> Optional[Station]:
-        for station in self.stations_by_id.values():
-            if station.name == station_name:
-                return station
-        return None
+        return self.get_station_index().get_station_by_name(station_name)
+
+    def find_station_by_name(self, station_name: str) -> Optional[Station]:
+        return self.get_station_index().find_station_by_name(station_name)
+
+    def get_stations_by_municipality(self, municipality: str) -> List[Station]:
+        return self.get_station_index().get_stations_by_municipality(municipality)
+
+    def get_nearest_stations(
+        self,
+        location: Tuple[float, float],
+        count: int = 1,
+        max_distance_km: float = None,
+    ) -> List[Tuple[Station, float]]:
+        return self.get_station_index().get_nearest_stations(location, count, max_distance_km)
 
 
 @dataclass
@@ -1,11 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import os
+import shutil
+import tempfile
 
-from .load import load_stop_times, load_trips
-from .build import index_by
-from .config import PATH_TO_GTFS_DATA
+import click
 
-PATH_TO_OUTPUT = os.path.join(PATH_TO_GTFS_DATA, "relevant_stop_times.txt")
+from .load import GtfsFiles, load_trip_route_columns
 
 RAPID_TRANSIT = (
     "Orange",
@@ -33,24 +34,122 @@ def is_relevant_route_id(route_id):
     return route_id in RELEVANT_ROUTE_IDS or route_id.startswith("CR-")
 
 
-def is_relevant_stop_time(stop_time_dict, trip_dicts_by_id):
-    trip_dict = trip_dicts_by_id.get(stop_time_dict["trip_id"])
-    if trip_dict:
-        return is_relevant_route_id(trip_dict["route_id"])
-    return False
+def get_relevant_trip_ids(gtfs_files: GtfsFiles):
+    trip_columns = load_trip_route_columns(gtfs_files)
+    return {
+        trip_id
+        for trip_id, route_id in zip(trip_columns["trip_id"], trip_columns["route_id"])
+        if is_relevant_route_id(route_id)
+    }
 
 
-def generate_relevant_stop_times():
-    trip_dicts_by_id = index_by(load_trips(), "trip_id")
-    stop_times = load_stop_times()
-    relevant_stop_times = [stop_time for stop_time in stop_times if is_relevant_stop_time(stop_time, trip_dicts_by_id)]
-    with open(PATH_TO_OUTPUT, "w") as file:
-        fieldnames = relevant_stop_times[0].keys()
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        for stop_time in relevant_stop_times:
-            writer.writerow(stop_time)
+def filter_stop_time_rows(lines, relevant_trip_ids, fieldnames, output_file):
+    trip_id_index = fieldnames.index("trip_id")
+    width = len(fieldnames)
+    writer = csv.writer(output_file)
+    for row in csv.reader(lines):
+        if len(row) > trip_id_index and row[trip_id_index] in relevant_trip_ids:
+            # Pad short rows the way csv.DictWriter fills in missing keys
+            writer.writerow(row + [""] * (width - len(row)))
+
+
+def _get_chunk_boundaries(input_path, chunks):
+    with open(input_path, "rb") as file:
+        header_end = len(file.readline())
+        file_size = os.fstat(file.fileno()).st_size
+        boundaries = [header_end]
+        for index in range(1, chunks):
+            file.seek(header_end + index * (file_size - header_end) // chunks)
+            # Move forward to the start of the next full line
+            file.readline()
+            boundaries.append(max(file.tell(), boundaries[-1]))
+        boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _read_lines_in_range(file, start, end):
+    file.seek(start)
+    position = start
+    while position < end:
+        line = file.readline()
+        if not line:
+            return
+        position += len(line)
+        yield line.decode("utf-8")
+
+
+def _filter_chunk(input_path, start, end, relevant_trip_ids, fieldnames, part_path):
+    with open(input_path, "rb") as input_file, open(part_path, "w", encoding="utf-8") as output_file:
+        filter_stop_time_rows(_read_lines_in_range(input_file, start, end), relevant_trip_ids, fieldnames, output_file)
+    return part_path
+
+
+def _filter_stop_times_in_chunks(input_path, output_path, relevant_trip_ids, fieldnames, processes):
+    # Chunks are split on line boundaries, which is safe because stop_times.txt never quotes newlines
+    chunks = _get_chunk_boundaries(input_path, processes)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as temp_dir:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(
+                    _filter_chunk,
+                    input_path,
+                    start,
+                    end,
+                    relevant_trip_ids,
+                    fieldnames,
+                    os.path.join(temp_dir, f"part-{index}.txt"),
+                )
+                for index, (start, end) in enumerate(chunks)
+            ]
+            part_paths = [future.result() for future in futures]
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            csv.writer(output_file).writerow(fieldnames)
+        with open(output_path, "ab") as output_file:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+
+
+def _write_relevant_stop_times(gtfs_files: GtfsFiles, output_path: str, processes: int):
+    relevant_trip_ids = get_relevant_trip_ids(gtfs_files)
+    with gtfs_files.open("stop_times") as input_file:
+        fieldnames = next(csv.reader(input_file))
+        if processes <= 1:
+            with open(output_path, "w", encoding="utf-8") as output_file:
+                csv.writer(output_file).writerow(fieldnames)
+                filter_stop_time_rows(input_file, relevant_trip_ids, fieldnames, output_file)
+            return
+        input_path = gtfs_files.get_path("stop_times")
+        if input_path:
+            _filter_stop_times_in_chunks(input_path, output_path, relevant_trip_ids, fieldnames, processes)
+            return
+        # Compressed zip members can't be split at byte offsets, so spill this one table to disk first
+        with tempfile.NamedTemporaryFile("w", dir=gtfs_files.directory_path, suffix=".txt", encoding="utf-8") as spill:
+            csv.writer(spill).writerow(fieldnames)
+            shutil.copyfileobj(input_file, spill)
+            spill.flush()
+            _filter_stop_times_in_chunks(spill.name, output_path, relevant_trip_ids, fieldnames, processes)
+
+
+def generate_relevant_stop_times(gtfs_files: GtfsFiles = None, processes=1):
+    gtfs_files = gtfs_files or GtfsFiles()
+    output_path = os.path.join(gtfs_files.directory_path, "relevant_stop_times.txt")
+    os.makedirs(gtfs_files.directory_path, exist_ok=True)
+    # Write beside the output and swap it in, so an interrupted run never leaves a truncated table behind
+    temp_path = output_path + ".tmp"
+    try:
+        _write_relevant_stop_times(gtfs_files, temp_path, processes)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@click.command()
+@click.option("--processes", default=1, show_default=True, help="Filter stop_times.txt in this many parallel chunks")
+def main(processes: int):
+    generate_relevant_stop_times(processes=processes)
 
 
 if __name__ == "__main__":
-    generate_relevant_stop_times()
+    main()
@@ -0,0 +1,114 @@
+from collections.abc import Sequence
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class ShapeView(Sequence):
+    __slots__ = ("buffer", "start", "end")
+
+    def __init__(self, buffer: np.ndarray, start: int, end: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    @property
+    def points(self) -> np.ndarray:
+        return self.buffer[self.start : self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, end, step)]
+            return ShapeView(self.buffer, self.start + start, self.start + max(start, end))
+        lat, lon = self.points[index]
+        return (float(lat), float(lon))
+
+    def __iter__(self):
+        for lat, lon in self.points.tolist():
+            yield (lat, lon)
+
+    def __eq__(self, other):
+        if isinstance(other, ShapeView):
+            return np.array_equal(self.points, other.points)
+        if isinstance(other, Sequence):
+            return list(self) == [tuple(point) for point in other]
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ShapeView({len(self)} points)"
+
+
+def _get_point_ids(points: np.ndarray) -> np.ndarray:
+    # Treat each (lat, lon) pair as one opaque 16-byte value so identical points share an id
+    keys = np.ascontiguousarray(points).view(np.dtype((np.void, 2 * points.dtype.itemsize))).reshape(-1)
+    _, point_ids = np.unique(keys, return_inverse=True)
+    return point_ids.reshape(-1)
+
+
+def _get_offsets(values: np.ndarray, count: int) -> np.ndarray:
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(values, minlength=count), out=offsets[1:])
+    return offsets
+
+
+def pack_shapes(points: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Shapes are given back to back in points, the i-th one at offsets[i]:offsets[i + 1]. Any shape whose
+    # points appear as a contiguous run of a longer shape is stored as a window onto that shape instead.
+    shape_count = len(offsets) - 1
+    lengths = np.diff(offsets)
+    point_ids = _get_point_ids(points) if len(points) else np.zeros(0, dtype=np.int64)
+    shape_by_position = np.repeat(np.arange(shape_count), lengths)
+    positions_by_point = np.argsort(point_ids, kind="stable")
+    point_offsets = _get_offsets(point_ids, int(point_ids.max()) + 1 if len(point_ids) else 0)
+    container = np.full(shape_count, -1, dtype=np.int64)
+    container_offset = np.zeros(shape_count, dtype=np.int64)
+    roots = []
+    for shape in np.argsort(-lengths, kind="stable"):
+        start, end = offsets[shape], offsets[shape + 1]
+        if end > start:
+            first_point = point_ids[start]
+            for position in positions_by_point[point_offsets[first_point] : point_offsets[first_point + 1]]:
+                other = shape_by_position[position]
+                if container[other] != other or position + (end - start) > offsets[other + 1]:
+                    continue
+                if np.array_equal(point_ids[position : position + end - start], point_ids[start:end]):
+                    container[shape] = other
+                    container_offset[shape] = position - offsets[other]
+                    break
+        if container[shape] < 0:
+            container[shape] = shape
+            roots.append(shape)
+    root_starts = np.zeros(shape_count, dtype=np.int64)
+    root_starts[roots] = np.concatenate([[0], np.cumsum(lengths[roots])[:-1]]) if roots else []
+    buffer = np.concatenate([points[offsets[root] : offsets[root + 1]] for root in roots]) if roots else points[:0]
+    starts = root_starts[container] + container_offset
+    return np.ascontiguousarray(buffer, dtype=np.float64), starts, starts + lengths
+
+
+def create_shape_views(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> List[ShapeView]:
+    return [ShapeView(buffer, int(start), int(end)) for start, end in zip(starts, ends)]
+
+
+def create_shapes_by_id(shape_ids: List[str], points: np.ndarray, offsets: np.ndarray) -> Dict[str, ShapeView]:
+    views = create_shape_views(*pack_shapes(points, offsets))
+    return dict(zip(shape_ids, views))
+
+
+def get_shared_shape_buffer(shapes: List[Sequence]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Shapes from one build already share a buffer. Anything else gets packed from scratch.
+    buffers = {id(shape.buffer) for shape in shapes if isinstance(shape, ShapeView)}
+    if len(buffers) == 1 and all(isinstance(shape, ShapeView) for shape in shapes):
+        return (
+            shapes[0].buffer,
+            np.array([shape.start for shape in shapes], dtype=np.int64),
+            np.array([shape.end for shape in shapes], dtype=np.int64),
+        )
+    lengths = [len(shape) for shape in shapes]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    points = np.array([point for shape in shapes for point in shape], dtype=np.float64).reshape(-1, 2)
+    return pack_shapes(points, offsets)
@@ -0,0 +1,406 @@
+from collections.abc import MutableMapping, Sequence
+from functools import cached_property
+from typing import Callable, Dict, List
+import json
+import os
+
+import numpy as np
+
+from .models import Network, Route, RoutePattern, Service, Station, Stop, Transfer, Trip
+from .shapes import create_shape_views, get_shared_shape_buffer
+from .stop_times import StopTimesTable
+from .time import DAYS_OF_WEEK
+
+SNAPSHOT_FORMAT_VERSION = 2
+MANIFEST_FILE_NAME = "manifest.json"
+
+STATION_STOP_STRING_FIELDS = (
+    "id",
+    "name",
+    "municipality",
+    "wheelchair_boarding",
+    "on_street",
+    "at_street",
+    "vehicle_type",
+    "zone_id",
+    "level_id",
+    "location_type",
+)
+
+TRIP_STRING_FIELDS = ("id", "route_id", "route_pattern_id", "shape_id")
+
+TRANSFER_INT_FIELDS = ("min_walk_time", "min_wheelchair_time", "min_transfer_time", "suggested_buffer_time")
+
+
+class StringColumn(Sequence):
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        return bytes(self.data[self.offsets[index] : self.offsets[index + 1]]).decode("utf-8")
+
+
+class LazyList(Sequence):
+    def __init__(self, length: int, create: Callable, link: Callable = None):
+        self._items = [None] * length
+        self._create = create
+        self._link = link
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        item = self._items[index]
+        if item is None:
+            item = self._items[index] = self._create(index)
+            # Linking happens after the item is cached so that back-references resolve to it
+            if self._link:
+                self._link(index, item)
+        return item
+
+
+class LazyMap(MutableMapping):
+    def __init__(self, ids: Sequence, items: Sequence):
+        self._ids = ids
+        self._items = items
+        self._dict = None
+
+    @cached_property
+    def _keys(self):
+        return list(self._ids)
+
+    @cached_property
+    def _indices_by_key(self):
+        return {key: index for index, key in enumerate(self._keys)}
+
+    def _materialize(self):
+        if self._dict is None:
+            self._dict = {key: self._items[index] for index, key in enumerate(self._keys)}
+        return self._dict
+
+    def __getitem__(self, key):
+        if self._dict is not None:
+            return self._dict[key]
+        return self._items[self._indices_by_key[key]]
+
+    def __contains__(self, key):
+        if self._dict is not None:
+            return key in self._dict
+        return key in self._indices_by_key
+
+    def __iter__(self):
+        return iter(self._dict if self._dict is not None else self._keys)
+
+    def __len__(self):
+        return len(self._dict) if self._dict is not None else len(self._keys)
+
+    def __setitem__(self, key, value):
+        self._materialize()[key] = value
+
+    def __delitem__(self, key):
+        del self._materialize()[key]
+
+    def __repr__(self):
+        return f"LazyMap({len(self)} items)"
+
+
+class SnapshotWriter(object):
+    def __init__(self):
+        self.arrays = {}
+
+    def add_array(self, name: str, values, dtype=None):
+        self.arrays[name] = np.asarray(values, dtype=dtype)
+
+    def add_strings(self, name: str, strings: List[str]):
+        encoded = [(string or "").encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        self.arrays[f"{name}.data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self.arrays[f"{name}.offsets"] = offsets
+
+    def write(self, directory: str, metadata: Dict = None):
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array, allow_pickle=False)
+        # The manifest goes last, so a directory without one is an incomplete snapshot
+        manifest = {
+            "version": SNAPSHOT_FORMAT_VERSION,
+            "arrays": sorted(self.arrays.keys()),
+            "metadata": metadata or {},
+        }
+        with open(os.path.join(directory, MANIFEST_FILE_NAME), "w") as file:
+            json.dump(manifest, file)
+
+
+class SnapshotReader(object):
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE_NAME), "r") as file:
+            manifest = json.load(file)
+        if manifest["version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported network snapshot version {manifest['version']}")
+        self.array_names = set(manifest["arrays"])
+        self.metadata = manifest.get("metadata", {})
+
+    def array(self, name: str) -> np.ndarray:
+        if name not in self.array_names:
+            raise KeyError(f"Network snapshot {self.directory} has no array {name}")
+        return np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+
+    def strings(self, name: str) -> StringColumn:
+        return StringColumn(self.array(f"{name}.data"), self.array(f"{name}.offsets"))
+
+
+def _get_offsets_for_groups(groups: List[List]) -> np.ndarray:
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum([len(group) for group in groups], out=offsets[1:])
+    return offsets
+
+
+def _write_station_stop_fields(writer: SnapshotWriter, prefix: str, station_stops: List):
+    for field in STATION_STOP_STRING_FIELDS:
+        writer.add_strings(f"{prefix}.{field}", [getattr(s, field) for s in station_stops])
+    writer.add_array(f"{prefix}.location", [s.location for s in station_stops], dtype=np.float64)
+
+
+def write_transfer_arrays(writer: SnapshotWriter, transfer_groups: List[List[Dict]]):
+    # Each group holds the transfers leaving one stop, as dicts of to_stop_index and the Transfer fields
+    flat_transfers = [transfer for group in transfer_groups for transfer in group]
+    writer.add_array("transfers.offsets", _get_offsets_for_groups(transfer_groups))
+    writer.add_array("transfers.to_stop_index", [t["to_stop_index"] for t in flat_transfers], np.int32)
+    for field in TRANSFER_INT_FIELDS:
+        writer.add_array(f"transfers.{field}", [t[field] for t in flat_transfers], dtype=np.int32)
+    writer.add_strings("transfers.wheelchair_transfer", [t["wheelchair_transfer"] for t in flat_transfers])
+
+
+def write_service_arrays(writer: SnapshotWriter, services: List[Service]):
+    writer.add_strings("services.id", [s.id for s in services])
+    writer.add_array(
+        "services.days",
+        [[day in s.days for day in DAYS_OF_WEEK] for s in services],
+        dtype=np.bool_,
+    )
+    for field in ("description", "schedule_name", "schedule_type"):
+        writer.add_strings(f"services.{field}", [getattr(s, field) for s in services])
+    writer.add_array("services.schedule_typicality", [s.schedule_typicality for s in services], dtype=np.int32)
+
+
+def write_shape_arrays(writer: SnapshotWriter, shapes_by_id: Dict) -> Dict[str, int]:
+    shape_ids = list(shapes_by_id.keys())
+    shape_buffer, shape_starts, shape_ends = get_shared_shape_buffer([shapes_by_id[s] for s in shape_ids])
+    writer.add_strings("shapes.id", shape_ids)
+    writer.add_array("shapes.points", shape_buffer, np.float64)
+    writer.add_array("shapes.start", shape_starts, np.int64)
+    writer.add_array("shapes.end", shape_ends, np.int64)
+    return {shape_id: index for index, shape_id in enumerate(shape_ids)}
+
+
+def write_route_arrays(writer: SnapshotWriter, routes: List[Route]):
+    route_indices = {id(route): index for index, route in enumerate(routes)}
+    route_patterns = [pattern for route in routes for pattern in route.route_patterns]
+    writer.add_strings("routes.id", [r.id for r in routes])
+    writer.add_strings("routes.long_name", [r.long_name for r in routes])
+    writer.add_array("routes.pattern_offsets", _get_offsets_for_groups([r.route_patterns for r in routes]))
+    writer.add_strings("route_patterns.id", [p.id for p in route_patterns])
+    writer.add_array("route_patterns.route_index", [route_indices[id(p.route)] for p in route_patterns], np.int32)
+    writer.add_array("route_patterns.direction", [p.direction for p in route_patterns], dtype=np.int8)
+
+
+def write_network_snapshot(network: Network, directory: str, metadata: Dict = None):
+    assert network.stop_times is not None, "Only networks built from GTFS can be snapshotted"
+    writer = SnapshotWriter()
+    stations = list(network.stations_by_id.values())
+    stops = list(network.stop_times.stops)
+    trips = list(network.stop_times.trips)
+    services = list(network.services_by_id.values())
+    routes = list(network.routes_by_id.values())
+    station_indices = {id(station): index for index, station in enumerate(stations)}
+    stop_indices = {id(stop): index for index, stop in enumerate(stops)}
+    service_indices = {service.id: index for index, service in enumerate(services)}
+    # Stations
+    _write_station_stop_fields(writer, "stations", stations)
+    child_stops = [[stop_indices[id(stop)] for stop in station.child_stops] for station in stations]
+    writer.add_array("stations.child_stop_index", [i for group in child_stops for i in group], dtype=np.int32)
+    writer.add_array("stations.child_stop_offsets", _get_offsets_for_groups(child_stops))
+    # Stops
+    _write_station_stop_fields(writer, "stops", stops)
+    writer.add_array("stops.parent_station_index", [station_indices[id(s.parent_station)] for s in stops], np.int32)
+    # Transfers, grouped by the stop they leave from
+    write_transfer_arrays(
+        writer,
+        [
+            [
+                {
+                    "to_stop_index": stop_indices[id(transfer.to_stop)],
+                    "wheelchair_transfer": transfer.wheelchair_transfer,
+                    **{field: getattr(transfer, field) for field in TRANSFER_INT_FIELDS},
+                }
+                for transfer in stop.transfers
+            ]
+            for stop in stops
+        ],
+    )
+    write_service_arrays(writer, services)
+    shape_indices = write_shape_arrays(writer, network.shapes_by_id)
+    # Trips
+    for field in TRIP_STRING_FIELDS:
+        writer.add_strings(f"trips.{field}", [getattr(t, field) for t in trips])
+    writer.add_array("trips.direction_id", [t.direction_id for t in trips], dtype=np.int8)
+    writer.add_array("trips.service_index", [service_indices[t.service.id] for t in trips], dtype=np.int32)
+    writer.add_array("trips.shape_index", [shape_indices[t.shape_id] for t in trips], dtype=np.int32)
+    write_route_arrays(writer, routes)
+    # Stop times
+    table = network.stop_times
+    for column in ("stop_index", "trip_index", "stop_sequence", "time", "by_stop_time", "by_trip_sequence"):
+        writer.add_array(f"stop_times.{column}", getattr(table, column))
+    writer.write(directory, metadata)
+
+
+def _read_station_stop_fields(reader: SnapshotReader, prefix: str) -> Callable:
+    columns = {field: reader.strings(f"{prefix}.{field}") for field in STATION_STOP_STRING_FIELDS}
+    location = reader.array(f"{prefix}.location")
+
+    def get_fields(index: int):
+        fields = {field: column[index] for field, column in columns.items()}
+        return {**fields, "location": (float(location[index][0]), float(location[index][1]))}
+
+    return get_fields
+
+
+def _read_services(reader: SnapshotReader) -> LazyList:
+    ids = reader.strings("services.id")
+    days = reader.array("services.days")
+    description = reader.strings("services.description")
+    schedule_name = reader.strings("services.schedule_name")
+    schedule_type = reader.strings("services.schedule_type")
+    schedule_typicality = reader.array("services.schedule_typicality")
+    return LazyList(
+        len(ids),
+        lambda i: Service(
+            id=ids[i],
+            days=[day for day, runs in zip(DAYS_OF_WEEK, days[i]) if runs],
+            description=description[i],
+            schedule_name=schedule_name[i],
+            schedule_type=schedule_type[i],
+            schedule_typicality=int(schedule_typicality[i]),
+        ),
+    )
+
+
+def _read_shapes(reader: SnapshotReader) -> List:
+    # Every shape is a view onto the one memory-mapped points array
+    return create_shape_views(reader.array("shapes.points"), reader.array("shapes.start"), reader.array("shapes.end"))
+
+
+def _read_routes(reader: SnapshotReader) -> LazyList:
+    ids = reader.strings("routes.id")
+    long_names = reader.strings("routes.long_name")
+    pattern_offsets = reader.array("routes.pattern_offsets")
+    pattern_ids = reader.strings("route_patterns.id")
+    pattern_directions = reader.array("route_patterns.direction")
+
+    def link_route_patterns(i: int, route: Route):
+        for p in range(pattern_offsets[i], pattern_offsets[i + 1]):
+            route.route_patterns.append(
+                RoutePattern(id=pattern_ids[p], route=route, direction=int(pattern_directions[p]), stops=[])
+            )
+
+    return LazyList(len(ids), lambda i: Route(id=ids[i], long_name=long_names[i]), link_route_patterns)
+
+
+def read_network_snapshot(directory: str) -> Network:
+    reader = SnapshotReader(directory)
+    # Stops and trips link to the stop times table, which in turn needs to index them
+    table = None
+
+    services = _read_services(reader)
+    shapes = _read_shapes(reader)
+    routes = _read_routes(reader)
+
+    get_station_fields = _read_station_stop_fields(reader, "stations")
+    child_stop_index = reader.array("stations.child_stop_index")
+    child_stop_offsets = reader.array("stations.child_stop_offsets")
+
+    def link_station(i: int, station: Station):
+        for s in child_stop_index[child_stop_offsets[i] : child_stop_offsets[i + 1]]:
+            station.add_child_stop(stops[s])
+
+    stations = LazyList(len(child_stop_offsets) - 1, lambda i: Station(**get_station_fields(i)), link_station)
+
+    get_stop_fields = _read_station_stop_fields(reader, "stops")
+    parent_station_index = reader.array("stops.parent_station_index")
+    transfer_offsets = reader.array("transfers.offsets")
+    transfer_to_stop_index = reader.array("transfers.to_stop_index")
+    transfer_columns = {field: reader.array(f"transfers.{field}") for field in TRANSFER_INT_FIELDS}
+    transfer_wheelchair = reader.strings("transfers.wheelchair_transfer")
+
+    def create_transfer(from_stop: Stop, t: int):
+        return Transfer(
+            from_stop=from_stop,
+            to_stop=stops[transfer_to_stop_index[t]],
+            wheelchair_transfer=transfer_wheelchair[t],
+            **{field: int(column[t]) for field, column in transfer_columns.items()},
+        )
+
+    def link_stop(i: int, stop: Stop):
+        # Creating the station links its child stops, so this stop has to be cached before it is reached
+        stop.parent_station = stations[parent_station_index[i]]
+        first_transfer = int(transfer_offsets[i])
+        stop.set_stop_times(table.get_stop_times_for_stop(i))
+        # Transfers stay lazy so that materializing a stop never walks the whole transfer graph
+        stop.transfers = LazyList(
+            int(transfer_offsets[i + 1]) - first_transfer,
+            lambda t: create_transfer(stop, first_transfer + t),
+        )
+
+    stops = LazyList(
+        len(parent_station_index),
+        lambda i: Stop(parent_station=None, **get_stop_fields(i)),
+        link_stop,
+    )
+
+    trip_columns = {field: reader.strings(f"trips.{field}") for field in TRIP_STRING_FIELDS}
+    direction_id = reader.array("trips.direction_id")
+    service_index = reader.array("trips.service_index")
+    shape_index = reader.array("trips.shape_index")
+
+    def create_trip(i: int):
+        return Trip(
+            **{field: column[i] for field, column in trip_columns.items()},
+            direction_id=int(direction_id[i]),
+            service=services[service_index[i]],
+            shape=shapes[shape_index[i]],
+        )
+
+    trips = LazyList(
+        len(direction_id),
+        create_trip,
+        lambda i, trip: trip.set_stop_times(table.get_stop_times_for_trip(i)),
+    )
+
+    table = StopTimesTable(
+        stops=stops,
+        trips=trips,
+        **{
+            column: reader.array(f"stop_times.{column}")
+            for column in ("stop_index", "trip_index", "stop_sequence", "time", "by_stop_time", "by_trip_sequence")
+        },
+    )
+    return Network(
+        stations_by_id=LazyMap(reader.strings("stations.id"), stations),
+        trips_by_id=LazyMap(trip_columns["id"], trips),
+        shapes_by_id=LazyMap(reader.strings("shapes.id"), shapes),
+        routes_by_id=LazyMap(reader.strings("routes.id"), routes),
+        services_by_id=LazyMap(reader.strings("services.id"), services),
+        stop_times=table,
+    )
+
+
+def is_network_snapshot(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, MANIFEST_FILE_NAME))
@@ -0,0 +1,182 @@
+from collections.abc import Sequence
+from functools import cached_property
+from typing import Dict, List
+
+import numpy as np
+
+from .load import GtfsFiles, load_relevant_stop_time_columns
+from .models import StopTime, Stop, Trip
+from .time import parse_time_column
+
+STOP_ORDER = "stop"
+TRIP_ORDER = "trip"
+
+
+class StopTimesView(Sequence):
+    __slots__ = ("table", "order", "start", "end")
+
+    def __init__(self, table: "StopTimesTable", order: str, start: int, end: int):
+        self.table = table
+        self.order = order
+        self.start = start
+        self.end = end
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.table.get_permutation(self.order)[self.start : self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            assert step == 1, "StopTimesView only supports contiguous slices"
+            return StopTimesView(self.table, self.order, self.start + start, self.start + max(start, end))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StopTimesView index out of range")
+        return self.table.get_stop_time(self.rows[index])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.table.get_stop_time(row)
+
+    def __repr__(self):
+        return f"StopTimesView({self.order}, {len(self)} stop times)"
+
+
+class StopTimeRowsView(Sequence):
+    __slots__ = ("table", "rows")
+
+    def __init__(self, table: "StopTimesTable", rows: np.ndarray):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return StopTimeRowsView(self.table, self.rows[index])
+        return self.table.get_stop_time(self.rows[index])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.table.get_stop_time(row)
+
+    def __repr__(self):
+        return f"StopTimeRowsView({len(self)} stop times)"
+
+
+class StopTimesTable(object):
+    def __init__(
+        self,
+        stops: Sequence[Stop],
+        trips: Sequence[Trip],
+        stop_index: np.ndarray,
+        trip_index: np.ndarray,
+        stop_sequence: np.ndarray,
+        time: np.ndarray,
+        by_stop_time: np.ndarray = None,
+        by_trip_sequence: np.ndarray = None,
+    ):
+        self.stops = stops
+        self.trips = trips
+        self.stop_index = stop_index.astype(np.int32, copy=False)
+        self.trip_index = trip_index.astype(np.int32, copy=False)
+        self.stop_sequence = stop_sequence.astype(np.int32, copy=False)
+        self.time = time.astype(np.int32, copy=False)
+        # np.lexsort is stable, so rows that tie keep their order from the feed
+        if by_stop_time is None:
+            by_stop_time = np.lexsort((self.time, self.stop_index)).astype(np.int32)
+        if by_trip_sequence is None:
+            by_trip_sequence = np.lexsort((self.stop_sequence, self.trip_index)).astype(np.int32)
+        self.by_stop_time = by_stop_time
+        self.by_trip_sequence = by_trip_sequence
+        self.stop_offsets = _get_offsets(self.stop_index, len(stops))
+        self.trip_offsets = _get_offsets(self.trip_index, len(trips))
+
+    def __len__(self):
+        return len(self.time)
+
+    @cached_property
+    def trip_service_ids(self) -> np.ndarray:
+        return np.array([trip.service.id for trip in self.trips], dtype=object)
+
+    def get_permutation(self, order: str) -> np.ndarray:
+        return self.by_stop_time if order == STOP_ORDER else self.by_trip_sequence
+
+    def get_stop_time(self, row: int) -> StopTime:
+        return StopTime(
+            stop=self.stops[self.stop_index[row]],
+            trip=self.trips[self.trip_index[row]],
+            time=int(self.time[row]),
+        )
+
+    def get_stop_times_for_stop(self, stop_index: int) -> StopTimesView:
+        start, end = self.stop_offsets[stop_index], self.stop_offsets[stop_index + 1]
+        return StopTimesView(self, STOP_ORDER, int(start), int(end))
+
+    def get_stop_times_for_trip(self, trip_index: int) -> StopTimesView:
+        start, end = self.trip_offsets[trip_index], self.trip_offsets[trip_index + 1]
+        return StopTimesView(self, TRIP_ORDER, int(start), int(end))
+
+
+def _get_offsets(index: np.ndarray, count: int) -> np.ndarray:
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(index, minlength=count), out=offsets[1:])
+    return offsets
+
+
+def _factorize(values: List[str]):
+    codes_by_value = {}
+    codes = np.fromiter(
+        (codes_by_value.setdefault(value, len(codes_by_value)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return list(codes_by_value), codes
+
+
+def parse_stop_time_columns(stop_time_columns: Dict[str, List[str]]) -> Dict:
+    # Ids repeat on nearly every row, so keep each distinct one once plus an integer code per row
+    trip_ids, trip_code = _factorize(stop_time_columns["trip_id"])
+    stop_ids, stop_code = _factorize(stop_time_columns["stop_id"])
+    return {
+        "trip_ids": trip_ids,
+        "trip_code": trip_code,
+        "stop_ids": stop_ids,
+        "stop_code": stop_code,
+        "time": parse_time_column(stop_time_columns["departure_time"]),
+        # Feeds we write ourselves leave stop_sequence blank, so fall back to row order
+        "stop_sequence": np.array(
+            [int(sequence) if sequence else row for row, sequence in enumerate(stop_time_columns["stop_sequence"])],
+            dtype=np.int32,
+        ),
+    }
+
+
+def load_stop_time_columns(gtfs_files: GtfsFiles = None) -> Dict:
+    return parse_stop_time_columns(load_relevant_stop_time_columns(gtfs_files))
+
+
+def _get_index_lookup(ids: List[str], items: List) -> np.ndarray:
+    indices_by_id = {item.id: index for index, item in enumerate(items)}
+    return np.array([indices_by_id.get(item_id, -1) for item_id in ids], dtype=np.int32)
+
+
+def build_stop_times_table(stop_time_columns: Dict, stops: List[Stop], trips: List[Trip]) -> StopTimesTable:
+    stop_index = _get_index_lookup(stop_time_columns["stop_ids"], stops)[stop_time_columns["stop_code"]]
+    trip_index = _get_index_lookup(stop_time_columns["trip_ids"], trips)[stop_time_columns["trip_code"]]
+    # Drop rows for stops that aren't part of a station or trips without regular service
+    keep = (stop_index >= 0) & (trip_index >= 0)
+    return StopTimesTable(
+        stops=stops,
+        trips=trips,
+        stop_index=stop_index[keep],
+        trip_index=trip_index[keep],
+        stop_sequence=stop_time_columns["stop_sequence"][keep],
+        time=stop_time_columns["time"][keep],
+    )
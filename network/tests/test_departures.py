@@ -0,0 +1,173 @@
+import copy
+import datetime
+import random
+
+import pytest
+
+from network.build import build_network_from_tables, load_gtfs_tables
+from network.models import Network, Service, Station, Stop, StopTime, Trip
+from network.tests.test_incremental import DAYS, FEED, _stop_time, _write_feed
+
+STOPS_BY_DIRECTION = {0: ("a-0", "b-0"), 1: ("b-1", "a-1")}
+
+
+def _get_schedule():
+    # Times on a five minute grid, so that stops and stations see several departures at the same time,
+    # and some of them after midnight
+    generator = random.Random(13)
+    schedule = []
+    for index in range(40):
+        start = 300 * generator.randrange(4 * 12, 26 * 12)
+        service_id = "weekday" if index % 3 else "saturday"
+        schedule.append((f"g{index}", service_id, index % 2, [start, start + 300 * generator.randrange(1, 4)]))
+    return schedule
+
+
+def _get_table_network(tmp_path) -> Network:
+    feed = copy.deepcopy(FEED)
+    feed["calendar"].append({"service_id": "saturday", **{day: "1" if day == "saturday" else "0" for day in DAYS}})
+    feed["calendar_attributes"].append({**feed["calendar_attributes"][0], "service_id": "saturday"})
+    for trip_id, service_id, direction, times in _get_schedule():
+        feed["trips"].append({**feed["trips"][direction], "trip_id": trip_id, "service_id": service_id})
+        for sequence, (stop_id, time) in enumerate(zip(STOPS_BY_DIRECTION[direction], times)):
+            time_string = "{:02}:{:02}:00".format(*divmod(time // 60, 60))
+            feed["relevant_stop_times"].append(_stop_time(trip_id, stop_id, time_string, sequence + 1))
+    return build_network_from_tables(load_gtfs_tables(_write_feed(tmp_path / "feed", feed), parallel=False))
+
+
+def _get_synthetic_network() -> Network:
+    network = Network(stations_by_id={}, trips_by_id={}, shapes_by_id={}, routes_by_id={}, services_by_id={})
+    fields = dict(
+        municipality="Boston",
+        wheelchair_boarding="1",
+        on_street="",
+        at_street="",
+        vehicle_type="2",
+        zone_id="",
+        level_id="",
+    )
+    stops_by_id = {}
+    for station_id, name, location in (("place-a", "Alpha", (42.35, -71.06)), ("place-b", "Bravo", (42.40, -71.10))):
+        station = network.add_station(Station(id=station_id, name=name, location=location, location_type="1", **fields))
+        for suffix in ("0", "1"):
+            stop_id = f"{name[0].lower()}-{suffix}"
+            stop = Stop(id=stop_id, name=name, location=location, location_type="0", parent_station=station, **fields)
+            station.add_child_stop(stop)
+            stops_by_id[stop_id] = stop
+    for service_id in ("weekday", "saturday"):
+        network.services_by_id[service_id] = Service(
+            id=service_id,
+            days=["saturday"] if service_id == "saturday" else list(DAYS[:5]),
+            description=service_id,
+            schedule_name=service_id,
+            schedule_type="Weekday",
+            schedule_typicality=1,
+        )
+    for trip_id, service_id, direction, times in _get_schedule():
+        trip = Trip(
+            id=trip_id,
+            route_id="CR-Test",
+            route_pattern_id=f"CR-Test-{direction}",
+            shape_id="",
+            shape=[],
+            direction_id=direction,
+            service=network.services_by_id[service_id],
+        )
+        for stop_id, time in zip(STOPS_BY_DIRECTION[direction], times):
+            trip.add_stop_time(StopTime(stop=stops_by_id[stop_id], trip=trip, time=time))
+        network.add_trip(trip)
+    return network
+
+
+@pytest.fixture(params=["table", "synthetic"])
+def network(request, tmp_path):
+    if request.param == "table":
+        return _get_table_network(tmp_path)
+    return _get_synthetic_network()
+
+
+def _get_departure_sources(network: Network):
+    for station in network.stations_by_id.values():
+        yield network.get_departures_for_station(station), {stop.id for stop in station.child_stops}
+        for stop in station.child_stops:
+            yield network.get_departures_for_stop(stop), {stop.id}
+
+
+def _filter_stop_times(network: Network, stop_ids, service=None, start=None, end=None):
+    return sorted(
+        (
+            stop_time
+            for trip in network.trips_by_id.values()
+            for stop_time in trip.stop_times
+            if stop_time.stop.id in stop_ids
+            and (service is None or trip.service.id == service.id)
+            and (start is None or stop_time.time >= start)
+            and (end is None or stop_time.time < end)
+        ),
+        key=lambda stop_time: (stop_time.time, stop_time.trip.id),
+    )
+
+
+def _describe(stop_times):
+    return sorted((int(stop_time.time), stop_time.trip.id) for stop_time in stop_times)
+
+
+def _get_query_times(network: Network):
+    # Every departure time and the seconds either side of it, to catch off-by-one boundaries
+    times = {int(stop_time.time) for trip in network.trips_by_id.values() for stop_time in trip.stop_times}
+    return sorted({time + delta for time in times for delta in (-1, 0, 1)} | {0, 30 * 3600})
+
+
+def test_departures_between_match_a_brute_force_filter(network):
+    query_times = _get_query_times(network)
+    services = [None, *network.services_by_id.values()]
+    checked = 0
+    for departures, stop_ids in _get_departure_sources(network):
+        for service in services:
+            for start in query_times[::7]:
+                for end in query_times[::5]:
+                    expected = _filter_stop_times(network, stop_ids, service, start, end)
+                    assert _describe(departures.get_departures_between(start, end, service)) == _describe(expected)
+                    assert list(departures.get_times(service, start, end)) == [st.time for st in expected]
+                    checked += bool(expected)
+    assert checked > 0
+
+
+def test_departure_ranges_include_their_start_and_exclude_their_end(network):
+    for departures, stop_ids in _get_departure_sources(network):
+        for stop_time in _filter_stop_times(network, stop_ids):
+            time = int(stop_time.time)
+            assert stop_time.trip.id in {st.trip.id for st in departures.get_departures_between(time, time + 1)}
+            assert not departures.get_departures_between(time, time)
+            assert time not in departures.get_times(end=time)
+            assert time in departures.get_times(start=time)
+
+
+def test_next_departures_match_a_brute_force_filter(network):
+    services = [None, *network.services_by_id.values()]
+    for departures, stop_ids in _get_departure_sources(network):
+        for service in services:
+            for time in _get_query_times(network)[::3]:
+                expected = _filter_stop_times(network, stop_ids, service, start=time)
+                for count in (1, 3):
+                    next_departures = departures.get_next_departures(time, count, service)
+                    assert [st.time for st in next_departures] == [st.time for st in expected[:count]]
+                    assert all(st.stop.id in stop_ids for st in next_departures)
+                    if service:
+                        assert all(st.trip.service.id == service.id for st in next_departures)
+
+
+def test_headways_match_a_brute_force_filter(network):
+    services = [None, *network.services_by_id.values()]
+    for departures, stop_ids in _get_departure_sources(network):
+        for service in services:
+            expected = [st.time for st in _filter_stop_times(network, stop_ids, service, 8 * 3600, 25 * 3600)]
+            headways = departures.get_headways(service, 8 * 3600, 25 * 3600)
+            assert list(headways) == [second - first for first, second in zip(expected, expected[1:])]
+
+
+def test_departure_queries_accept_timedeltas(network):
+    start, end = datetime.timedelta(hours=8), datetime.timedelta(hours=24, minutes=30)
+    for departures, stop_ids in _get_departure_sources(network):
+        expected = _filter_stop_times(network, stop_ids, start=8 * 3600, end=24 * 3600 + 30 * 60)
+        assert _describe(departures.get_departures_between(start, end)) == _describe(expected)
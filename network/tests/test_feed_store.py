@@ -0,0 +1,43 @@
+import os
+import zipfile
+from datetime import date
+
+from network.feed_store import FeedStore
+from network.mbta_gtfs import GtfsFeed, get_stored_gtfs_feed
+
+
+def _write_feed_zip(path, corrupt=False):
+    contents = b"agency_id,agency_name\n1,MBTA\n" * 20
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr("agency.txt", contents)
+    if corrupt:
+        with open(path, "rb") as file:
+            data = bytearray(file.read())
+        # Flip a byte inside the stored member so that only its CRC check fails
+        index = data.index(contents) + 5
+        data[index] ^= 0xFF
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+def _get_feed(path, version):
+    return GtfsFeed(start_date=date(2024, 1, 1), end_date=date(2024, 1, 31), url=path, version=version)
+
+
+def test_feed_is_stored(tmp_path):
+    source_path = str(tmp_path / "source.zip")
+    _write_feed_zip(source_path)
+    store = FeedStore(str(tmp_path / "store"))
+    stored_path = get_stored_gtfs_feed(_get_feed(source_path, "good"), store)
+    assert stored_path == store.get_feed_path("good")
+
+
+def test_feed_with_corrupt_member_is_not_stored(tmp_path):
+    source_path = str(tmp_path / "source.zip")
+    _write_feed_zip(source_path, corrupt=True)
+    with zipfile.ZipFile(source_path) as zf:
+        assert zf.testzip() == "agency.txt"
+    store = FeedStore(str(tmp_path / "store"))
+    assert get_stored_gtfs_feed(_get_feed(source_path, "corrupt"), store) is None
+    assert store.get_feed_path("corrupt") is None
+    assert os.listdir(store.path) == []
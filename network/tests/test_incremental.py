@@ -0,0 +1,181 @@
+import copy
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from network.build import build_network_from_tables, load_gtfs_tables
+from network.incremental import IncompatibleChange, get_patch_input_tables, patch_network_snapshot
+from network.load import GtfsFiles
+from network.snapshot import SnapshotReader, write_network_snapshot
+
+
+def _stop(stop_id, name, lat, lon, location_type, parent_station=""):
+    return {
+        "stop_id": stop_id,
+        "stop_name": name,
+        "municipality": "Boston",
+        "stop_lat": str(lat),
+        "stop_lon": str(lon),
+        "wheelchair_boarding": "1",
+        "on_street": "",
+        "at_street": "",
+        "vehicle_type": "2" if location_type == "0" else "",
+        "zone_id": "",
+        "level_id": "",
+        "location_type": location_type,
+        "parent_station": parent_station,
+    }
+
+
+def _transfer(from_stop_id, to_stop_id, min_transfer_time):
+    return {
+        "from_stop_id": from_stop_id,
+        "to_stop_id": to_stop_id,
+        "min_walk_time": "60",
+        "min_wheelchair_time": "",
+        "min_transfer_time": str(min_transfer_time),
+        "suggested_buffer_time": "",
+        "wheelchair_transfer": "1",
+    }
+
+
+def _stop_time(trip_id, stop_id, time, sequence):
+    return {"trip_id": trip_id, "stop_id": stop_id, "departure_time": time, "stop_sequence": str(sequence)}
+
+
+def _shape_points(shape_id, points):
+    return [
+        {"shape_id": shape_id, "shape_pt_lat": str(lat), "shape_pt_lon": str(lon), "shape_pt_sequence": str(index)}
+        for index, (lat, lon) in enumerate(points)
+    ]
+
+
+DAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+WEEKDAYS = DAYS[:5]
+
+FEED = {
+    "calendar": [
+        {"service_id": "weekday", **{day: "1" if day in WEEKDAYS else "0" for day in DAYS}},
+        {"service_id": "never", **{day: "0" for day in DAYS}},
+    ],
+    "calendar_attributes": [
+        {
+            "service_id": service_id,
+            "service_description": f"{service_id} service",
+            "service_schedule_name": service_id.title(),
+            "service_schedule_type": "Weekday",
+            "service_schedule_typicality": "1",
+        }
+        for service_id in ("weekday", "never")
+    ],
+    "stops": [
+        _stop("place-a", "Alpha", 42.35, -71.06, "1"),
+        _stop("a-0", "Alpha", 42.35, -71.06, "0", "place-a"),
+        _stop("a-1", "Alpha", 42.35, -71.06, "0", "place-a"),
+        _stop("place-b", "Bravo", 42.40, -71.10, "1"),
+        _stop("b-0", "Bravo", 42.40, -71.10, "0", "place-b"),
+        _stop("b-1", "Bravo", 42.40, -71.10, "0", "place-b"),
+    ],
+    "transfers": [_transfer("a-0", "a-1", 120), _transfer("b-1", "b-0", 90), _transfer("a-1", "nowhere", 30)],
+    "trips": [
+        {
+            "trip_id": trip_id,
+            "service_id": service_id,
+            "route_id": "CR-Test",
+            "route_pattern_id": f"CR-Test-{direction}",
+            "direction_id": str(direction),
+            "shape_id": f"shape-{direction}",
+        }
+        for trip_id, service_id, direction in (("t1", "weekday", 0), ("t2", "weekday", 1), ("t3", "never", 0))
+    ],
+    "relevant_stop_times": [
+        _stop_time("t1", "a-0", "08:00:00", 1),
+        _stop_time("t1", "b-0", "08:10:00", 2),
+        _stop_time("t2", "b-1", "24:05:00", 1),
+        _stop_time("t2", "a-1", "24:15:00", 2),
+        _stop_time("t3", "a-0", "09:00:00", 1),
+    ],
+    "routes": [{"route_id": "CR-Test", "route_long_name": "Test Line"}],
+    "route_patterns": [
+        {"route_pattern_id": f"CR-Test-{direction}", "route_id": "CR-Test", "direction_id": str(direction)}
+        for direction in (0, 1)
+    ],
+    "shapes": _shape_points("shape-0", [(42.35, -71.06), (42.37, -71.08), (42.40, -71.10)])
+    + _shape_points("shape-1", [(42.40, -71.10), (42.37, -71.08), (42.35, -71.06)]),
+}
+
+
+def _write_feed(directory, feed):
+    os.makedirs(directory, exist_ok=True)
+    for file_name, rows in feed.items():
+        with open(os.path.join(directory, f"{file_name}.txt"), "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    return GtfsFiles(directory_path=str(directory), zip_path=None)
+
+
+def _write_full_snapshot(gtfs_files, directory):
+    network = build_network_from_tables(load_gtfs_tables(gtfs_files, parallel=False))
+    write_network_snapshot(network, str(directory))
+    return SnapshotReader(str(directory))
+
+
+def _assert_snapshots_equal(first: SnapshotReader, second: SnapshotReader):
+    assert first.array_names == second.array_names
+    for name in first.array_names:
+        assert np.array_equal(first.array(name), second.array(name)), name
+
+
+def _change_transfers(feed):
+    feed["transfers"][0]["min_transfer_time"] = "240"
+    feed["transfers"].append(_transfer("b-0", "a-0", 600))
+
+
+def _change_calendar_attributes(feed):
+    feed["calendar_attributes"][0]["service_description"] = "Renamed weekday service"
+
+
+def _change_routes(feed):
+    feed["routes"][0]["route_long_name"] = "Renamed Line"
+    feed["route_patterns"].append({"route_pattern_id": "CR-Test-2", "route_id": "CR-Test", "direction_id": "0"})
+
+
+def _change_shapes(feed):
+    feed["shapes"] = _shape_points("shape-1", [(42.40, -71.10), (42.35, -71.06)]) + _shape_points(
+        "shape-0", [(42.35, -71.06), (42.36, -71.07), (42.37, -71.08), (42.40, -71.10)]
+    )
+
+
+@pytest.mark.parametrize(
+    "change, changed_tables",
+    [
+        (_change_transfers, ["transfers"]),
+        (_change_calendar_attributes, ["calendar_attributes"]),
+        (_change_routes, ["routes", "route_patterns"]),
+        (_change_shapes, ["shapes"]),
+        (lambda feed: (_change_transfers(feed), _change_shapes(feed)), ["transfers", "shapes"]),
+    ],
+)
+def test_patched_snapshot_matches_full_rebuild(tmp_path, change, changed_tables):
+    base_files = _write_feed(tmp_path / "base-feed", FEED)
+    base_snapshot = _write_full_snapshot(base_files, tmp_path / "base")
+    feed = copy.deepcopy(FEED)
+    change(feed)
+    changed_files = _write_feed(tmp_path / "changed-feed", feed)
+    full_snapshot = _write_full_snapshot(changed_files, tmp_path / "full")
+    tables = load_gtfs_tables(changed_files, parallel=False, names=get_patch_input_tables(changed_tables))
+    patch_network_snapshot(base_snapshot.directory, changed_tables, tables, str(tmp_path / "patched"))
+    _assert_snapshots_equal(SnapshotReader(str(tmp_path / "patched")), full_snapshot)
+
+
+def test_calendar_change_that_alters_trips_is_not_patched(tmp_path):
+    base_snapshot = _write_full_snapshot(_write_feed(tmp_path / "base-feed", FEED), tmp_path / "base")
+    feed = copy.deepcopy(FEED)
+    feed["calendar"][1]["monday"] = "1"
+    changed_files = _write_feed(tmp_path / "changed-feed", feed)
+    tables = load_gtfs_tables(changed_files, parallel=False, names=get_patch_input_tables(["calendar"]))
+    with pytest.raises(IncompatibleChange):
+        patch_network_snapshot(base_snapshot.directory, ["calendar"], tables, str(tmp_path / "patched"))
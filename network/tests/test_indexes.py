@@ -0,0 +1,221 @@
+import random
+
+import pytest
+
+from network.indexes import GRID_CELL_DEGREES, StationIndex, get_distance_km, normalize_station_name
+from network.models import Network, Service, Station, Stop, StopTime, Trip
+from network.tests.test_departures import _get_table_network
+from synthesize.distance import get_exemplar_trip_for_stations
+
+
+def _station(station_id, name, location, municipality="Boston"):
+    return Station(
+        id=station_id,
+        name=name,
+        municipality=municipality,
+        location=location,
+        wheelchair_boarding="1",
+        on_street="",
+        at_street="",
+        vehicle_type="",
+        zone_id="",
+        level_id="",
+        location_type="1",
+    )
+
+
+def _get_grid_stations():
+    # Stations spread around Boston, with some exactly on the edges and corners of grid cells
+    generator = random.Random(11)
+    stations = []
+    for index in range(150):
+        location = (42.2 + 0.4 * generator.random(), -71.3 + 0.5 * generator.random())
+        stations.append(_station(f"random-{index}", f"Random {index}", location))
+    for row in range(2110, 2130, 3):
+        for column in range(-3565, -3545, 4):
+            location = (row * GRID_CELL_DEGREES, column * GRID_CELL_DEGREES)
+            stations.append(_station(f"edge-{row}-{column}", f"Edge {row} {column}", location))
+    return stations
+
+
+def _get_query_locations():
+    generator = random.Random(17)
+    for _ in range(60):
+        lat, lon = 42.2 + 0.4 * generator.random(), -71.3 + 0.5 * generator.random()
+        yield lat, lon
+        # The same point moved onto, and just either side of, the nearest cell edges
+        row, column = round(lat / GRID_CELL_DEGREES), round(lon / GRID_CELL_DEGREES)
+        for offset in (-1e-9, 0, 1e-9):
+            yield row * GRID_CELL_DEGREES + offset, lon
+            yield lat, column * GRID_CELL_DEGREES + offset
+            yield row * GRID_CELL_DEGREES + offset, column * GRID_CELL_DEGREES + offset
+    # Far outside the cells that hold any station
+    yield 41.0, -73.5
+    yield 44.5, -69.0
+
+
+def _scan_nearest_stations(stations, location, count, max_distance_km=None):
+    distances = [(station, get_distance_km(location, station.location)) for station in stations]
+    distances = [(s, d) for s, d in distances if max_distance_km is None or d <= max_distance_km]
+    return sorted(distances, key=lambda station_and_distance: station_and_distance[1])[:count]
+
+
+@pytest.mark.parametrize("count, max_distance_km", [(1, None), (5, None), (8, 3.0), (400, None), (3, 0.5)])
+def test_nearest_stations_match_a_haversine_scan(count, max_distance_km):
+    stations = _get_grid_stations()
+    index = StationIndex(stations)
+    for location in _get_query_locations():
+        nearest = index.get_nearest_stations(location, count, max_distance_km)
+        expected = _scan_nearest_stations(stations, location, count, max_distance_km)
+        assert [distance for _, distance in nearest] == pytest.approx([distance for _, distance in expected])
+        # Stations at the same distance can come back in either order
+        distances = {station.id: distance for station, distance in expected}
+        for station, distance in nearest:
+            assert distances.get(station.id, distance) == pytest.approx(distance)
+
+
+def test_nearest_stations_of_an_empty_index():
+    assert StationIndex().get_nearest_stations((42.35, -71.06), 3) == []
+    assert StationIndex(_get_grid_stations()).get_nearest_stations((42.35, -71.06), 0) == []
+
+
+def test_station_name_lookups():
+    science_park = _station("place-spmnl", "Science Park/West End", (42.3664, -71.0676))
+    first_alpha = _station("place-alpha-1", "Alpha", (42.3, -71.0), municipality="Quincy")
+    second_alpha = _station("place-alpha-2", "Alpha", (42.31, -71.0), municipality="Quincy")
+    jfk = _station("place-jfk", "JFK/UMass", (42.3207, -71.0524))
+    index = StationIndex([science_park, first_alpha, second_alpha, jfk])
+    assert index.get_station_by_name("Alpha") is first_alpha
+    assert index.get_station_by_name("alpha") is None
+    assert index.find_station_by_name("alpha") is first_alpha
+    assert index.find_station_by_name("  SCIENCE park / west end ") is science_park
+    assert index.find_station_by_name("West End") is science_park
+    assert index.find_station_by_name("umass") is jfk
+    assert index.find_station_by_name("Nowhere") is None
+    index.add_alias("Kendall/MIT", science_park)
+    assert index.find_station_by_name("kendall mit") is science_park
+    assert normalize_station_name("Kendall/MIT") == "kendall mit"
+    assert normalize_station_name("Back Bay & South End") == "back bay and south end"
+
+
+def test_stations_by_municipality():
+    stations = _get_grid_stations()
+    quincy = _station("place-qnctr", "Quincy Center", (42.2518, -71.0054), municipality="Quincy")
+    index = StationIndex([*stations, quincy])
+    assert index.get_stations_by_municipality("Quincy") == [quincy]
+    assert index.get_stations_by_municipality("Boston") == stations
+    assert index.get_stations_by_municipality("Nowhere") == []
+    # Callers get a copy they can change without changing the index
+    index.get_stations_by_municipality("Quincy").clear()
+    assert index.get_stations_by_municipality("Quincy") == [quincy]
+
+
+SERVICE = Service(
+    id="weekday",
+    days=["monday"],
+    description="",
+    schedule_name="",
+    schedule_type="Weekday",
+    schedule_typicality=1,
+)
+
+
+def _stop(station: Station):
+    fields = {name: getattr(station, name) for name in ("name", "municipality", "location", "wheelchair_boarding")}
+    stop = Stop(
+        id=f"{station.id}-0",
+        on_street="",
+        at_street="",
+        vehicle_type="2",
+        zone_id="",
+        level_id="",
+        location_type="0",
+        parent_station=station,
+        **fields,
+    )
+    station.add_child_stop(stop)
+    return stop
+
+
+def _trip(trip_id, stations, route_pattern_id="pattern"):
+    trip = Trip(
+        id=trip_id,
+        route_id="route",
+        route_pattern_id=route_pattern_id,
+        shape_id="",
+        shape=[],
+        direction_id=0,
+        service=SERVICE,
+    )
+    for minute, station in enumerate(stations):
+        trip.add_stop_time(StopTime(stop=station.child_stops[0], trip=trip, time=60 * minute))
+    return trip
+
+
+def _get_trip_network():
+    generator = random.Random(5)
+    network = Network(stations_by_id={}, trips_by_id={}, shapes_by_id={}, routes_by_id={}, services_by_id={})
+    stations = [network.add_station(_station(f"s{i}", f"S{i}", (42.3 + 0.01 * i, -71.0))) for i in range(8)]
+    for station in stations:
+        _stop(station)
+    for index in range(30):
+        calls = generator.sample(stations, generator.randrange(2, 6))
+        network.add_trip(_trip(f"t{index}", calls, f"pattern-{index % 3}"))
+    return network, stations, generator
+
+
+def _scan_exemplar_trip(network: Network, first: Station, second: Station):
+    # The linear scan that get_exemplar_trip_for_stations used to make over every trip
+    def trip_serves_station(trip: Trip, station: Station):
+        return station in (stop_time.stop.parent_station for stop_time in trip.stop_times)
+
+    return next(
+        (
+            trip
+            for trip in network.trips_by_id.values()
+            if trip_serves_station(trip, first) and trip_serves_station(trip, second)
+        ),
+        None,
+    )
+
+
+def _assert_exemplar_trips_match_scan(network: Network):
+    stations = list(network.stations_by_id.values())
+    for first in stations:
+        for second in stations:
+            expected = _scan_exemplar_trip(network, first, second)
+            if expected is None:
+                with pytest.raises(Exception, match="No exemplar trip"):
+                    get_exemplar_trip_for_stations(network, first, second)
+            else:
+                assert get_exemplar_trip_for_stations(network, first, second) is expected
+
+
+def test_exemplar_trips_match_a_linear_scan(tmp_path):
+    network, stations, generator = _get_trip_network()
+    _assert_exemplar_trips_match_scan(network)
+    # Replacing trips after the index is built moves them to other stations without moving them in order
+    for index in range(0, 30, 4):
+        network.add_trip(_trip(f"t{index}", generator.sample(stations, 3), "pattern-0"))
+    _assert_exemplar_trips_match_scan(network)
+    _assert_exemplar_trips_match_scan(_get_table_network(tmp_path))
+
+
+def test_replaced_trip_leaves_no_stale_entries():
+    network, stations, _ = _get_trip_network()
+    old_trip = network.trips_by_id["t0"]
+    assert old_trip in network.get_trips_for_route_pattern("pattern-0")
+    new_trip = network.add_trip(_trip("t0", stations[:2], "pattern-1"))
+    assert network.get_station_ids_for_trip(new_trip) == {"s0", "s1"}
+    for trips in (
+        list(network.get_trips_serving_stations([])),
+        list(network.get_trips_serving_stations(stations[:1])),
+        network.get_trips_for_route_pattern("pattern-0"),
+        network.get_trips_for_route_pattern("pattern-1"),
+    ):
+        assert all(trip is not old_trip for trip in trips)
+    assert list(network.get_trips_serving_stations([])) == list(network.trips_by_id.values())
+    assert network.get_trips_for_route_pattern("pattern-1") == [
+        trip for trip in network.trips_by_id.values() if trip.route_pattern_id == "pattern-1"
+    ]
+    assert new_trip in network.get_trips_serving_stations(stations[:2])
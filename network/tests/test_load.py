@@ -0,0 +1,64 @@
+import os
+import zipfile
+
+import pytest
+
+import network.load
+from network.build import build_network_from_tables, load_gtfs_tables
+from network.load import GtfsFiles
+from network.tests.test_incremental import FEED, _write_feed
+from network.tests.test_snapshot import _describe_network
+
+
+class _RecordedZipFile(zipfile.ZipFile):
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instances.append(self)
+
+
+@pytest.fixture
+def zip_files(monkeypatch):
+    _RecordedZipFile.instances = []
+    monkeypatch.setattr(network.load, "ZipFile", _RecordedZipFile)
+    return _RecordedZipFile.instances
+
+
+def _write_zipped_feed(tmp_path):
+    # Derived tables like relevant_stop_times.txt stay in the directory next to the feed zip
+    directory_files = _write_feed(tmp_path / "feed", FEED)
+    zip_path = str(tmp_path / "feed.zip")
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for file_name in FEED:
+            if file_name != "relevant_stop_times":
+                zip_file.write(directory_files.get_path(file_name), f"{file_name}.txt")
+                os.remove(directory_files.get_path(file_name))
+    return directory_files, GtfsFiles(directory_path=directory_files.directory_path, zip_path=zip_path)
+
+
+def test_zipped_feed_loads_like_a_directory(tmp_path, zip_files):
+    directory_files = _write_feed(tmp_path / "unzipped", FEED)
+    _, gtfs_files = _write_zipped_feed(tmp_path)
+    assert gtfs_files.get_path("stops") is None
+    assert gtfs_files.get_path("relevant_stop_times")
+    network = build_network_from_tables(load_gtfs_tables(gtfs_files, parallel=False))
+    expected_network = build_network_from_tables(load_gtfs_tables(directory_files, parallel=False))
+    assert _describe_network(network) == _describe_network(expected_network)
+    assert zip_files
+
+
+def test_opening_a_zipped_table_closes_the_zip(tmp_path, zip_files):
+    _, gtfs_files = _write_zipped_feed(tmp_path)
+    load_gtfs_tables(gtfs_files, parallel=False)
+    with gtfs_files.open("stops") as file:
+        assert file.readline().startswith("stop_id")
+        assert any(zip_file.fp for zip_file in zip_files)
+    assert file.closed
+    assert all(zip_file.fp is None for zip_file in zip_files)
+    # An error while reading a table still closes the zip
+    with pytest.raises(StopIteration):
+        with gtfs_files.open("stops") as file:
+            while True:
+                next(file)
+    assert all(zip_file.fp is None for zip_file in zip_files)
@@ -0,0 +1,109 @@
+import random
+
+import numpy as np
+import pytest
+
+from network.shapes import ShapeView, create_shape_views, get_shared_shape_buffer, pack_shapes
+
+
+def _pack(shapes):
+    offsets = np.concatenate([[0], np.cumsum([len(shape) for shape in shapes])]).astype(np.int64)
+    points = np.array([point for shape in shapes for point in shape], dtype=np.float64).reshape(-1, 2)
+    buffer, starts, ends = pack_shapes(points, offsets)
+    return buffer, starts, ends, create_shape_views(buffer, starts, ends)
+
+
+def _line(count, lat=42.35, lon=-71.06):
+    return [(lat + 0.001 * index, lon - 0.001 * index) for index in range(count)]
+
+
+def test_identical_shapes_share_a_window():
+    shape = _line(5)
+    buffer, starts, ends, views = _pack([shape, list(shape), _line(3, lat=40.0)])
+    assert (starts[0], ends[0]) == (starts[1], ends[1])
+    assert len(buffer) == 5 + 3
+    assert views[0] == shape and views[1] == shape
+
+
+def test_contiguous_part_of_a_shape_is_a_window_onto_it():
+    long_shape = _line(10)
+    buffer, starts, ends, views = _pack([long_shape[3:7], long_shape, long_shape[:1], long_shape[-2:]])
+    assert len(buffer) == 10
+    assert starts[0] == starts[1] + 3
+    assert starts[2] == starts[1]
+    assert ends[3] == ends[1]
+    assert [list(view) for view in views] == [long_shape[3:7], long_shape, long_shape[:1], long_shape[-2:]]
+
+
+def test_shapes_that_are_not_contiguous_runs_are_stored_separately():
+    long_shape = _line(6)
+    shapes = [long_shape, long_shape[::2], list(reversed(long_shape[1:4])), long_shape[2:4] + [(0.0, 0.0)]]
+    buffer, _, _, views = _pack(shapes)
+    assert len(buffer) == sum(len(shape) for shape in shapes)
+    assert [list(view) for view in views] == shapes
+
+
+def test_runs_across_the_end_of_a_shape_are_not_windows():
+    # Given back to back, the end of one shape and the start of the next look like a contiguous run
+    first, second = _line(3), _line(4, lat=40.0)
+    shapes = [first, second, first[-1:] + second[:1]]
+    buffer, _, _, views = _pack(shapes)
+    assert len(buffer) == 9
+    assert [list(view) for view in views] == shapes
+
+
+def test_empty_shapes():
+    assert [len(view) for view in _pack([])[3]] == []
+    buffer, _, _, views = _pack([[], [], []])
+    assert len(buffer) == 0
+    assert [list(view) for view in views] == [[], [], []]
+    shape = _line(4)
+    buffer, _, _, views = _pack([[], shape, []])
+    assert len(buffer) == 4
+    assert [list(view) for view in views] == [[], shape, []]
+
+
+def test_random_shapes_pack_and_unpack():
+    generator = random.Random(3)
+    pool = _line(40)
+    shapes = []
+    for _ in range(60):
+        start = generator.randrange(len(pool))
+        shape = pool[start : start + generator.randrange(0, 12)]
+        shapes.append(list(reversed(shape)) if generator.random() < 0.2 else shape)
+    buffer, _, _, views = _pack(shapes)
+    assert len(buffer) < sum(len(shape) for shape in shapes)
+    assert [list(view) for view in views] == shapes
+
+
+def test_shape_view_slices_like_a_list():
+    shape = _line(7)
+    view = _pack([shape, shape[2:5]])[3][0]
+    indices = [None, -9, -7, -3, -1, 0, 1, 3, 6, 7, 9]
+    for start in indices:
+        for stop in indices:
+            for step in (None, 1, 2, -1, -2):
+                expected = shape[start:stop:step]
+                sliced = view[start:stop:step]
+                assert list(sliced) == expected
+                assert sliced == expected
+                assert len(sliced) == len(expected)
+    for index in range(-7, 7):
+        assert view[index] == shape[index]
+    for index in (-8, 7):
+        with pytest.raises(IndexError):
+            view[index]
+    # Slices of slices stay views onto the same buffer
+    inner = view[1:6][1:3]
+    assert isinstance(inner, ShapeView) and inner.buffer is view.buffer
+    assert list(inner) == shape[1:6][1:3]
+
+
+def test_shared_shape_buffer_is_reused_or_packed():
+    shapes = [_line(5), _line(5)[1:3], _line(2, lat=40.0)]
+    buffer, starts, ends, views = _pack(shapes)
+    reused_buffer, reused_starts, reused_ends = get_shared_shape_buffer(views)
+    assert reused_buffer is buffer
+    assert np.array_equal(reused_starts, starts) and np.array_equal(reused_ends, ends)
+    packed_buffer, packed_starts, packed_ends = get_shared_shape_buffer(shapes)
+    assert [list(view) for view in create_shape_views(packed_buffer, packed_starts, packed_ends)] == shapes
@@ -0,0 +1,100 @@
+from dataclasses import fields
+
+from network.build import build_network_from_tables, load_gtfs_tables
+from network.models import Network, StationStop
+from network.snapshot import read_network_snapshot, write_network_snapshot
+from network.tests.test_incremental import FEED, _write_feed
+
+STATION_STOP_FIELDS = [field.name for field in fields(StationStop)]
+TRANSFER_FIELDS = ("min_walk_time", "min_wheelchair_time", "min_transfer_time", "suggested_buffer_time")
+
+
+def _describe_station_stop(station_stop):
+    return {name: getattr(station_stop, name) for name in STATION_STOP_FIELDS}
+
+
+def _describe_network(network: Network):
+    # Plain values for everything a snapshot stores, so that networks can be compared field by field
+    stations = {
+        station.id: (_describe_station_stop(station), [stop.id for stop in station.child_stops])
+        for station in network.stations_by_id.values()
+    }
+    stops = {
+        stop.id: (
+            _describe_station_stop(stop),
+            stop.parent_station.id,
+            [(stop_time.trip.id, int(stop_time.time)) for stop_time in stop.stop_times],
+            [
+                (
+                    transfer.to_stop.id,
+                    *(int(getattr(transfer, field)) for field in TRANSFER_FIELDS),
+                    transfer.wheelchair_transfer,
+                )
+                for transfer in stop.transfers
+            ],
+        )
+        for station in network.stations_by_id.values()
+        for stop in station.child_stops
+    }
+    trips = {
+        trip.id: (
+            trip.route_id,
+            trip.route_pattern_id,
+            trip.direction_id,
+            trip.service.id,
+            trip.shape_id,
+            [(float(lat), float(lon)) for lat, lon in trip.shape],
+        )
+        for trip in network.trips_by_id.values()
+    }
+    services = {
+        service.id: (
+            list(service.days),
+            service.description,
+            service.schedule_name,
+            service.schedule_type,
+            service.schedule_typicality,
+        )
+        for service in network.services_by_id.values()
+    }
+    routes = {
+        route.id: (
+            route.long_name,
+            [(pattern.id, pattern.route.id, pattern.direction) for pattern in route.route_patterns],
+        )
+        for route in network.routes_by_id.values()
+    }
+    return stations, stops, trips, services, routes
+
+
+def test_network_survives_a_snapshot_round_trip(tmp_path):
+    gtfs_files = _write_feed(tmp_path / "feed", FEED)
+    network = build_network_from_tables(load_gtfs_tables(gtfs_files, parallel=False))
+    write_network_snapshot(network, str(tmp_path / "snapshot"))
+    stations, stops, trips, services, routes = _describe_network(read_network_snapshot(str(tmp_path / "snapshot")))
+    expected_stations, expected_stops, expected_trips, expected_services, expected_routes = _describe_network(network)
+    assert stations == expected_stations
+    assert stops == expected_stops
+    assert any(stop_times for _, _, stop_times, _ in stops.values())
+    assert any(transfers for _, _, _, transfers in stops.values())
+    assert trips == expected_trips
+    assert services == expected_services
+    assert routes == expected_routes
+
+
+def test_loaded_network_keeps_one_object_per_stop(tmp_path):
+    gtfs_files = _write_feed(tmp_path / "feed", FEED)
+    network = build_network_from_tables(load_gtfs_tables(gtfs_files, parallel=False))
+    write_network_snapshot(network, str(tmp_path / "snapshot"))
+    loaded = read_network_snapshot(str(tmp_path / "snapshot"))
+    # Stops are reached through trips first, before their stations have been created
+    for trip in loaded.trips_by_id.values():
+        for stop_time in trip.stop_times:
+            child_stops = stop_time.stop.parent_station.child_stops
+            assert any(stop_time.stop is child_stop for child_stop in child_stops)
+    for station in loaded.stations_by_id.values():
+        for stop in station.child_stops:
+            assert stop.parent_station is station
+            assert all(stop_time.stop is stop for stop_time in stop.stop_times)
+    write_network_snapshot(loaded, str(tmp_path / "rewritten"))
+    assert _describe_network(read_network_snapshot(str(tmp_path / "rewritten"))) == _describe_network(network)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from network.time import format_time_column, parse_time_column, seconds_from_string
+
+TIMES = ["5:03:00", "05:03:00", "24:10:00", "25:59:59", "0:00", "23:59", "100:00:00", "-10:00:00", "-11:59:59"]
+
+
+def test_parse_time_column_matches_seconds_from_string():
+    assert list(parse_time_column(TIMES)) == [seconds_from_string(time) for time in TIMES]
+
+
+def test_time_columns_round_trip():
+    seconds = parse_time_column(TIMES)
+    formatted = format_time_column(seconds)
+    assert list(formatted) == [
+        "05:03:00",
+        "05:03:00",
+        "24:10:00",
+        "25:59:59",
+        "00:00:00",
+        "23:59:00",
+        "100:00:00",
+        "-10:00:00",
+        "-11:59:59",
+    ]
+    assert np.array_equal(parse_time_column(formatted), seconds)
+
+
+@pytest.mark.parametrize("time", ["5.03", "1:", "::", ":03:00", "5:3:00", "5:03:0", "5:030", "5", "1:02:03:04", ""])
+def test_parse_time_column_rejects_malformed_times(time):
+    with pytest.raises(ValueError):
+        parse_time_column(["05:03:00", time])
@@ -1,13 +1,100 @@
+from typing import Sequence, Union
 import datetime
 
+import numpy as np
 
-def time_from_string(time_string):
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def seconds_from_string(time_string):
     pieces = [int(x) for x in time_string.split(":")]
     if len(pieces) == 3:
         hours, minutes, seconds = pieces
-        return datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+        return 3600 * hours + 60 * minutes + seconds
     hours, minutes = pieces
-    return datetime.timedelta(hours=hours, minutes=minutes)
+    return 3600 * hours + 60 * minutes
+
+
+def to_seconds(time: Union[int, datetime.timedelta]) -> int:
+    if isinstance(time, datetime.timedelta):
+        return int(time.total_seconds())
+    return int(time)
+
+
+def format_seconds(seconds: int) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return "{:02}:{:02}:{:02}".format(hours, minutes, seconds)
+
+
+def parse_time_column(time_strings: Sequence[str]) -> np.ndarray:
+    # GTFS times run past 24:00 for trips that continue after midnight, so these are seconds since the
+    # start of the service day rather than times of day. Each string is treated as a row of ASCII bytes
+    # and the H:MM[:SS] fields are accumulated column by column across all rows at once.
+    if len(time_strings) == 0:
+        return np.zeros(0, dtype=np.int32)
+    encoded = np.array(time_strings, dtype=np.bytes_)
+    chars = encoded.view(np.uint8).reshape(len(encoded), encoded.dtype.itemsize).astype(np.int32)
+    is_colon = chars == ord(":")
+    is_padding = chars == 0
+    digits = chars - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    # Like seconds_from_string, a leading minus makes the hours negative, which is how format_seconds
+    # writes negative times
+    is_negative = chars[:, 0] == ord("-")
+    is_known = is_colon | is_padding | is_digit
+    is_known[:, 0] |= is_negative
+    colon_counts = is_colon.sum(axis=1)
+    is_valid = np.all(is_known, axis=1) & (colon_counts >= 1) & (colon_counts <= 2)
+    hours_sign = np.where(is_negative, -1, 1)
+    total = np.zeros(len(encoded), dtype=np.int64)
+    field = np.zeros(len(encoded), dtype=np.int64)
+    field_index = np.zeros(len(encoded), dtype=np.int64)
+    field_length = np.zeros(len(encoded), dtype=np.int64)
+    for column in range(chars.shape[1]):
+        digit_here = is_digit[:, column]
+        colon_here = is_colon[:, column]
+        field = np.where(digit_here, field * 10 + digits[:, column], field)
+        field_length += digit_here
+        # Hours can have any number of digits, but minutes and seconds have exactly two
+        is_valid &= ~colon_here | np.where(field_index == 0, field_length > 0, field_length == 2)
+        signed_field = np.where(field_index == 0, hours_sign * field, field)
+        total = np.where(colon_here, total * 60 + signed_field, total)
+        field = np.where(colon_here, 0, field)
+        field_index += colon_here
+        field_length = np.where(colon_here, 0, field_length)
+    is_valid &= field_length == 2
+    if not np.all(is_valid):
+        bad_row = np.flatnonzero(~is_valid)[0]
+        raise ValueError(f"Invalid GTFS time {time_strings[bad_row]!r}")
+    total = total * 60 + field
+    # Times without a seconds field ("H:MM") were accumulated in minutes
+    total = np.where(colon_counts == 1, total * 60, total)
+    return total.astype(np.int32)
+
+
+def format_time_column(seconds: Sequence[int]) -> np.ndarray:
+    seconds = np.asarray(seconds, dtype=np.int64)
+    hours, remainder = np.divmod(seconds, 3600)
+    minutes, secs = np.divmod(remainder, 60)
+    chars = np.empty((len(seconds), 8), dtype=np.uint8)
+    for column, (values, place) in enumerate(
+        ((hours, 10), (hours, 1), (None, 0), (minutes, 10), (minutes, 1), (None, 0), (secs, 10), (secs, 1))
+    ):
+        chars[:, column] = ord(":") if values is None else ord("0") + (values // place) % 10
+    formatted = chars.view("S8").reshape(-1).astype(np.str_)
+    # Negative times and times past 99:59:59 don't fit the fixed width, so format those one at a time into
+    # an array that can hold longer strings
+    unusual = np.flatnonzero((seconds < 0) | (hours > 99))
+    if len(unusual):
+        formatted = formatted.astype(object)
+    for index in unusual:
+        formatted[index] = format_seconds(seconds[index])
+    return formatted
+
+
+def time_from_string(time_string):
+    return datetime.timedelta(seconds=seconds_from_string(time_string))
 
 
 def time_range_from_string(time_string):
@@ -17,11 +104,7 @@ def time_range_from_string(time_string):
 
 
 def stringify_timedelta(td):
-    seconds = td.total_seconds()
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    seconds = seconds % 60
-    return "{:02}:{:02}:{:02}".format(int(hours), int(minutes), int(seconds))
+    return format_seconds(to_seconds(td))
 
 
 DAYS_OF_WEEK = [
@@ -0,0 +1,99 @@
+from importlib import import_module
+
+import click
+
+from scheduler.optimize import OPTIMIZER_MODES
+from scheduler.options import SCHEDULER_ENGINES, SchedulerOptions
+from synthesize.write_gtfs import archive_scenario_gtfs
+
+
+def load_scenario_module(name: str):
+    # Each scenario package keeps its subgraphs and output name in a scenario module
+    try:
+        return import_module(f"scenarios.{name}.scenario")
+    except ModuleNotFoundError as e:
+        if e.name and e.name.startswith(f"scenarios.{name}"):
+            raise click.BadParameter(f"No scenario named {name}", param_hint="NAME")
+        raise
+
+
+def write_scenario(name: str, options: SchedulerOptions = None) -> str:
+    from synthesize.evaluate import evaluate_scenario
+    from synthesize.write_gtfs import write_scenario_gtfs
+
+    scenario_module = load_scenario_module(name)
+    scenario = evaluate_scenario(scenario_module.subgraphs, options)
+    write_scenario_gtfs(scenario, scenario_module.gtfs_name)
+    return scenario_module.gtfs_name
+
+
+def archive_scenario(name: str, gtfs_name: str = None):
+    gtfs_name = gtfs_name or load_scenario_module(name).gtfs_name
+    archive_scenario_gtfs("gtfs-present")
+    archive_scenario_gtfs(gtfs_name)
+
+
+def _parse_subgraph_engines(ctx, param, values):
+    subgraph_engines = {}
+    for value in values:
+        route_id, _, engine = value.partition("=")
+        if engine not in SCHEDULER_ENGINES:
+            raise click.BadParameter(f"Expected ROUTE_ID=ENGINE with ENGINE one of {', '.join(SCHEDULER_ENGINES)}")
+        subgraph_engines[route_id] = engine
+    return subgraph_engines
+
+
+def scheduler_options(command):
+    command = click.option(
+        "--subgraph-engine",
+        "subgraph_engines",
+        multiple=True,
+        callback=_parse_subgraph_engines,
+        metavar="ROUTE_ID=ENGINE",
+        help="Schedule the subgraph holding this route with another engine",
+    )(command)
+    command = click.option(
+        "--time-budget",
+        default=30.0,
+        show_default=True,
+        help="Seconds the joint and beam engines may spend on each set of frequencies in a subgraph",
+    )(command)
+    command = click.option(
+        "--beam-width", default=8, show_default=True, help="States the beam engine keeps at each step of its search"
+    )(command)
+    command = click.option("--engine", type=click.Choice(SCHEDULER_ENGINES), default="orderings", show_default=True)(
+        command
+    )
+    command = click.option(
+        "--processes",
+        default=1,
+        show_default=True,
+        help="Search for and solve candidate orderings on this many processes",
+    )(command)
+    command = click.option(
+        "--optimizer-mode", type=click.Choice(OPTIMIZER_MODES), default="parametric", show_default=True
+    )(command)
+    return command
+
+
+@click.command()
+@click.argument("name")
+@scheduler_options
+def run(name: str, **options):
+    """Schedule a scenario, write it out as GTFS, and archive it"""
+    archive_scenario(name, write_scenario(name, SchedulerOptions(**options)))
+
+
+@click.command()
+@click.argument("name")
+@scheduler_options
+def write(name: str, **options):
+    """Schedule a scenario and write it out as GTFS"""
+    write_scenario(name, SchedulerOptions(**options))
+
+
+@click.command()
+@click.argument("name")
+def archive(name: str):
+    """Archive the present GTFS and a scenario's GTFS that has already been written"""
+    archive_scenario(name)
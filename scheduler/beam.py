@@ -0,0 +1,166 @@
+from dataclasses import replace
+from typing import Dict, Iterator, List
+import math
+import time
+
+from synthesize.util import get_pairs
+
+from scheduler.joint import JointProgram, solve_first_feasible_ordering
+from scheduler.optimize import ParametricProgram, SolveStats, is_better_value
+from scheduler.ordering import (
+    Arrival,
+    Ordering,
+    OrderingState,
+    SearchStats,
+    get_initial_ordering_state,
+    get_next_ordering_states,
+    get_ordering,
+    get_symmetry_predecessors,
+)
+from scheduler.scheduling_problem import SchedulingProblem
+
+# The share of the time budget held back for the lower bound that the gap is measured against
+BOUND_SHARE = 0.25
+
+
+def get_arrival_counts_by_node_id(problem: SchedulingProblem) -> Dict[str, int]:
+    counts = {}
+    for service_id, service in problem.services.items():
+        for node in service.calls_at_nodes:
+            counts[node.id] = counts.get(node.id, 0) + problem.trips_per_period[service_id]
+    return counts
+
+
+def score_ordering_state(state: OrderingState, problem: SchedulingProblem, arrival_counts: Dict[str, int]):
+    # Arrivals can only be slotted in between the ones a state already has, so a gap between two of them
+    # that can't reach the desired headway only gets worse, and once a node has all of its arrivals none of
+    # its gaps can change
+    arrival_ordering: Dict[str, List[Arrival]] = state.arrival_orderings[0]
+    score = 0
+    for node_id, arrivals in arrival_ordering.items():
+        count = arrival_counts[node_id]
+        if count < 2:
+            continue
+        desired_gap = problem.period // count
+        is_complete = len(arrivals) == count
+        for first, second in get_pairs(arrivals):
+            longest = second.range.upper - first.range.lower
+            shortest = max(second.range.lower - first.range.upper, problem.exclusion_time)
+            if longest < desired_gap:
+                score += (desired_gap - longest) ** 2 / count
+            elif is_complete and shortest > desired_gap:
+                score += (shortest - desired_gap) ** 2 / count
+    return score
+
+
+def _get_ordering_key(ordering: Ordering):
+    return (
+        tuple(service.id for service in ordering.dispatch_ordering),
+        tuple(
+            (node.id, tuple((index, service.id) for index, service in arrivals))
+            for node, arrivals in ordering.arrival_orderings.items()
+        ),
+    )
+
+
+class BeamSearch:
+    # Searches the same OrderingStates as get_orderings, but level by level, keeping only the beam_width
+    # states at each level that score_ordering_state likes best. Each pass widens the beam, starting from a
+    # single greedy dive, until a pass drops nothing, which means it has seen every ordering, or deadline
+    # passes, even if no ordering has been found by then.
+    def __init__(self, problem: SchedulingProblem, beam_width: int, deadline: float, stats: SearchStats = None):
+        self.problem = problem
+        self.beam_width = beam_width
+        self.deadline = deadline
+        self.stats = stats or SearchStats()
+        self.predecessors = get_symmetry_predecessors(problem)
+        self.arrival_counts = get_arrival_counts_by_node_id(problem)
+        self.complete = False
+        self.found = 0
+
+    def _is_out_of_time(self):
+        return time.perf_counter() > self.deadline
+
+    def _get_children(self, state: OrderingState):
+        # Each arrival ordering of a child is scored, and kept or dropped, on its own
+        for child in get_next_ordering_states(state, self.problem, self.predecessors):
+            for arrival_ordering in child.arrival_orderings:
+                yield replace(child, arrival_orderings=[arrival_ordering], origins=[()])
+
+    def _search(self, width: int) -> Iterator[Ordering]:
+        frontier = [get_initial_ordering_state(self.problem)]
+        dropped = 0
+        while frontier:
+            children = []
+            for state in frontier:
+                if self._is_out_of_time():
+                    return
+                self.stats.expanded += 1
+                children += self._get_children(state)
+            unfinished = []
+            for child in children:
+                if child.finished:
+                    yield get_ordering(child.dispatch_ordering, child.arrival_orderings[0], self.problem)
+                else:
+                    unfinished.append(child)
+            scores = [score_ordering_state(child, self.problem, self.arrival_counts) for child in unfinished]
+            ranked = sorted(range(len(unfinished)), key=lambda index: scores[index])
+            frontier = [unfinished[index] for index in ranked[:width]]
+            dropped += len(ranked) - len(frontier)
+        self.stats.dropped += dropped
+        self.complete = dropped == 0
+
+    def __iter__(self) -> Iterator[Ordering]:
+        seen = set()
+        width = 1
+        while not self.complete and not self._is_out_of_time():
+            for ordering in self._search(width):
+                key = _get_ordering_key(ordering)
+                if key not in seen:
+                    seen.add(key)
+                    self.found += 1
+                    yield ordering
+            width = self.beam_width if width < self.beam_width else 2 * width
+
+
+def solve_departure_offsets_with_beam(
+    problem: SchedulingProblem,
+    beam_width: int,
+    time_budget: float,
+    debug=True,
+    stats: SolveStats = None,
+):
+    start = time.perf_counter()
+    problem_stats = SolveStats()
+    program = ParametricProgram(problem)
+    search = BeamSearch(problem, beam_width, start + time_budget * (1 - BOUND_SHARE), problem_stats.search)
+    best_value, best_ordering, best_offsets, best_arrivals = math.inf, None, None, None
+    for ordering in search:
+        problem_stats.orderings += 1
+        value, offsets, arrivals = program.solve(ordering, problem_stats)
+        if is_better_value(value, best_value):
+            best_value, best_ordering, best_offsets, best_arrivals = value, ordering, offsets, arrivals
+    # A beam can drop every state that leads to a feasible ordering, and run out of time before it finds one
+    fell_back = best_offsets is None and not search.complete
+    if fell_back:
+        best_value, best_ordering, best_offsets, best_arrivals = solve_first_feasible_ordering(
+            problem, program, problem_stats
+        )
+    if best_offsets is None:
+        raise Exception(f"Beam search found no feasible ordering for {problem.trips_per_period}")
+    time_left = start + time_budget - time.perf_counter()
+    lower_bound = JointProgram(problem).get_lower_bound(max(time_left, 0), best_value, problem_stats)
+    gap = (best_value - lower_bound) / best_value if best_value > lower_bound else 0
+    if stats:
+        stats.merge(problem_stats)
+    if debug:
+        print("---------")
+        print(best_ordering)
+        print(
+            f"Optimized with a beam search in {time.perf_counter() - start:.2f}s "
+            f"({'complete' if search.complete else 'fell back' if fell_back else 'incomplete'}), {problem_stats}, "
+            f"value {best_value:.2f} with lower bound {lower_bound:.2f}, gap {gap:.1%}"
+        )
+        for node_id, arrivals in (best_arrivals or {}).items():
+            print(node_id, [a // 60 for a in arrivals])
+    return best_offsets
@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from scheduler.network import Node, Service
+from scheduler.ordering import Ordering
+from scheduler.scheduling_problem import SchedulingProblem
+
+
+class ProblemLayout:
+    # How the departure-offset program for a SchedulingProblem is laid out: one offset per service, and one
+    # row per pair of consecutive arrivals at a node holding the gap between them. Rows are grouped by node,
+    # and their number and weights depend only on the problem, never on the ordering.
+    def __init__(self, problem: SchedulingProblem):
+        self.problem = problem
+        self.service_ids = list(problem.services.keys())
+        self.service_indices = {service_id: index for index, service_id in enumerate(self.service_ids)}
+        self.headways = np.array([problem.get_service_headway(service_id) for service_id in self.service_ids])
+        self.arrival_counts: Dict[Node, int] = {}
+        for node in problem.nodes.values():
+            count = sum(
+                problem.trips_per_period[service.id]
+                for service in problem.services.values()
+                if node in service.calls_at_nodes
+            )
+            if count:
+                self.arrival_counts[node] = count
+        row_weights, row_desired_gaps, node_row_starts = [], [], []
+        for count in self.arrival_counts.values():
+            if count > 1:
+                node_row_starts.append(len(row_weights))
+            row_weights += [1 / count] * (count - 1)
+            row_desired_gaps += [problem.period // count] * (count - 1)
+        self.row_weights = np.array(row_weights)
+        self.row_desired_gaps = np.array(row_desired_gaps)
+        self.node_row_starts = np.array(node_row_starts, dtype=np.int64)
+
+    @property
+    def service_count(self):
+        return len(self.service_ids)
+
+    @property
+    def row_count(self):
+        return len(self.row_weights)
+
+    def get_arrival_time_constant(self, service: Service, index: int, node: Node):
+        trip_time = service.trip_time_to_node_seconds(node)
+        if trip_time is None:
+            raise ValueError("Got invalid trip time")
+        return self.problem.get_service_headway(service) * index + trip_time
+
+    def get_dispatch_indices(self, ordering: Ordering) -> List[int]:
+        return [self.service_indices[service.id] for service in ordering.dispatch_ordering]
+
+    def get_gap_rows(self, ordering: Ordering) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Row r holds offsets[seconds[r]] - offsets[firsts[r]] + constants[r]
+        firsts = np.zeros(self.row_count, dtype=np.int64)
+        seconds = np.zeros(self.row_count, dtype=np.int64)
+        constants = np.zeros(self.row_count)
+        row = 0
+        for node, count in self.arrival_counts.items():
+            arrivals = ordering.arrival_orderings[node]
+            assert len(arrivals) == count, f"Expected {count} arrivals at {node}, got {len(arrivals)}"
+            for index in range(count - 1):
+                first_index, first = arrivals[index]
+                second_index, second = arrivals[index + 1]
+                firsts[row] = self.service_indices[first.id]
+                seconds[row] = self.service_indices[second.id]
+                constants[row] = self.get_arrival_time_constant(
+                    second, second_index, node
+                ) - self.get_arrival_time_constant(first, first_index, node)
+                row += 1
+        return firsts, seconds, constants
+
+
+def _get_difference_ranges(firsts, seconds, dispatch_positions, upper_offsets):
+    # Range of offsets[seconds] - offsets[firsts], given that every offset is at least zero and that offsets
+    # never decrease along the dispatch ordering
+    rows = np.arange(len(firsts))[:, None]
+    second_is_later = dispatch_positions[rows, seconds] > dispatch_positions[rows, firsts]
+    second_is_earlier = dispatch_positions[rows, seconds] < dispatch_positions[rows, firsts]
+    lower = np.where(second_is_earlier, -upper_offsets[rows, firsts], 0)
+    upper = np.where(second_is_later, upper_offsets[rows, seconds], 0)
+    return lower, upper
+
+
+def _get_squared_distances(values, lower, upper):
+    return np.maximum(np.maximum(lower - values, values - upper), 0) ** 2
+
+
+def get_lower_bounds(layout: ProblemLayout, orderings: List[Ordering]) -> np.ndarray:
+    # Bounds the objective of each ordering from below without solving anything. Each offset can only range
+    # between zero and the smallest headway of any service dispatched at or after it, which bounds every
+    # gap. A node's term is then at least what its gaps would score on their own, and by Cauchy-Schwarz at
+    # least what the total of its gaps allows. An ordering whose gaps can't clear exclusion_time gets inf.
+    count = len(orderings)
+    if count == 0 or layout.row_count == 0:
+        return np.zeros(count)
+    dispatch_orders = np.array([layout.get_dispatch_indices(ordering) for ordering in orderings], dtype=np.int64)
+    rows = [layout.get_gap_rows(ordering) for ordering in orderings]
+    firsts, seconds, constants = (np.array([row[field] for row in rows]) for field in range(3))
+    ordering_rows = np.arange(count)[:, None]
+    dispatch_positions = np.zeros((count, layout.service_count), dtype=np.int64)
+    dispatch_positions[ordering_rows, dispatch_orders] = np.arange(layout.service_count)
+    suffix_headways = np.minimum.accumulate((layout.headways[dispatch_orders] - 1)[:, ::-1], axis=1)[:, ::-1]
+    suffix_headways[:, 0] = 0
+    upper_offsets = np.zeros((count, layout.service_count))
+    upper_offsets[ordering_rows, dispatch_orders] = suffix_headways
+    lower, upper = _get_difference_ranges(firsts, seconds, dispatch_positions, upper_offsets)
+    gap_lower = np.maximum(constants + lower, layout.problem.exclusion_time)
+    gap_upper = constants + upper
+    infeasible = np.any(gap_upper < gap_lower, axis=1)
+    row_bounds = layout.row_weights * _get_squared_distances(layout.row_desired_gaps, gap_lower, gap_upper)
+    node_row_bounds = np.add.reduceat(row_bounds, layout.node_row_starts, axis=1)
+    # The gaps at a node add up to the time between its first and last arrivals
+    node_row_ends = np.append(layout.node_row_starts[1:], layout.row_count)
+    node_row_counts = node_row_ends - layout.node_row_starts
+    span_lower, span_upper = _get_difference_ranges(
+        firsts[:, layout.node_row_starts], seconds[:, node_row_ends - 1], dispatch_positions, upper_offsets
+    )
+    span_constants = np.add.reduceat(constants, layout.node_row_starts, axis=1)
+    span_lower = np.maximum(span_constants + span_lower, np.add.reduceat(gap_lower, layout.node_row_starts, axis=1))
+    span_upper = np.minimum(span_constants + span_upper, np.add.reduceat(gap_upper, layout.node_row_starts, axis=1))
+    node_weights = layout.row_weights[layout.node_row_starts]
+    node_desired_spans = layout.row_desired_gaps[layout.node_row_starts] * node_row_counts
+    node_span_bounds = (
+        node_weights * _get_squared_distances(node_desired_spans, span_lower, span_upper) / node_row_counts
+    )
+    bounds = np.maximum(node_row_bounds, node_span_bounds).sum(axis=1)
+    bounds[infeasible | np.any(span_upper < span_lower, axis=1)] = np.inf
+    return bounds
@@ -7,9 +7,12 @@ from synthesize.definitions import Route, RoutePattern, Service, Frequencies, Ti
 from synthesize.util import listify, get_pairs
 
 from scheduler.network import create_scheduler_network, SchedulerNetwork
+from scheduler.options import SchedulerOptions
 from scheduler.scheduling_problem import SchedulingProblem
+from scheduler.beam import solve_departure_offsets_with_beam
+from scheduler.joint import solve_departure_offsets_jointly
 from scheduler.ordering import get_orderings
-from scheduler.optimize import solve_departure_offsets_for_orderings
+from scheduler.optimize import SolveStats, solve_departure_offsets_for_orderings
 
 
 @listify
@@ -71,7 +74,11 @@ def _get_dispatch_times(tph: int, dispatch_offset: int, rng: TimeRange) -> List[
 
 
 # Important function
-def _create_departure_offset_getter(network: SchedulerNetwork) -> Dict[str, int]:
+def _create_departure_offset_getter(
+    network: SchedulerNetwork,
+    options: SchedulerOptions,
+    stats: SolveStats = None,
+) -> Dict[str, int]:
     tph_dict_cache = {}
 
     def get_departure_offsets(route_pattern_id_to_tph: Dict[str, int]):
@@ -83,20 +90,36 @@ def _create_departure_offset_getter(network: SchedulerNetwork) -> Dict[str, int]
             trips_per_period=route_pattern_id_to_tph,
             network=network,
         )
-        orderings = get_orderings(problem)
-        offsets = solve_departure_offsets_for_orderings(problem, orderings)
+        if options.engine == "joint":
+            offsets = solve_departure_offsets_jointly(problem, options.time_budget, stats=stats)
+        elif options.engine == "beam":
+            offsets = solve_departure_offsets_with_beam(problem, options.beam_width, options.time_budget, stats=stats)
+        else:
+            orderings = get_orderings(problem, stats.search if stats else None, processes=options.processes)
+            offsets = solve_departure_offsets_for_orderings(
+                problem,
+                orderings,
+                mode=options.optimizer_mode,
+                processes=options.processes,
+                stats=stats,
+            )
         tph_dict_cache[key] = offsets
         return offsets
 
     return get_departure_offsets
 
 
-def create_departure_getter_for_subgraph(subgraph: List[Route]):
+def create_departure_getter_for_subgraph(
+    subgraph: List[Route],
+    options: SchedulerOptions = None,
+    stats: SolveStats = None,
+):
+    options = (options or SchedulerOptions()).for_subgraph([route.id for route in subgraph])
     route_patterns = _get_route_patterns(subgraph)
     scheduler_network = create_scheduler_network(route_patterns)
     reverse_scheduler_network = scheduler_network.reverse()
-    get_departure_offsets = _create_departure_offset_getter(scheduler_network)
-    get_reverse_departure_offsets = _create_departure_offset_getter(reverse_scheduler_network)
+    get_departure_offsets = _create_departure_offset_getter(scheduler_network, options, stats)
+    get_reverse_departure_offsets = _create_departure_offset_getter(reverse_scheduler_network, options, stats)
 
     def get_departures_for_service(service: Service):
         constant_frequency_ranges = _get_constant_frequency_time_ranges(
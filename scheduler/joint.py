@@ -0,0 +1,306 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+import math
+import time
+
+import numpy as np
+
+from scheduler.bounds import ProblemLayout
+from scheduler.network import Node, Service
+from scheduler.optimize import ParametricProgram, SolveStats
+from scheduler.ordering import Ordering, get_orderings, get_symmetry_predecessors
+from scheduler.scheduling_problem import SchedulingProblem
+
+# Stop once the best ordering found is within this fraction of the lower bound on every ordering
+JOINT_TOLERANCE = 1e-4
+MAX_JOINT_ITERATIONS = 100
+
+
+@dataclass
+class NodeBlock:
+    # The part of the joint program for one node: a binary x[p, k] for whether arrival p is the kth to reach
+    # the node, the time t[k] of the kth arrival, and an upper bound z[k] on the weighted squared error of the
+    # gap between the kth and k+1th arrivals
+    node: Node
+    arrivals: List[Tuple[int, Service]]
+    positions: int
+    times: int
+    gaps: int
+    weight: float
+    desired_gap: float
+    cut_points: Set[float] = field(default_factory=set)
+
+    @property
+    def count(self):
+        return len(self.arrivals)
+
+    def get_position_column(self, arrival: int, position: int):
+        return self.positions + arrival * self.count + position
+
+
+class _ConstraintRows:
+    def __init__(self):
+        self.rows, self.columns, self.values = [], [], []
+        self.lower, self.upper = [], []
+
+    def add(self, coefficients: List[Tuple[int, float]], lower: float, upper: float):
+        row = len(self.lower)
+        for column, value in coefficients:
+            self.rows.append(row)
+            self.columns.append(column)
+            self.values.append(value)
+        self.lower.append(lower)
+        self.upper.append(upper)
+
+    def extend(self, other: "_ConstraintRows"):
+        offset = len(self.lower)
+        self.rows += [row + offset for row in other.rows]
+        self.columns += other.columns
+        self.values += other.values
+        self.lower += other.lower
+        self.upper += other.upper
+
+    def to_constraint(self, column_count: int):
+        from scipy.optimize import LinearConstraint
+        from scipy.sparse import csr_array
+
+        matrix = csr_array((self.values, (self.rows, self.columns)), shape=(len(self.lower), column_count))
+        return LinearConstraint(matrix, self.lower, self.upper)
+
+
+class JointProgram:
+    # Picks an ordering and its departure offsets together. Which arrival comes kth at each node is a
+    # binary choice, linked to the arrival times with big-M constraints, so every ordering that the
+    # enumeration in get_orderings could produce is a point of one MILP. HiGHS can't take the quadratic
+    # objective into a MILP, so it is replaced by tangent cuts that bound it from below. The ordering that
+    # each MILP picks is then solved exactly with a ParametricProgram, and the cuts are tightened around
+    # its gaps until the exact value of the best ordering meets the MILP's bound.
+    def __init__(self, problem: SchedulingProblem, layout: ProblemLayout = None):
+        self.problem = problem
+        self.layout = layout or ProblemLayout(problem)
+        self.program = ParametricProgram(problem, self.layout)
+        headways = self.layout.headways
+        lower, upper = [0.0] * self.layout.service_count, list(headways - 1.0)
+        integrality = [0] * self.layout.service_count
+        self.blocks: List[NodeBlock] = []
+        self.rows = _ConstraintRows()
+        for node, count in self.layout.arrival_counts.items():
+            if count < 2:
+                continue
+            arrivals = [
+                (index, service)
+                for service in problem.services.values()
+                if node in service.calls_at_nodes
+                for index in range(problem.trips_per_period[service.id])
+            ]
+            block = NodeBlock(
+                node=node,
+                arrivals=arrivals,
+                positions=len(lower),
+                times=len(lower) + count * count,
+                gaps=len(lower) + count * count + count,
+                weight=1 / count,
+                desired_gap=problem.period // count,
+            )
+            constants = [self.layout.get_arrival_time_constant(service, index, node) for index, service in arrivals]
+            earliest = constants
+            latest = [
+                constant + headways[self.layout.service_indices[service.id]] - 1
+                for constant, (_, service) in zip(constants, arrivals)
+            ]
+            # The kth arrival has k arrivals, each at least exclusion_time apart, ahead of it
+            exclusion_time = problem.exclusion_time
+            lower += [0] * count * count
+            lower += [min(earliest) + position * exclusion_time for position in range(count)] + [0] * (count - 1)
+            upper += [1] * count * count
+            upper += [max(latest) - (count - 1 - position) * exclusion_time for position in range(count)]
+            upper += [np.inf] * (count - 1)
+            integrality += [1] * count * count + [0] * (2 * count - 1)
+            self._add_block_rows(block, constants, earliest, latest)
+            self.blocks.append(block)
+            for point in (exclusion_time, block.desired_gap / 2, block.desired_gap, 1.5 * block.desired_gap):
+                block.cut_points.add(max(point, exclusion_time))
+        # Equivalent services can swap offsets without changing anything, so they are dispatched in order
+        for service_id, predecessor in get_symmetry_predecessors(problem).items():
+            service_indices = self.layout.service_indices
+            self.rows.add([(service_indices[predecessor], 1), (service_indices[service_id], -1)], -np.inf, 0)
+        self.column_count = len(lower)
+        self.lower, self.upper = np.array(lower, dtype=float), np.array(upper, dtype=float)
+        self.integrality = np.array(integrality)
+        self.objective = np.zeros(self.column_count)
+        for block in self.blocks:
+            self.objective[block.gaps : block.gaps + block.count - 1] = 1
+
+    def _add_block_rows(self, block: NodeBlock, constants: List[float], earliest: List[float], latest: List[float]):
+        count, rows = block.count, self.rows
+        latest_time, earliest_time = max(latest), min(earliest)
+        for arrival, (index, service) in enumerate(block.arrivals):
+            offset = self.layout.service_indices[service.id]
+            rows.add([(block.get_position_column(arrival, position), 1) for position in range(count)], 1, 1)
+            for position in range(count):
+                column, time_column = block.get_position_column(arrival, position), block.times + position
+                # t[k] is the arrival time of whichever arrival has x[p, k] set
+                above = latest_time - earliest[arrival]
+                below = latest[arrival] - earliest_time
+                rows.add([(time_column, 1), (offset, -1), (column, above)], -np.inf, constants[arrival] + above)
+                rows.add([(time_column, 1), (offset, -1), (column, -below)], constants[arrival] - below, np.inf)
+            if index > 0:
+                # Trips of one service reach a node in the order they were dispatched
+                rows.add(
+                    [(block.get_position_column(arrival - 1, position), position) for position in range(count)]
+                    + [(block.get_position_column(arrival, position), -position) for position in range(count)],
+                    -np.inf,
+                    -1,
+                )
+        for position in range(count):
+            rows.add([(block.get_position_column(arrival, position), 1) for arrival in range(count)], 1, 1)
+        for position in range(count - 1):
+            rows.add(
+                [(block.times + position + 1, 1), (block.times + position, -1)], self.problem.exclusion_time, np.inf
+            )
+
+    def _get_cut_rows(self):
+        # z[k] >= w * (g - d)^2 is bounded from below by its tangent at each point g0, which comes out as
+        # z[k] - 2w(g0 - d)g >= w(d^2 - g0^2) for the gap g = t[k + 1] - t[k]
+        rows = _ConstraintRows()
+        for block in self.blocks:
+            weight, desired_gap = block.weight, block.desired_gap
+            for point in sorted(block.cut_points):
+                slope = 2 * weight * (point - desired_gap)
+                for position in range(block.count - 1):
+                    rows.add(
+                        [
+                            (block.gaps + position, 1),
+                            (block.times + position + 1, -slope),
+                            (block.times + position, slope),
+                        ],
+                        weight * (desired_gap**2 - point**2),
+                        np.inf,
+                    )
+        return rows
+
+    def _add_cut_points(self, block_gaps: List[np.ndarray]):
+        for block, gaps in zip(self.blocks, block_gaps):
+            block.cut_points.update(round(float(gap), 3) for gap in gaps)
+
+    def _get_block_gaps(self, solution: np.ndarray):
+        return [np.diff(solution[block.times : block.times + block.count]) for block in self.blocks]
+
+    def _get_ordering(self, solution: np.ndarray) -> Ordering:
+        offsets = solution[: self.layout.service_count]
+        dispatch_ordering = [
+            self.problem.services[self.layout.service_ids[index]] for index in np.argsort(offsets, kind="stable")
+        ]
+        arrival_orderings: Dict[Node, List[Tuple[int, Service]]] = {}
+        blocks_by_node = {block.node: block for block in self.blocks}
+        for node in self.problem.nodes.values():
+            block = blocks_by_node.get(node)
+            if block is None:
+                arrival_orderings[node] = [
+                    (0, service) for service in self.problem.services.values() if node in service.calls_at_nodes
+                ]
+                continue
+            positions = solution[block.positions : block.positions + block.count**2].reshape(block.count, block.count)
+            arrival_orderings[node] = [block.arrivals[arrival] for arrival in np.argmax(positions, axis=0)]
+        return Ordering(dispatch_ordering=dispatch_ordering, arrival_orderings=arrival_orderings)
+
+    def _get_program_block_gaps(self, ordering: Ordering):
+        firsts, seconds, constants = self.layout.get_gap_rows(ordering)
+        offsets = self.program.offsets.value
+        gaps = offsets[seconds] - offsets[firsts] + constants
+        starts = self.layout.node_row_starts
+        return np.split(gaps, starts[1:])
+
+    def _solve_milp(self, stats: SolveStats = None, **options):
+        from scipy.optimize import Bounds, milp
+
+        constraint_rows = _ConstraintRows()
+        constraint_rows.extend(self.rows)
+        constraint_rows.extend(self._get_cut_rows())
+        start = time.perf_counter()
+        result = milp(
+            self.objective,
+            integrality=self.integrality,
+            bounds=Bounds(self.lower, self.upper),
+            constraints=constraint_rows.to_constraint(self.column_count),
+            options={"mip_rel_gap": JOINT_TOLERANCE / 10, **options},
+        )
+        if stats:
+            stats.add_milp_solve(time.perf_counter() - start)
+        return result
+
+    def get_lower_bound(self, time_limit: float, value: float = math.inf, stats: SolveStats = None) -> float:
+        # The bound from each MILP holds for every ordering, and HiGHS still has one if it runs out of time.
+        # Cutting at the gaps each MILP picks only tightens it, until it meets value or time runs out.
+        deadline = time.perf_counter() + time_limit
+        lower_bound = 0
+        for _ in range(MAX_JOINT_ITERATIONS):
+            result = self._solve_milp(stats, time_limit=max(deadline - time.perf_counter(), 0))
+            if result.status == 2:
+                return math.inf
+            lower_bound = max(lower_bound, result.mip_dual_bound or 0)
+            if result.x is None or value - lower_bound <= JOINT_TOLERANCE * max(1, abs(value)):
+                break
+            cut_point_count = sum(len(block.cut_points) for block in self.blocks)
+            self._add_cut_points(self._get_block_gaps(result.x))
+            if time.perf_counter() > deadline or cut_point_count == sum(len(b.cut_points) for b in self.blocks):
+                break
+        return lower_bound
+
+    def solve(self, stats: SolveStats = None, time_limit: float = math.inf):
+        # Out of time, HiGHS returns the best ordering it has found so far, or none at all
+        deadline = time.perf_counter() + time_limit
+        best_value, best_ordering, best_offsets, best_arrivals = math.inf, None, None, None
+        lower_bound = -math.inf
+        for _ in range(MAX_JOINT_ITERATIONS):
+            result = self._solve_milp(stats, time_limit=max(deadline - time.perf_counter(), 0))
+            if result.x is None:
+                break
+            if result.mip_dual_bound is not None:
+                lower_bound = max(lower_bound, result.mip_dual_bound)
+            ordering = self._get_ordering(result.x)
+            value, offsets, arrivals = self.program.solve(ordering, stats)
+            if value < best_value:
+                best_value, best_ordering, best_offsets, best_arrivals = value, ordering, offsets, arrivals
+            if best_value - lower_bound <= JOINT_TOLERANCE * max(1, abs(best_value)):
+                break
+            self._add_cut_points(self._get_block_gaps(result.x))
+            if not math.isinf(value):
+                self._add_cut_points(self._get_program_block_gaps(ordering))
+            if time.perf_counter() > deadline:
+                break
+        return best_value, lower_bound, best_ordering, best_offsets, best_arrivals
+
+
+def solve_first_feasible_ordering(problem: SchedulingProblem, program: ParametricProgram, stats: SolveStats):
+    # The depth-first search in get_orderings backtracks, so it keeps going until it finds a feasible ordering
+    for ordering in get_orderings(problem, stats.search):
+        stats.orderings += 1
+        value, offsets, arrivals = program.solve(ordering, stats)
+        if offsets is not None:
+            return value, ordering, offsets, arrivals
+    return math.inf, None, None, None
+
+
+def solve_departure_offsets_jointly(
+    problem: SchedulingProblem,
+    time_limit: float = math.inf,
+    debug=True,
+    stats: SolveStats = None,
+):
+    problem_stats = SolveStats()
+    program = JointProgram(problem)
+    value, lower_bound, ordering, offsets, arrivals = program.solve(problem_stats, time_limit)
+    if offsets is None:
+        value, ordering, offsets, arrivals = solve_first_feasible_ordering(problem, program.program, problem_stats)
+    if offsets is None:
+        raise Exception(f"Found no feasible ordering for {problem.trips_per_period}")
+    if stats:
+        stats.merge(problem_stats)
+    if debug:
+        print("---------")
+        print(ordering)
+        print(f"Optimized jointly, {problem_stats}, value {value:.2f} with lower bound {lower_bound:.2f}")
+        for node_id, node_arrivals in (arrivals or {}).items():
+            print(node_id, [a // 60 for a in node_arrivals])
+    return offsets
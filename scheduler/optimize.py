@@ -1,11 +1,19 @@
-from typing import List
-from dataclasses import dataclass
-import cvxpy as cp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass, field
+from functools import partial
+import math
+import multiprocessing
+import sys
+import time
+
+import numpy as np
 
 from synthesize.util import get_pairs, listify
 
+from scheduler.bounds import ProblemLayout, get_lower_bounds
 from scheduler.network import Service, Node
-from scheduler.ordering import Ordering
+from scheduler.ordering import Ordering, SearchStats
 from scheduler.scheduling_problem import SchedulingProblem
 
 
@@ -21,6 +29,8 @@ class OptimizeContext:
         existing = self._variables.get(name)
         if existing:
             return existing
+        import cvxpy as cp
+
         variable = cp.Variable(name=name, **kwargs)
         self._variables[name] = variable
         return variable
@@ -95,12 +105,60 @@ def get_scheduler_objective(ctx: OptimizeContext):
     return obj
 
 
-def solve_departure_offsets(problem: SchedulingProblem, ordering: Ordering):
+@dataclass
+class SolveStats:
+    orderings: int = 0
+    solves: int = 0
+    pruned: int = 0
+    milp_solves: int = 0
+    canonicalize: float = 0
+    solve: float = 0
+    search: SearchStats = field(default_factory=SearchStats)
+
+    def add_solve(self, cvx_problem, elapsed: float):
+        compilation_time = cvx_problem.compilation_time or 0
+        self.canonicalize += compilation_time
+        self.solve += elapsed - compilation_time
+        self.solves += 1
+
+    def add_milp_solve(self, elapsed: float):
+        self.solve += elapsed
+        self.milp_solves += 1
+
+    def merge(self, other: "SolveStats"):
+        self.orderings += other.orderings
+        self.solves += other.solves
+        self.pruned += other.pruned
+        self.milp_solves += other.milp_solves
+        self.search.merge(other.search)
+        self.canonicalize += other.canonicalize
+        self.solve += other.solve
+
+    def __repr__(self):
+        milp_solves = f", {self.milp_solves} MILP solves" if self.milp_solves else ""
+        search = f", {self.search}" if self.search.expanded else ""
+        return (
+            f"{self.orderings} orderings, {self.solves} solves, {self.pruned} QPs avoided{milp_solves}{search}: "
+            f"canonicalize {self.canonicalize:.2f}s, solve {self.solve:.2f}s"
+        )
+
+
+def _timed_solve(cvx_problem, stats: SolveStats = None, **kwargs):
+    start = time.perf_counter()
+    cvx_problem.solve(**kwargs)
+    if stats:
+        stats.add_solve(cvx_problem, time.perf_counter() - start)
+
+
+def solve_departure_offsets(problem: SchedulingProblem, ordering: Ordering, stats: SolveStats = None):
+    # cvxpy takes a good while to import, so only pay for it once there is something to solve
+    import cvxpy as cp
+
     ctx = OptimizeContext(problem=problem, ordering=ordering)
     constraints = get_scheduler_constraints(ctx)
     objective = get_scheduler_objective(ctx)
     cvx_problem = cp.Problem(cp.Minimize(objective), constraints)
-    cvx_problem.solve()
+    _timed_solve(cvx_problem, stats)
     if cvx_problem.status in ["infeasible", "unbounded"]:
         return float("inf"), None, None
     offsets = {}
@@ -114,25 +172,217 @@ def solve_departure_offsets(problem: SchedulingProblem, ordering: Ordering):
     return cvx_problem.value, offsets, arrivals
 
 
+class ParametricProgram:
+    # The same program as solve_departure_offsets, compiled once per SchedulingProblem. An ordering only
+    # decides which offsets each constraint compares, and with what constant between them, so it goes in as
+    # parameter values and every solve after the first skips canonicalization.
+    def __init__(self, problem: SchedulingProblem, layout: ProblemLayout = None):
+        import cvxpy as cp
+
+        self.problem = problem
+        self.layout = layout or ProblemLayout(problem)
+        service_count = self.layout.service_count
+        self.offsets = cp.Variable(service_count, name="departure_offsets", nonneg=True)
+        self.first_dispatch = cp.Parameter(service_count)
+        self.dispatch_differences = cp.Parameter((max(service_count - 1, 1), service_count))
+        constraints = [
+            self.first_dispatch @ self.offsets == 0,
+            self.offsets + 1 <= self.layout.headways,
+            self.dispatch_differences @ self.offsets <= 0,
+        ]
+        objective = 0
+        self.gap_differences = None
+        if self.layout.row_count:
+            self.gap_differences = cp.Parameter((self.layout.row_count, service_count))
+            self.gap_constants = cp.Parameter(self.layout.row_count)
+            gaps = self.gap_differences @ self.offsets + self.gap_constants
+            constraints.append(gaps >= problem.exclusion_time)
+            objective = cp.sum(cp.multiply(self.layout.row_weights, cp.square(gaps - self.layout.row_desired_gaps)))
+        self.cvx_problem = cp.Problem(cp.Minimize(objective), constraints)
+
+    def set_ordering(self, ordering: Ordering):
+        dispatch_indices = self.layout.get_dispatch_indices(ordering)
+        first_dispatch = np.zeros(self.layout.service_count)
+        first_dispatch[dispatch_indices[0]] = 1
+        dispatch_differences = np.zeros(self.dispatch_differences.shape)
+        for row, (first, second) in enumerate(get_pairs(dispatch_indices)):
+            dispatch_differences[row, first] = 1
+            dispatch_differences[row, second] = -1
+        self.first_dispatch.value = first_dispatch
+        self.dispatch_differences.value = dispatch_differences
+        if self.gap_differences is None:
+            return
+        firsts, seconds, constants = self.layout.get_gap_rows(ordering)
+        gap_differences = np.zeros(self.gap_differences.shape)
+        rows = np.arange(self.layout.row_count)
+        np.add.at(gap_differences, (rows, seconds), 1)
+        np.add.at(gap_differences, (rows, firsts), -1)
+        self.gap_differences.value = gap_differences
+        self.gap_constants.value = constants
+
+    def solve(self, ordering: Ordering, stats: SolveStats = None):
+        self.set_ordering(ordering)
+        _timed_solve(self.cvx_problem, stats, warm_start=True)
+        if self.cvx_problem.status in ["infeasible", "unbounded"]:
+            return float("inf"), None, None
+        offset_values = self.offsets.value
+        service_indices = self.layout.service_indices
+        offsets = {
+            service_id: round(float(offset_values[index])) for index, service_id in enumerate(self.layout.service_ids)
+        }
+        arrivals = {}
+        for node in self.problem.nodes.values():
+            arrivals[node.id] = [
+                round(
+                    float(offset_values[service_indices[service.id]])
+                    + self.layout.get_arrival_time_constant(service, index, node)
+                )
+                for index, service in ordering.arrival_orderings[node]
+            ]
+        return self.cvx_problem.value, offsets, arrivals
+
+
+OPTIMIZER_MODES = ("parametric", "rebuild")
+
+# Orderings that tie on objective value come back from the solver with values a few ulps apart, so
+# anything this close to the incumbent counts as a tie, and ties go to the ordering that get_orderings
+# produced first
+OBJECTIVE_TOLERANCE = 1e-6
+
+# Orderings are solved in fixed-size batches so that how they are split up never depends on how many
+# processes share the work
+BATCH_SIZE = 16
+
+
+def is_better_value(value: float, best_value: float):
+    if math.isinf(best_value):
+        return value < best_value
+    return value < best_value - OBJECTIVE_TOLERANCE * max(1, abs(best_value))
+
+
+def is_preferred(value: float, position: int, best_value: float, best_position: int):
+    return is_better_value(value, best_value) or (not is_better_value(best_value, value) and position < best_position)
+
+
+class Incumbent:
+    # The best value found so far and the position of its ordering, shared between worker processes
+    def __init__(self, context=multiprocessing):
+        self.lock = context.Lock()
+        self.value = context.Value("d", math.inf, lock=False)
+        self.position = context.Value("q", sys.maxsize, lock=False)
+
+    def offer(self, value: float, position: int):
+        with self.lock:
+            if is_preferred(value, position, self.value.value, self.position.value):
+                self.value.value = value
+                self.position.value = position
+
+    def can_skip(self, lower_bound: float, position: int):
+        # Skip an ordering if even its lower bound wouldn't be preferred over the incumbent
+        with self.lock:
+            return not is_preferred(lower_bound, position, self.value.value, self.position.value)
+
+
+@dataclass
+class BatchResult:
+    position: int = sys.maxsize
+    value: float = math.inf
+    offsets: Optional[Dict[str, int]] = None
+    arrivals: Optional[Dict[str, List[int]]] = None
+    stats: SolveStats = field(default_factory=SolveStats)
+
+    def is_preferred_over(self, other: "BatchResult"):
+        return is_preferred(self.value, self.position, other.value, other.position)
+
+
+# A batch is a list of (position, lower bound, ordering), where position is the ordering's place in the
+# output of get_orderings, which decides ties
+Batch = List[Tuple[int, float, Ordering]]
+
+
+def _get_solver(problem: SchedulingProblem, layout: ProblemLayout, mode: str):
+    if mode == "parametric":
+        return ParametricProgram(problem, layout).solve
+    return partial(solve_departure_offsets, problem)
+
+
+def _solve_batch(solve, incumbent: Incumbent, batch: Batch):
+    result = BatchResult()
+    result.stats.orderings = len(batch)
+    for position, lower_bound, ordering in batch:
+        if not is_preferred(lower_bound, position, result.value, result.position) or incumbent.can_skip(
+            lower_bound, position
+        ):
+            result.stats.pruned += 1
+            continue
+        value, offsets, arrivals = solve(ordering, stats=result.stats)
+        if is_preferred(value, position, result.value, result.position):
+            result.position, result.value, result.offsets, result.arrivals = position, value, offsets, arrivals
+            incumbent.offer(value, position)
+    return result
+
+
+_worker_state = {}
+
+
+def _init_worker(problem: SchedulingProblem, layout: ProblemLayout, mode: str, incumbent: Incumbent):
+    _worker_state["solve"] = _get_solver(problem, layout, mode)
+    _worker_state["incumbent"] = incumbent
+
+
+def _solve_batch_in_worker(batch: Batch):
+    return _solve_batch(_worker_state["solve"], _worker_state["incumbent"], batch)
+
+
+def _solve_batches(problem: SchedulingProblem, layout: ProblemLayout, batches: List[Batch], mode: str, processes: int):
+    context = multiprocessing.get_context()
+    incumbent = Incumbent(context)
+    if processes <= 1 or len(batches) <= 1:
+        solve = _get_solver(problem, layout, mode)
+        return [_solve_batch(solve, incumbent, batch) for batch in batches]
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(batches)),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(problem, layout, mode, incumbent),
+    ) as executor:
+        return list(executor.map(_solve_batch_in_worker, batches))
+
+
+def get_batches(layout: ProblemLayout, orderings: List[Ordering]) -> List[Batch]:
+    # Solving the orderings with the lowest bounds first finds a good incumbent early, and that prunes the rest
+    lower_bounds = get_lower_bounds(layout, orderings)
+    queue = [
+        (position, float(lower_bounds[position]), orderings[position])
+        for position in np.argsort(lower_bounds, kind="stable")
+    ]
+    return [queue[start : start + BATCH_SIZE] for start in range(0, len(queue), BATCH_SIZE)]
+
+
 def solve_departure_offsets_for_orderings(
     problem: SchedulingProblem,
-    orderings: List[Ordering],
+    orderings: Iterable[Ordering],
     debug=True,
+    mode: str = "parametric",
+    processes: int = 1,
+    stats: SolveStats = None,
 ):
-    best_offsets = None
-    best_arrivals = None
-    best_ordering = None
-    best_value = float("inf")
-    for ordering in orderings:
-        value, offsets, arrivals = solve_departure_offsets(problem, ordering)
-        if value < best_value:
-            best_ordering = ordering
-            best_value = value
-            best_offsets = offsets
-            best_arrivals = arrivals
+    assert mode in OPTIMIZER_MODES, f"Unknown optimizer mode {mode}"
+    orderings = list(orderings)
+    layout = ProblemLayout(problem)
+    problem_stats = SolveStats()
+    best = BatchResult()
+    # Batches can finish in any order, but the winner is picked by value and then position alone
+    for result in _solve_batches(problem, layout, get_batches(layout, orderings), mode, processes):
+        problem_stats.merge(result.stats)
+        if result.is_preferred_over(best):
+            best = result
+    if stats:
+        stats.merge(problem_stats)
     if debug:
         print("---------")
-        print(best_ordering)
-        for node_id, arrivals in best_arrivals.items():
+        print(orderings[best.position] if best.offsets else None)
+        print(f"Optimized in {mode} mode on {max(processes, 1)} processes, {problem_stats}")
+        for node_id, arrivals in best.arrivals.items():
             print(node_id, [a // 60 for a in arrivals])
-    return best_offsets
+    return best.offsets
@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field, replace
+from typing import Dict, List
+
+# "orderings" enumerates every ordering with get_orderings and solves a QP for each one, "joint" picks the
+# ordering and the offsets together in one mixed-integer program, and "beam" solves the most promising
+# orderings it can find. Both "joint" and "beam" stop after time_budget seconds
+SCHEDULER_ENGINES = ("orderings", "joint", "beam")
+
+
+@dataclass
+class SchedulerOptions:
+    optimizer_mode: str = "parametric"
+    processes: int = 1
+    engine: str = "orderings"
+    subgraph_engines: Dict[str, str] = field(default_factory=dict)
+    beam_width: int = 8
+    time_budget: float = 30.0
+
+    def for_subgraph(self, route_ids: List[str]) -> "SchedulerOptions":
+        # A subgraph uses the engine given for any of its routes, and the default engine otherwise
+        engine = next(
+            (self.subgraph_engines[route_id] for route_id in route_ids if route_id in self.subgraph_engines),
+            self.engine,
+        )
+        return replace(self, engine=engine)
@@ -1,11 +1,17 @@
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from functools import cached_property
-from typing import List, Dict, Tuple
+from itertools import permutations, product
+from typing import Iterable, Iterator, List, Dict, Tuple
 
 from synthesize.util import listify
 from scheduler.network import Service, Node
 from scheduler.scheduling_problem import SchedulingProblem
 
+# A parallel search is split into at least this many subtrees for each process, so that processes that
+# finish small subtrees early can take on more of them
+FRONTIER_STATES_PER_PROCESS = 8
+
 
 @dataclass
 class Range:
@@ -53,12 +59,21 @@ class ServicePool:
                 yield ServicePool(next_dict), key
 
 
+# For each service dispatched so far: how much longer the dispatches since its latest one could go on
+# before it can't be dispatched again in time, and how long each service dispatched since then still has
+# to wait before its next dispatch
+DispatchClocks = Dict[str, Tuple[int, Tuple[Tuple[str, int], ...]]]
+
+
 @dataclass
 class OrderingState:
     dispatch_ordering: List[str]
     arrival_orderings: List[Dict[str, List[Arrival]]]
     service_pool: ServicePool
     finished: bool = False
+    clocks: DispatchClocks = field(default_factory=dict)
+    # For each of arrival_orderings, the index of the arrival ordering it grew from in each earlier state
+    origins: List[Tuple[int, ...]] = field(default_factory=lambda: [()])
 
 
 @dataclass
@@ -235,7 +250,11 @@ def get_possible_insertions_of_dispatch_or_arrival(
             yield insertion_range, insertion_list
 
 
-def get_arrival_orderings_for_dispatch(state: OrderingState, problem: SchedulingProblem, dispatch_service_id: str):
+def get_arrival_orderings_for_alternative(
+    arrival_ordering: Dict[str, List[Arrival]],
+    problem: SchedulingProblem,
+    dispatch_service_id: str,
+):
     @listify
     def subproblem(
         node_ids: List[str],
@@ -277,20 +296,56 @@ def get_arrival_orderings_for_dispatch(state: OrderingState, problem: Scheduling
 
     node_ids_in_service = problem.node_ids_for_service_id(dispatch_service_id)
     next_arrival_orderings = []
-    for arrival_ordering in state.arrival_orderings:
-        for ordering in subproblem(node_ids=node_ids_in_service, existing_arrivals=arrival_ordering):
-            next_arrival_orderings.append({**arrival_ordering, **ordering})
+    for ordering in subproblem(node_ids=node_ids_in_service, existing_arrivals=arrival_ordering):
+        next_arrival_orderings.append({**arrival_ordering, **ordering})
     return next_arrival_orderings
 
 
+def advance_dispatch_clocks(clocks: DispatchClocks, dispatch: str, problem: SchedulingProblem) -> DispatchClocks:
+    # Steps minimum_time_spanned_by_sequence along by one dispatch for every service at once. Waits are kept
+    # relative to now, and dropped once they are no longer than dispatch_spacing_time, so that sequences
+    # which constrain the rest of the search in the same way end up with the same clocks.
+    spacing = problem.dispatch_spacing_time
+    headway = problem.get_service_headway(dispatch)
+    next_clocks = {}
+    for service_id, (slack, waits) in clocks.items():
+        if service_id == dispatch:
+            continue
+        elapsed = max(spacing, dict(waits).get(dispatch, 0))
+        next_waits = tuple(
+            (other, wait - elapsed) for other, wait in waits if other != dispatch and wait - elapsed > spacing
+        )
+        if headway > spacing:
+            next_waits = tuple(sorted(next_waits + ((dispatch, headway),)))
+        next_clocks[service_id] = (slack - elapsed, next_waits)
+    next_clocks[dispatch] = (headway, ())
+    return next_clocks
+
+
+def has_expired_clock(clocks: DispatchClocks):
+    # A service whose slack has run out is too late for its next dispatch, or, if it has none left, keeps
+    # the sequence from being cyclical. Slack only ever shrinks until it is dispatched again, so nothing
+    # below a state with an expired clock can finish.
+    return any(slack < 0 for slack, _ in clocks.values())
+
+
 @listify
-def get_next_ordering_states(state: OrderingState, problem: SchedulingProblem):
+def get_next_ordering_states(state: OrderingState, problem: SchedulingProblem, predecessors: Dict[str, str] = None):
+    predecessors = predecessors or {}
     for next_pool, candidate_service_id in state.service_pool.next_candidates():
-        if proposed_dispatch_is_too_late(state.dispatch_ordering, candidate_service_id, problem):
+        predecessor = predecessors.get(candidate_service_id)
+        if predecessor and candidate_service_id not in state.clocks and predecessor not in state.clocks:
             continue
-        next_arrival_orderings = get_arrival_orderings_for_dispatch(
-            state=state, problem=problem, dispatch_service_id=candidate_service_id
-        )
+        next_clocks = advance_dispatch_clocks(state.clocks, candidate_service_id, problem)
+        if has_expired_clock(next_clocks):
+            continue
+        next_arrival_orderings, next_origins = [], []
+        for index, (arrival_ordering, origin) in enumerate(zip(state.arrival_orderings, state.origins)):
+            for next_arrival_ordering in get_arrival_orderings_for_alternative(
+                arrival_ordering, problem, candidate_service_id
+            ):
+                next_arrival_orderings.append(next_arrival_ordering)
+                next_origins.append(origin + (index,))
         next_dispatch_ordering = state.dispatch_ordering + [candidate_service_id]
         if len(next_arrival_orderings) > 0:
             yield OrderingState(
@@ -298,50 +353,260 @@ def get_next_ordering_states(state: OrderingState, problem: SchedulingProblem):
                 arrival_orderings=next_arrival_orderings,
                 service_pool=next_pool,
                 finished=len(next_dispatch_ordering) == problem.total_dispatches,
+                clocks=next_clocks,
+                origins=next_origins,
             )
 
 
-def get_orderings_from_ordering_state(state: OrderingState, problem: SchedulingProblem):
+def get_ordering(dispatch_ordering: List[str], arrival_ordering: Dict[str, List[Arrival]], problem: SchedulingProblem):
     dispatch_ordering_of_services = []
-    for service_id in state.dispatch_ordering:
+    for service_id in dispatch_ordering:
         service = problem.services[service_id]
         if service not in dispatch_ordering_of_services:
             dispatch_ordering_of_services.append(service)
+    arrival_orderings_of_nodes = {}
+    for node_id, arrivals_at_node in arrival_ordering.items():
+        node = problem.nodes[node_id]
+        service_id_indices = {}
+        arrival_tuples = []
+        for arrival in arrivals_at_node:
+            index = service_id_indices.setdefault(arrival.service_id, 0)
+            service_id_indices[arrival.service_id] += 1
+            service = problem.services[arrival.service_id]
+            arrival_tuple = (index, service)
+            arrival_tuples.append(arrival_tuple)
+        arrival_orderings_of_nodes[node] = arrival_tuples
+    return Ordering(
+        dispatch_ordering=dispatch_ordering_of_services,
+        arrival_orderings=arrival_orderings_of_nodes,
+    )
+
+
+def get_orderings_from_ordering_state(state: OrderingState, problem: SchedulingProblem):
     for arrival_ordering in state.arrival_orderings:
-        arrival_orderings_of_nodes = {}
-        for node_id, arrivals_at_node in arrival_ordering.items():
-            node = problem.nodes[node_id]
-            service_id_indices = {}
-            arrival_tuples = []
-            for arrival in arrivals_at_node:
-                index = service_id_indices.setdefault(arrival.service_id, 0)
-                service_id_indices[arrival.service_id] += 1
-                service = problem.services[arrival.service_id]
-                arrival_tuple = (index, service)
-                arrival_tuples.append(arrival_tuple)
-            arrival_orderings_of_nodes[node] = arrival_tuples
-        yield Ordering(
-            dispatch_ordering=dispatch_ordering_of_services,
-            arrival_orderings=arrival_orderings_of_nodes,
-        )
+        yield get_ordering(state.dispatch_ordering, arrival_ordering, problem)
 
 
-@listify
-def get_orderings(problem: SchedulingProblem):
+@dataclass
+class SearchStats:
+    expanded: int = 0
+    reused: int = 0
+    # States left out of a beam search
+    dropped: int = 0
+
+    def merge(self, other: "SearchStats"):
+        self.expanded += other.expanded
+        self.reused += other.reused
+        self.dropped += other.dropped
+
+    def __repr__(self):
+        dropped = f", {self.dropped} dropped" if self.dropped else ""
+        return f"{self.expanded} states expanded, {self.reused} reused{dropped}"
+
+
+def get_remaining_node_ids(state: OrderingState, problem: SchedulingProblem) -> Tuple[str, ...]:
+    node_ids = set()
+    for service_id, count in state.service_pool.trips_per_period_dict.items():
+        if count > 0:
+            node_ids.update(problem.node_ids_for_service_id(service_id))
+    return tuple(sorted(node_ids))
+
+
+def get_ordering_state_key(state: OrderingState, node_ids: Tuple[str, ...]):
+    # Everything below a state follows from what is left in the pool, its clocks, and its arrivals at the
+    # nodes that services left in the pool still call at, so states that agree on those share a subtree
+    return (
+        tuple(state.service_pool.trips_per_period_dict.values()),
+        tuple(sorted(state.clocks.items())),
+        tuple(
+            tuple(
+                (node_id, tuple((a.service_id, a.range.lower, a.range.upper) for a in arrival_ordering[node_id]))
+                for node_id in node_ids
+                if node_id in arrival_ordering
+            )
+            for arrival_ordering in state.arrival_orderings
+        ),
+    )
+
+
+@dataclass
+class _SearchFrame:
+    key: tuple
+    depth: int
+    node_ids: Tuple[str, ...]
+    # Each finished ordering below this state, as the dispatches after it, the index of the arrival ordering
+    # it grew from, and its arrivals at node_ids
+    continuations: List[Tuple[Tuple[str, ...], int, Dict[str, List[Arrival]]]] = field(default_factory=list)
+
+
+def get_initial_ordering_state(problem: SchedulingProblem):
     service_pool = ServicePool(problem.trips_per_period)
-    initial_state = OrderingState(dispatch_ordering=[], arrival_orderings=[{}], service_pool=service_pool)
+    return OrderingState(dispatch_ordering=[], arrival_orderings=[{}], service_pool=service_pool)
 
-    def subproblem(state: OrderingState):
-        if state.finished and not sequence_cannot_be_cyclical(state.dispatch_ordering, problem):
-            return [state]
-        else:
-            results = []
-            next_states = get_next_ordering_states(state, problem)
-            for next_state in next_states:
-                results += subproblem(next_state)
-            return results
-
-    ordering_states = subproblem(initial_state)
-    for state in ordering_states:
-        for ordering in get_orderings_from_ordering_state(state, problem):
-            yield ordering
+
+def iterate_finished_orderings(
+    problem: SchedulingProblem,
+    stats: SearchStats = None,
+    break_symmetry: bool = True,
+    root: OrderingState = None,
+) -> Iterator[Tuple[List[str], Dict[str, List[Arrival]]]]:
+    # A depth-first search over OrderingStates on an explicit stack. Once every state below a state has been
+    # searched, the orderings found there are kept in a transposition table, and any later state with the
+    # same key replays them instead of searching its subtree again.
+    stats = stats or SearchStats()
+    predecessors = get_symmetry_predecessors(problem) if break_symmetry else {}
+    stack = [root or get_initial_ordering_state(problem)]
+    transpositions = {}
+    open_frames: List[_SearchFrame] = []
+
+    def finish(dispatch_ordering, arrival_ordering, origin):
+        for frame in open_frames:
+            arrivals = {node_id: arrival_ordering[node_id] for node_id in frame.node_ids if node_id in arrival_ordering}
+            frame.continuations.append((tuple(dispatch_ordering[frame.depth :]), origin[frame.depth], arrivals))
+        return dispatch_ordering, arrival_ordering
+
+    while stack:
+        state = stack.pop()
+        if state is None:
+            frame = open_frames.pop()
+            transpositions[frame.key] = frame.continuations
+            continue
+        if state.finished:
+            for arrival_ordering, origin in zip(state.arrival_orderings, state.origins):
+                yield finish(state.dispatch_ordering, arrival_ordering, origin)
+            continue
+        node_ids = get_remaining_node_ids(state, problem)
+        key = get_ordering_state_key(state, node_ids)
+        continuations = transpositions.get(key)
+        if continuations is not None:
+            stats.reused += 1
+            for dispatches, index, arrivals in continuations:
+                yield finish(
+                    state.dispatch_ordering + list(dispatches),
+                    {**state.arrival_orderings[index], **arrivals},
+                    state.origins[index],
+                )
+            continue
+        stats.expanded += 1
+        open_frames.append(_SearchFrame(key=key, depth=len(state.dispatch_ordering), node_ids=node_ids))
+        # The marker closes this state's frame once everything pushed above it has been searched
+        stack.append(None)
+        stack += reversed(get_next_ordering_states(state, problem, predecessors))
+
+
+def get_frontier_states(
+    problem: SchedulingProblem, count: int, stats: SearchStats, break_symmetry: bool = True
+) -> List[OrderingState]:
+    # Expands the search a level at a time until there are at least count states to search below. Each
+    # state is replaced by its children in place, so searching below each of them in turn finds the same
+    # orderings in the same order as one search from the top.
+    predecessors = get_symmetry_predecessors(problem) if break_symmetry else {}
+    frontier = [get_initial_ordering_state(problem)]
+    while len(frontier) < count and not all(state.finished for state in frontier):
+        next_frontier = []
+        for state in frontier:
+            if state.finished:
+                next_frontier.append(state)
+                continue
+            stats.expanded += 1
+            next_frontier += get_next_ordering_states(state, problem, predecessors)
+        frontier = next_frontier
+    return frontier
+
+
+_worker_state = {}
+
+
+def _init_worker(problem: SchedulingProblem, break_symmetry: bool):
+    _worker_state["problem"] = problem
+    _worker_state["break_symmetry"] = break_symmetry
+
+
+def _search_below_state_in_worker(root: OrderingState):
+    stats = SearchStats()
+    finished = list(
+        iterate_finished_orderings(_worker_state["problem"], stats, _worker_state["break_symmetry"], root=root)
+    )
+    return finished, stats
+
+
+def iterate_finished_orderings_in_parallel(
+    problem: SchedulingProblem, processes: int, stats: SearchStats = None, break_symmetry: bool = True
+) -> Iterator[Tuple[List[str], Dict[str, List[Arrival]]]]:
+    # Workers take the next state off the frontier as they free up, and the orderings below each state are
+    # passed on in frontier order, whichever worker finishes first. Transposition tables aren't shared, so
+    # the workers together expand more states than a single search would.
+    stats = stats or SearchStats()
+    frontier = get_frontier_states(problem, processes * FRONTIER_STATES_PER_PROCESS, stats, break_symmetry)
+    if len(frontier) <= 1:
+        for root in frontier:
+            yield from iterate_finished_orderings(problem, stats, break_symmetry, root=root)
+        return
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(frontier)),
+        initializer=_init_worker,
+        initargs=(problem, break_symmetry),
+    ) as executor:
+        for finished, worker_stats in executor.map(_search_below_state_in_worker, frontier):
+            stats.merge(worker_stats)
+            yield from finished
+
+
+def get_equivalent_service_classes(problem: SchedulingProblem) -> List[List[str]]:
+    # Services that run as often as each other and reach the same nodes at the same times can be swapped
+    # in any ordering without changing what it costs
+    classes = {}
+    for service_id, service in problem.services.items():
+        signature = (
+            problem.trips_per_period[service_id],
+            tuple((node.id, service.trip_time_to_node_seconds(node)) for node in service.calls_at_nodes),
+        )
+        classes.setdefault(signature, []).append(service_id)
+    return [service_ids for service_ids in classes.values() if len(service_ids) > 1]
+
+
+def get_symmetry_predecessors(problem: SchedulingProblem) -> Dict[str, str]:
+    # Only the ordering in which each class of equivalent services is first dispatched in problem order is
+    # searched, so each service waits for the one before it in its class
+    predecessors = {}
+    for service_ids in get_equivalent_service_classes(problem):
+        for predecessor, service_id in zip(service_ids, service_ids[1:]):
+            predecessors[service_id] = predecessor
+    return predecessors
+
+
+def relabel_ordering(ordering: Ordering, services_by_id: Dict[str, Service]) -> Ordering:
+    return Ordering(
+        dispatch_ordering=[services_by_id.get(service.id, service) for service in ordering.dispatch_ordering],
+        arrival_orderings={
+            node: [(index, services_by_id.get(service.id, service)) for index, service in arrivals]
+            for node, arrivals in ordering.arrival_orderings.items()
+        },
+    )
+
+
+def expand_equivalent_orderings(orderings: Iterable[Ordering], problem: SchedulingProblem) -> Iterator[Ordering]:
+    # Yields each ordering followed by every other way of assigning its equivalent services
+    classes = get_equivalent_service_classes(problem)
+    for ordering in orderings:
+        for assignment in product(*(permutations(service_ids) for service_ids in classes)):
+            services_by_id = {
+                service_id: problem.services[assigned_id]
+                for service_ids, assigned_ids in zip(classes, assignment)
+                for service_id, assigned_id in zip(service_ids, assigned_ids)
+            }
+            yield relabel_ordering(ordering, services_by_id)
+
+
+def get_orderings(
+    problem: SchedulingProblem,
+    stats: SearchStats = None,
+    break_symmetry: bool = True,
+    processes: int = 1,
+) -> Iterator[Ordering]:
+    if processes > 1:
+        finished_orderings = iterate_finished_orderings_in_parallel(problem, processes, stats, break_symmetry)
+    else:
+        finished_orderings = iterate_finished_orderings(problem, stats, break_symmetry)
+    for dispatch_ordering, arrival_ordering in finished_orderings:
+        yield get_ordering(dispatch_ordering, arrival_ordering, problem)
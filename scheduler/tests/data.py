@@ -34,3 +34,14 @@ Z = RoutePattern(
 )
 
 route_patterns = [X, Y, Z]
+
+# Runs exactly like X, so the two are interchangeable in any ordering
+X_TWIN = RoutePattern(
+    name="X Twin",
+    id="x-twin",
+    stations=route_x_stations,
+    timetable=route_x_timetable,
+    schedule=all_day_15,
+)
+
+twin_route_patterns = [X, X_TWIN, Y, Z]
@@ -0,0 +1,56 @@
+import math
+import time
+
+import pytest
+
+from scheduler.beam import BeamSearch, solve_departure_offsets_with_beam
+from scheduler.joint import JointProgram
+from scheduler.network import create_scheduler_network
+from scheduler.optimize import ParametricProgram
+from scheduler.ordering import get_orderings
+from scheduler.scheduling_problem import SchedulingProblem
+from scheduler.tests.data import route_patterns
+
+
+def _get_problem(trips_per_period):
+    return SchedulingProblem(trips_per_period=trips_per_period, network=create_scheduler_network(route_patterns))
+
+
+@pytest.mark.parametrize("trips_per_period", [{"x": 2, "y": 2, "z": 2}, {"x": 4, "y": 2, "z": 2}])
+def test_unhurried_beam_search_finds_the_enumerated_optimum(trips_per_period):
+    problem = _get_problem(trips_per_period)
+    program = ParametricProgram(problem)
+    search = BeamSearch(problem, beam_width=2, deadline=math.inf)
+    beam_value = min(program.solve(ordering)[0] for ordering in search)
+    enumerated_value = min(program.solve(ordering)[0] for ordering in get_orderings(problem))
+    assert search.complete
+    assert search.stats.dropped > 0
+    assert beam_value == pytest.approx(enumerated_value, rel=1e-4, abs=1e-3)
+
+
+def test_beam_search_stops_at_its_deadline():
+    problem = _get_problem({"x": 4, "y": 2, "z": 2})
+    search = BeamSearch(problem, beam_width=8, deadline=time.perf_counter())
+    assert list(search) == []
+    assert not search.complete
+    assert search.stats.expanded == 0
+
+
+def test_beam_search_out_of_time_still_schedules():
+    problem = _get_problem({"x": 4, "y": 2, "z": 2})
+    start = time.perf_counter()
+    offsets = solve_departure_offsets_with_beam(problem, beam_width=8, time_budget=0, debug=False)
+    assert time.perf_counter() - start < 5
+    expected_value, expected_offsets, _ = ParametricProgram(problem).solve(next(get_orderings(problem)))
+    assert offsets == expected_offsets
+    assert JointProgram(problem).get_lower_bound(time_limit=1, value=expected_value) <= expected_value + 1e-3
+
+
+def test_beam_search_without_a_feasible_ordering_raises():
+    problem = SchedulingProblem(
+        trips_per_period={"x": 2, "y": 2, "z": 2},
+        network=create_scheduler_network(route_patterns),
+        exclusion_time=1000,
+    )
+    with pytest.raises(Exception, match="no feasible ordering"):
+        solve_departure_offsets_with_beam(problem, beam_width=2, time_budget=1, debug=False)
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+# Everything behind the CLI's lightweight commands, which should start without the solver or geo libraries
+LIGHTWEIGHT_MODULES = (
+    "cli",
+    "network.main",
+    "scenarios.cli",
+    "scenarios.regional_rail.scenario",
+    "synthesize.write_gtfs",
+    "synthesize.distance",
+    "scheduler.departures",
+)
+
+HEAVY_MODULES = ("cvxpy", "geopy")
+
+MAX_IMPORT_SECONDS = 1.0
+
+
+def _import_in_fresh_interpreter(modules):
+    script = (
+        "import importlib, json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"for module in {list(modules)!r}:\n"
+        "    importlib.import_module(module)\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': list(sys.modules)}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def test_lightweight_commands_skip_heavy_imports():
+    result = _import_in_fresh_interpreter(LIGHTWEIGHT_MODULES)
+    loaded = {module.split(".")[0] for module in result["modules"]}
+    assert not loaded & set(HEAVY_MODULES)
+    assert result["seconds"] < MAX_IMPORT_SECONDS
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from scheduler.joint import JointProgram, solve_departure_offsets_jointly
+from scheduler.network import create_scheduler_network
+from scheduler.optimize import ParametricProgram
+from scheduler.ordering import get_orderings
+from scheduler.scheduling_problem import SchedulingProblem
+from scheduler.tests.data import route_patterns, twin_route_patterns
+
+
+@pytest.mark.parametrize(
+    "trips_per_period",
+    [{"x": 2, "y": 2, "z": 2}, {"x": 4, "y": 2, "z": 2}, {"x": 1, "y": 1, "z": 1}, {"x": 3, "y": 2, "z": 1}],
+)
+@pytest.mark.parametrize("reverse", [False, True])
+def test_joint_program_matches_enumerated_orderings(trips_per_period, reverse):
+    network = create_scheduler_network(route_patterns)
+    problem = SchedulingProblem(trips_per_period=trips_per_period, network=network.reverse() if reverse else network)
+    program = ParametricProgram(problem)
+    enumerated_value = min(program.solve(ordering)[0] for ordering in get_orderings(problem))
+    value, lower_bound, ordering, offsets, _ = JointProgram(problem).solve()
+    assert value == pytest.approx(enumerated_value, rel=1e-4, abs=1e-3)
+    assert lower_bound <= value + 1e-3
+    assert program.solve(ordering)[1] == offsets
+
+
+def test_joint_program_dispatches_equivalent_services_in_order():
+    problem = SchedulingProblem(
+        trips_per_period={"x": 2, "x-twin": 2, "y": 1, "z": 1},
+        network=create_scheduler_network(twin_route_patterns),
+    )
+    program = ParametricProgram(problem)
+    enumerated_value = min(program.solve(ordering)[0] for ordering in get_orderings(problem))
+    value, _, _, offsets, _ = JointProgram(problem).solve()
+    assert value == pytest.approx(enumerated_value, rel=1e-4, abs=1e-3)
+    assert offsets["x"] <= offsets["x-twin"]
+
+
+def test_joint_program_stops_at_its_time_limit():
+    problem = SchedulingProblem(
+        trips_per_period={"x": 8, "y": 6, "z": 6},
+        network=create_scheduler_network(route_patterns),
+    )
+    # Its first MILP alone takes longer than this to solve to optimality
+    start = time.perf_counter()
+    value, lower_bound, ordering, offsets, _ = JointProgram(problem).solve(time_limit=1)
+    assert time.perf_counter() - start < 3
+    assert offsets is not None
+    assert lower_bound <= value + 1e-3
+    assert ParametricProgram(problem).solve(ordering)[1] == offsets
+
+
+def test_joint_program_out_of_time_still_schedules():
+    problem = SchedulingProblem(
+        trips_per_period={"x": 4, "y": 2, "z": 2},
+        network=create_scheduler_network(route_patterns),
+    )
+    offsets = solve_departure_offsets_jointly(problem, time_limit=0, debug=False)
+    assert offsets == ParametricProgram(problem).solve(next(get_orderings(problem)))[1]
@@ -0,0 +1,70 @@
+import pytest
+
+from scheduler.bounds import ProblemLayout, get_lower_bounds
+from scheduler.network import create_scheduler_network
+from scheduler.optimize import (
+    ParametricProgram,
+    SolveStats,
+    solve_departure_offsets,
+    solve_departure_offsets_for_orderings,
+)
+from scheduler.ordering import get_orderings
+from scheduler.scheduling_problem import SchedulingProblem
+from scheduler.tests.data import route_patterns
+
+
+def _get_problem(trips_per_period):
+    return SchedulingProblem(trips_per_period=trips_per_period, network=create_scheduler_network(route_patterns))
+
+
+@pytest.mark.parametrize(
+    "trips_per_period", [{"x": 2, "y": 2, "z": 2}, {"x": 4, "y": 2, "z": 2}, {"x": 1, "y": 1, "z": 1}]
+)
+def test_parametric_program_matches_rebuilt_problems(trips_per_period):
+    problem = _get_problem(trips_per_period)
+    program = ParametricProgram(problem)
+    for ordering in get_orderings(problem):
+        value, offsets, arrivals = program.solve(ordering)
+        expected_value, expected_offsets, expected_arrivals = solve_departure_offsets(problem, ordering)
+        assert value == pytest.approx(expected_value, rel=1e-4, abs=1e-3)
+        assert offsets == expected_offsets
+        assert arrivals == expected_arrivals
+
+
+def test_optimizer_modes_pick_the_same_offsets():
+    problem = _get_problem({"x": 2, "y": 2, "z": 2})
+    orderings = list(get_orderings(problem))
+    parametric = solve_departure_offsets_for_orderings(problem, orderings, debug=False, mode="parametric")
+    rebuild = solve_departure_offsets_for_orderings(problem, orderings, debug=False, mode="rebuild")
+    assert parametric == rebuild
+
+
+def test_parallel_solving_picks_the_same_offsets():
+    problem = _get_problem({"x": 4, "y": 2, "z": 2})
+    orderings = list(get_orderings(problem))
+    sequential = solve_departure_offsets_for_orderings(problem, orderings, debug=False)
+    parallel = solve_departure_offsets_for_orderings(problem, orderings, debug=False, processes=2)
+    assert parallel == sequential
+
+
+@pytest.mark.parametrize(
+    "trips_per_period", [{"x": 2, "y": 2, "z": 2}, {"x": 4, "y": 2, "z": 2}, {"x": 1, "y": 1, "z": 1}]
+)
+def test_lower_bounds_never_exceed_solved_values(trips_per_period):
+    problem = _get_problem(trips_per_period)
+    orderings = list(get_orderings(problem))
+    layout = ProblemLayout(problem)
+    program = ParametricProgram(problem, layout)
+    for ordering, lower_bound in zip(orderings, get_lower_bounds(layout, orderings)):
+        value, _, _ = program.solve(ordering)
+        assert lower_bound <= value + 1e-3 * max(1, abs(value))
+
+
+def test_pruning_skips_solves():
+    problem = _get_problem({"x": 4, "y": 2, "z": 2})
+    orderings = list(get_orderings(problem))
+    stats = SolveStats()
+    solve_departure_offsets_for_orderings(problem, orderings, debug=False, stats=stats)
+    assert stats.orderings == len(orderings)
+    assert stats.solves + stats.pruned == len(orderings)
+    assert stats.pruned > 0
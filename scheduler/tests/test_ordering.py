@@ -1,7 +1,20 @@
+from itertools import product
+
 from scheduler.network import create_scheduler_network
-from scheduler.tests.data import route_patterns
+from scheduler.tests.data import route_patterns, twin_route_patterns
 from scheduler.scheduling_problem import SchedulingProblem
-from scheduler.ordering import get_orderings, Range, proposed_dispatch_is_too_late
+from scheduler.ordering import (
+    SearchStats,
+    advance_dispatch_clocks,
+    expand_equivalent_orderings,
+    get_equivalent_service_classes,
+    get_frontier_states,
+    get_orderings,
+    last_index_of,
+    minimum_time_spanned_by_sequence,
+    Range,
+    proposed_dispatch_is_too_late,
+)
 
 
 def test_ordering():
@@ -10,7 +23,7 @@ def test_ordering():
         trips_per_period={"x": 2, "y": 2, "z": 2},
         network=network,
     )
-    orderings = get_orderings(problem)
+    orderings = list(get_orderings(problem))
     assert len(orderings) == 10
 
 
@@ -43,3 +56,72 @@ def test_proposed_dispatch_is_too_late():
     assert not proposed_dispatch_is_too_late(sequence, "x", problem)
     assert not proposed_dispatch_is_too_late(sequence, "y", problem)
     assert not proposed_dispatch_is_too_late(sequence, "z", problem)
+
+
+def test_orderings_stream_from_the_search():
+    network = create_scheduler_network(route_patterns)
+    problem = SchedulingProblem(
+        trips_per_period={"x": 4, "y": 2, "z": 2},
+        network=network,
+    )
+    stats = SearchStats()
+    orderings = get_orderings(problem, stats)
+    next(orderings)
+    expanded_before_the_rest = stats.expanded
+    remaining = list(orderings)
+    assert len(remaining) > 0
+    assert stats.expanded > expanded_before_the_rest
+
+
+def test_dispatch_clocks_match_minimum_time_spanned():
+    network = create_scheduler_network(route_patterns)
+    problem = SchedulingProblem(
+        trips_per_period={"x": 4, "y": 2, "z": 1},
+        network=network,
+    )
+    for sequence in product("xyz", repeat=6):
+        sequence = list(sequence)
+        clocks = {}
+        for dispatch in sequence:
+            clocks = advance_dispatch_clocks(clocks, dispatch, problem)
+        for service_id, (slack, _) in clocks.items():
+            since_last = sequence[last_index_of(sequence, service_id) + 1 :]
+            headway = problem.get_service_headway(service_id)
+            assert slack == headway - minimum_time_spanned_by_sequence(since_last, problem)
+
+
+def _get_ordering_key(ordering):
+    arrivals = sorted(
+        (node.id, tuple((index, service.id) for index, service in arrivals))
+        for node, arrivals in ordering.arrival_orderings.items()
+    )
+    return tuple(service.id for service in ordering.dispatch_ordering), tuple(arrivals)
+
+
+def test_equivalent_services_are_searched_once():
+    network = create_scheduler_network(twin_route_patterns)
+    problem = SchedulingProblem(
+        trips_per_period={"x": 2, "x-twin": 2, "y": 1, "z": 1},
+        network=network,
+    )
+    assert get_equivalent_service_classes(problem) == [["x", "x-twin"]]
+    canonical = list(get_orderings(problem))
+    unbroken = list(get_orderings(problem, break_symmetry=False))
+    assert len(unbroken) == 2 * len(canonical)
+    expanded = list(expand_equivalent_orderings(canonical, problem))
+    assert {_get_ordering_key(ordering) for ordering in expanded} == {
+        _get_ordering_key(ordering) for ordering in unbroken
+    }
+
+
+def test_parallel_search_finds_the_same_orderings_in_order():
+    network = create_scheduler_network(route_patterns)
+    problem = SchedulingProblem(
+        trips_per_period={"x": 4, "y": 2, "z": 2},
+        network=network,
+    )
+    sequential = [_get_ordering_key(ordering) for ordering in get_orderings(problem)]
+    frontier = get_frontier_states(problem, 16, SearchStats())
+    assert len(frontier) >= 16
+    parallel = [_get_ordering_key(ordering) for ordering in get_orderings(problem, processes=2)]
+    assert parallel == sequential
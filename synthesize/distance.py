@@ -1,10 +1,10 @@
 import math
 from typing import List
 
-from geopy.distance import geodesic
 import numpy as np
 
 from network.models import Network, Station, Trip
+from network.shapes import ShapeView
 
 from .trainset import Trainset
 from .util import get_pairs, get_triples
@@ -42,6 +42,8 @@ def get_point_distance(p1, p2):
 
 def shoddily_convert_point_to_km(point, source=CENTER_OF_BOSTON):
     # These points are in (lat, long) which is like (y, x)
+    from geopy.distance import geodesic
+
     (y1, x1) = point
     (y2, x2) = source
     x_distance = geodesic((x1, y1), (x2, y1)).km
@@ -52,34 +54,26 @@ def shoddily_convert_point_to_km(point, source=CENTER_OF_BOSTON):
 
 
 def get_exemplar_trip_for_stations(network: Network, first: Station, second: Station) -> Trip:
-    all_trips = network.trips_by_id.values()
-
-    def trip_serves_station(trip: Trip, station: Station):
-        return station in (stop_time.stop.parent_station for stop_time in trip.stop_times)
-
     try:
-        return next(
-            trip for trip in all_trips if trip_serves_station(trip, first) and trip_serves_station(trip, second)
-        )
+        return next(network.get_trips_serving_stations([first, second]))
     except StopIteration as e:
         raise Exception(f"No exemplar trip for {first.name} -> {second.name}") from e
 
 
 def get_shape_between_stations(network: Network, first: Station, second: Station):
     trip_shape = get_exemplar_trip_for_stations(network, first, second).shape
+    shape_points = trip_shape.points if isinstance(trip_shape, ShapeView) else np.array(trip_shape).reshape(-1, 2)
+
+    def get_distances_to_shape(point):
+        return np.sqrt(((shape_points - np.array(point)) ** 2).sum(axis=1))
 
     def closest_point_towards(target, boundary):
-        closest = float("inf")
-        closest_index = None
         target_boundary_distance = get_point_distance(target, boundary)
-        for index, point in enumerate(trip_shape):
-            point_distance = get_point_distance(point, target)
-            if point_distance < closest and get_point_distance(boundary, point) <= target_boundary_distance:
-                closest = point_distance
-                closest_index = index
-        if closest_index is None:
+        within_boundary = get_distances_to_shape(boundary) <= target_boundary_distance
+        distances = np.where(within_boundary, get_distances_to_shape(target), np.inf)
+        if not np.any(np.isfinite(distances)):
             raise Exception("Could not find valid closest point")
-        return closest_index
+        return int(np.argmin(distances))
 
     closest_to_first = closest_point_towards(first.location, second.location)
     closest_to_second = closest_point_towards(second.location, first.location)
@@ -89,6 +83,8 @@ def get_shape_between_stations(network: Network, first: Station, second: Station
 
 
 def get_distances_between_points_km(geo_shape):
+    from geopy.distance import geodesic
+
     res = []
     for p1, p2 in get_pairs(geo_shape):
         res.append(geodesic(p1, p2).km)
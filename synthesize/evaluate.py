@@ -4,7 +4,10 @@ from datetime import timedelta
 
 from network.main import get_gtfs_network
 from network.models import Network, Service, StopTime, Stop, Trip, Route, RoutePattern
+from network.time import to_seconds
 from scheduler.departures import create_departure_getter_for_subgraph
+from scheduler.optimize import SolveStats
+from scheduler.options import SchedulerOptions
 
 import synthesize.definitions as defn
 from synthesize.amenities import Amenities, RR_BASE_AMENITIES
@@ -85,12 +88,12 @@ def _add_time_to_trip(
     route_pattern: defn.RoutePattern,
 ):
     if not previous_stop:
-        return timedelta(seconds=0)
+        return 0
     travel_time = route_pattern.timetable.get_travel_time(
         previous_stop.parent_station.name,
         current_stop.parent_station.name,
     )
-    return timedelta(seconds=int(travel_time))
+    return int(travel_time)
 
 
 def _get_trip(
@@ -112,7 +115,7 @@ def _get_trip(
         shape_id=None,
         shape=None,
     )
-    current_time = departure_time
+    current_time = to_seconds(departure_time)
     previous_stop = None
     for current_stop in _get_stops_in_direction(route_pattern, direction, network):
         current_time += _add_time_to_trip(previous_stop, current_stop, route_pattern)
@@ -126,9 +129,11 @@ def _get_trips_for_subgraph(
     subgraph: List[defn.Route],
     services: List[Service],
     network: Network,
+    options: SchedulerOptions = None,
 ) -> List[Trip]:
     trip_index = 0
-    get_departures = create_departure_getter_for_subgraph(subgraph)
+    stats = SolveStats()
+    get_departures = create_departure_getter_for_subgraph(subgraph, options, stats)
     for service in services:
         departures = get_departures(service)
         for route_pattern, direction, departure_time in departures:
@@ -144,9 +149,11 @@ def _get_trips_for_subgraph(
             )
             trip_index += 1
             yield trip
+    route_ids = "+".join(route.id for route in subgraph)
+    print(f"Scheduled {route_ids}: {stats}")
 
 
-def evaluate_scenario(subgraphs: List[List[defn.Route]]) -> Scenario:
+def evaluate_scenario(subgraphs: List[List[defn.Route]], options: SchedulerOptions = None) -> Scenario:
     services = [Weekdays, Saturday, Sunday]
     real_network = get_gtfs_network()
     pattern_defns = _get_route_pattern_definitions_from_subgraphs(subgraphs)
@@ -163,8 +170,8 @@ def evaluate_scenario(subgraphs: List[List[defn.Route]]) -> Scenario:
         shadowed_route_ids += _get_shadowed_route_ids(subgraph)
         for route in _get_routes_for_subgraph(subgraph, network):
             network.routes_by_id[route.id] = route
-        for trip in _get_trips_for_subgraph(subgraph, services, network):
-            network.trips_by_id[trip.id] = trip
+        for trip in _get_trips_for_subgraph(subgraph, services, network, options):
+            network.add_trip(trip)
     return Scenario(
         services=services,
         real_network=real_network,
@@ -1,6 +1,6 @@
 from typing import Dict
 
-from network.time import time_from_string, time_range_from_string, DAYS_OF_WEEK
+from network.time import seconds_from_string, time_range_from_string, DAYS_OF_WEEK
 from network.models import Service
 
 
@@ -8,7 +8,7 @@ class Timetable(object):
     def __init__(self, str_times_dict: Dict[any, str] = None):
         if str_times_dict:
             self.travel_times = {
-                station_name: time_from_string(time_offset) for (station_name, time_offset) in str_times_dict.items()
+                station_name: seconds_from_string(time_offset) for (station_name, time_offset) in str_times_dict.items()
             }
         else:
             self.travel_times = {}
@@ -20,7 +20,7 @@ class Timetable(object):
         from_time = self.travel_times.get(from_key)
         to_time = self.travel_times.get(to_key)
         if from_time is not None and to_time is not None:
-            return abs(from_time - to_time).seconds
+            return abs(from_time - to_time)
         return None
 
     def map(self, map_keys=None, map_values=None):
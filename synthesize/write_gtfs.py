@@ -4,7 +4,7 @@ import shutil
 import os
 import tarfile
 
-from network.time import DAYS_OF_WEEK, stringify_timedelta
+from network.time import DAYS_OF_WEEK, format_time_column
 from network.models import (
     LocationType,
     Stop,
@@ -30,6 +30,7 @@ class GtfsWriter(object):
         print(f"Writing to {self.directory_path}")
         self.stop_rows = []
         self.stop_time_rows = []
+        self.stop_time_seconds = []
         self.transfer_rows = []
         self.trip_rows = []
         self.route_rows = []
@@ -99,12 +100,13 @@ class GtfsWriter(object):
         )
 
     def add_stop_time(self, stop_time: StopTime):
-        time = stringify_timedelta(stop_time.time)
+        # Times are formatted all at once in write()
+        self.stop_time_seconds.append(stop_time.time)
         self.stop_time_rows.append(
             {
                 "trip_id": stop_time.trip.id,
-                "arrival_time": time,
-                "departure_time": time,
+                "arrival_time": None,
+                "departure_time": None,
                 "stop_id": stop_time.stop.id,
                 "stop_sequence": "",
                 "stop_headsign": "",
@@ -172,7 +174,12 @@ class GtfsWriter(object):
             for row in rows:
                 dict_writer.writerow(row)
 
+    def format_stop_times(self):
+        for row, time in zip(self.stop_time_rows, format_time_column(self.stop_time_seconds)):
+            row["arrival_time"] = row["departure_time"] = str(time)
+
     def write(self):
+        self.format_stop_times()
         if os.path.exists(self.directory_path) and os.path.isdir(self.directory_path):
             shutil.rmtree(self.directory_path)
         os.mkdir(self.directory_path)